@@ -0,0 +1,334 @@
+"""
+DBFarmer v2 - Detection benchmark
+Runs the detector over a labeled corpus of game screenshots and reports
+per-image latency, frames per second and precision / recall per confidence.
+
+Corpus = a folder of screenshots (PNG/JPG) + labels.json:
+    {
+        "frames": {
+            "0001.png": {"SkipButton": [1073, 68], "StorySlide": [960, 900]},
+            "0002.png": {"TapArrow": null},
+            "0003.png": {}
+        }
+    }
+Coordinates are the RELATIVE center of the visible image in the frame
+(null = visible, position not checked). Keys not listed are NOT visible.
+
+Usage:
+    python benchmark.py corpus/
+    python benchmark.py corpus/ --engines single pyramid --colors bgr gray
+    python benchmark.py corpus/ --engines single fft --keys SkipButton TapArrow OkBattleButton
+    python benchmark.py corpus/ --confidences 0.6 0.7 0.75 0.8 0.9 --json out.json
+    python benchmark.py corpus/ --metrics        → with timing histograms on (+ their overhead)
+    python benchmark.py corpus/ --bootstrap      → writes labels.json from current detection
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import cv2
+import numpy as np
+
+from detection import Frame, Detector, RegionIndex, load_templates
+from frame_sources import IMAGE_EXTENSIONS
+from metrics import Metrics
+
+logger = logging.getLogger("DBFarmer")
+
+LABELS_FILE = "labels.json"
+DEFAULT_CONFIDENCES = (0.6, 0.7, 0.75, 0.8, 0.85, 0.9)
+
+# ─────────────────────────────────────────────────────────────
+#  CORPUS
+# ─────────────────────────────────────────────────────────────
+
+def load_corpus(folder: str) -> list[tuple[str, dict]]:
+    """
+    Returns [(frame_path, {key: (x, y) | None}), ...] sorted by file name.
+    Without labels.json every frame is returned with no label.
+    """
+    path = os.path.join(folder, LABELS_FILE)
+    labels = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        labels = data.get("frames", data)
+    else:
+        logger.warning(f"No {LABELS_FILE} in {folder}/ — precision/recall will be meaningless")
+
+    corpus = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        visible = {key: (tuple(pos) if pos else None) for key, pos in labels.get(name, {}).items()}
+        corpus.append((os.path.join(folder, name), visible))
+    return corpus
+
+
+def bootstrap_labels(folder: str, detector: Detector, keys: list, confidence: float = 0.9):
+    """
+    Writes a first labels.json from the current detector at a strict threshold.
+    Meant to be reviewed / corrected by hand before benchmarking.
+    """
+    frames = {}
+    for path, _ in load_corpus(folder):
+        bgr = cv2.imread(path)
+        if bgr is None:
+            continue
+        h, w = bgr.shape[:2]
+        frame = Frame(bgr, (0, 0, w, h))
+        hits  = detector.detect(frame, keys, confidence)
+        frames[os.path.basename(path)] = {k: list(c) for k, (_, c) in hits.items() if c}
+    out = os.path.join(folder, LABELS_FILE)
+    with open(out, "w") as f:
+        json.dump({"frames": frames}, f, indent=2)
+    print(f"  {len(frames)} frames labeled → {out} (review it before benchmarking)")
+
+# ─────────────────────────────────────────────────────────────
+#  RUN
+# ─────────────────────────────────────────────────────────────
+
+def percentile(values, p: float) -> float:
+    return float(np.percentile(values, p)) if len(values) else 0.0
+
+
+def run_benchmark(corpus: list, detector: Detector, keys: list, confidences,
+                  tolerance: int = 10, repeat: int = 1, reference: Detector = None) -> dict:
+    """
+    Scores every key on every frame with detector.match().
+    Latency is measured per key (ms); the per-frame preprocessing
+    (grayscale / downscaled views, FFT spectrum) is reported apart as "(frame prep)".
+    reference → another detector run on the same frames (untimed); the largest
+    score difference per key is reported (engines must agree within ~1e-3).
+    """
+    latencies = {key: [] for key in keys}
+    prep      = []
+    counts    = {c: {key: {"tp": 0, "fp": 0, "fn": 0} for key in keys} for c in confidences}
+    threshold = min(confidences)    # match() only uses it to accept ROI hits / prune peaks
+    total     = 0.0
+    n_frames  = 0
+    diffs     = {key: 0.0 for key in keys}
+
+    for path, visible in corpus:
+        bgr = cv2.imread(path)
+        if bgr is None:
+            logger.warning(f"Could not read {path}")
+            continue
+        h, w = bgr.shape[:2]
+
+        for _ in range(repeat):
+            frame = Frame(bgr, (0, 0, w, h))
+            t0 = time.perf_counter()
+            frame.view(detector.color)
+            if detector.engine == "pyramid":
+                frame.view(detector.color, detector.pyramid_scale)
+            elif detector.engine == "fft":
+                frame.spectrum(detector.color)
+            t1 = time.perf_counter()
+            prep.append((t1 - t0) * 1000)
+
+            results = {}
+            for key in keys:
+                a = time.perf_counter()
+                if detector.metrics is not None:   # same timer as Detector.detect()
+                    with detector.metrics.timer("match", key=key):
+                        results[key] = detector.match(frame, key, threshold)
+                else:
+                    results[key] = detector.match(frame, key, threshold)
+                latencies[key].append((time.perf_counter() - a) * 1000)
+            total += time.perf_counter() - t0
+            n_frames += 1
+
+        if reference is not None:
+            frame = Frame(bgr, (0, 0, w, h))
+            for key in keys:
+                score, _ = reference.match(frame, key, threshold)
+                diffs[key] = max(diffs[key], abs(score - results[key][0]))
+
+        # Precision / recall (detection results are deterministic → last run)
+        for key, (score, rel) in results.items():
+            expected = visible.get(key, False)
+            for c in confidences:
+                found = rel is not None and score >= c
+                if expected is False:
+                    counts[c][key]["fp"] += found
+                    continue
+                if not found:
+                    counts[c][key]["fn"] += 1
+                elif expected is None or (abs(rel[0] - expected[0]) <= tolerance and
+                                          abs(rel[1] - expected[1]) <= tolerance):
+                    counts[c][key]["tp"] += 1
+                else:
+                    # Found in the wrong place: a false hit AND a miss
+                    counts[c][key]["fp"] += 1
+                    counts[c][key]["fn"] += 1
+
+    def stats(values):
+        return {"mean": float(np.mean(values)) if values else 0.0,
+                "p50": percentile(values, 50), "p99": percentile(values, 99), "n": len(values)}
+
+    report = {
+        "engine": detector.engine,
+        "color": detector.color,
+        "regions": detector.regions is not None,
+        "frames": n_frames,
+        "fps": n_frames / total if total else 0.0,
+        "latency_ms": {key: stats(v) for key, v in latencies.items()},
+        "frame_prep_ms": stats(prep),
+        "max_score_diff": diffs if reference is not None else None,
+        "accuracy": {},
+    }
+    for c in confidences:
+        per_key = {}
+        for key, n in counts[c].items():
+            tp, fp, fn = n["tp"], n["fp"], n["fn"]
+            per_key[key] = {
+                **n,
+                "precision": tp / (tp + fp) if tp + fp else None,
+                "recall": tp / (tp + fn) if tp + fn else None,
+            }
+        tp = sum(n["tp"] for n in counts[c].values())
+        fp = sum(n["fp"] for n in counts[c].values())
+        fn = sum(n["fn"] for n in counts[c].values())
+        report["accuracy"][str(c)] = {
+            "precision": tp / (tp + fp) if tp + fp else None,
+            "recall": tp / (tp + fn) if tp + fn else None,
+            "per_key": per_key,
+        }
+    return report
+
+def metrics_overhead(n: int = 20000) -> float:
+    """Cost of one timed block with metrics on (µs), measured on an empty block."""
+    metrics = Metrics()
+    keys = [f"key{i}" for i in range(20)]
+    t0 = time.perf_counter()
+    for i in range(n):
+        pass
+    empty = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for i in range(n):
+        with metrics.timer("match", key=keys[i % 20]):
+            pass
+    return max(0.0, time.perf_counter() - t0 - empty) / n * 1e6
+
+# ─────────────────────────────────────────────────────────────
+#  OUTPUT
+# ─────────────────────────────────────────────────────────────
+
+def _fmt(value) -> str:
+    return "  -  " if value is None else f"{value:.3f}"
+
+
+def print_report(report: dict):
+    name = f"{report['engine']}/{report['color']}" + (" +regions" if report["regions"] else "")
+    print("="*72)
+    print(f"  Engine: {name} | {report['frames']} frames | {report['fps']:.1f} frames/s")
+    print("="*72)
+    print(f"  {'Image':<20} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    p = report["frame_prep_ms"]
+    print(f"  {'(frame prep)':<20} {p['mean']:>9.2f} {p['p50']:>9.2f} {p['p99']:>9.2f}")
+    for key, s in sorted(report["latency_ms"].items(), key=lambda x: -x[1]["mean"]):
+        print(f"  {key:<20} {s['mean']:>9.2f} {s['p50']:>9.2f} {s['p99']:>9.2f}")
+    if report.get("metrics_overhead_us") is not None:
+        means = [s["mean"] for s in report["latency_ms"].values() if s["n"]]
+        per_match = report["metrics_overhead_us"] / 1000
+        share = per_match / np.mean(means) if means else 0.0
+        print(f"  Metrics overhead: {report['metrics_overhead_us']:.1f} µs per timed match "
+              f"({share:.3%} of the mean match)")
+    if report["max_score_diff"]:
+        key, diff = max(report["max_score_diff"].items(), key=lambda x: x[1])
+        print(f"  Max score difference vs single engine: {diff:.5f} ({key})")
+    print()
+    print(f"  {'Confidence':<12} {'precision':>10} {'recall':>10}")
+    for c, acc in report["accuracy"].items():
+        print(f"  {c:<12} {_fmt(acc['precision']):>10} {_fmt(acc['recall']):>10}")
+
+    # Images that are not perfect at some confidence
+    worst = []
+    for c, acc in report["accuracy"].items():
+        for key, n in acc["per_key"].items():
+            if n["fp"] or n["fn"]:
+                worst.append(f"{key}@{c} (fp={n['fp']}, fn={n['fn']})")
+    if worst:
+        print()
+        print("  Errors: " + ", ".join(worst[:20]) + (" ..." if len(worst) > 20 else ""))
+    print()
+
+# ─────────────────────────────────────────────────────────────
+#  MAIN
+# ─────────────────────────────────────────────────────────────
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DBFarmer detection benchmark")
+    parser.add_argument("corpus", help="folder of screenshots + labels.json")
+    parser.add_argument("--images", default="images", help="reference images folder")
+    parser.add_argument("--keys", nargs="*", help="only these images (default: all loaded)")
+    parser.add_argument("--engines", nargs="*", default=["single"], choices=Detector.ENGINES)
+    parser.add_argument("--colors", nargs="*", default=["bgr"], choices=Detector.COLORS)
+    parser.add_argument("--confidences", nargs="*", type=float, default=list(DEFAULT_CONFIDENCES))
+    parser.add_argument("--pyramid-scale", type=float, default=0.5)
+    parser.add_argument("--regions", action="store_true",
+                        help="also run with a region index (warmed up on a first pass)")
+    parser.add_argument("--tolerance", type=int, default=10, help="max position error (px)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per frame (latency only)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="run with timing histograms on and report their overhead")
+    parser.add_argument("--json", help="write the full report(s) to this file")
+    parser.add_argument("--bootstrap", action="store_true",
+                        help="write labels.json from current detection (confidence 0.9) and exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+
+    _, templates, missing = load_templates(args.images, (args.pyramid_scale,))
+    if not templates:
+        print(f"[ERROR] No reference image found in '{args.images}/'")
+        return 1
+    keys = [k for k in (args.keys or templates) if k in templates]
+    if missing:
+        print(f"  Missing images (skipped): {missing}")
+
+    if args.bootstrap:
+        bootstrap_labels(args.corpus, Detector(templates, 0.9), keys)
+        return 0
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"[ERROR] No screenshot found in '{args.corpus}/'")
+        return 1
+
+    reports = []
+    for engine in args.engines:
+        for color in args.colors:
+            for use_regions in ([False, True] if args.regions else [False]):
+                regions = None
+                if use_regions:
+                    # In-memory index, warmed up on one pass so the timed run uses ROIs
+                    regions = RegionIndex(None)
+                detector = Detector(templates, max(args.confidences), regions,
+                                    engine=engine, pyramid_scale=args.pyramid_scale, color=color,
+                                    metrics=Metrics() if args.metrics else None)
+                reference = None
+                if engine != "single" and not use_regions:
+                    reference = Detector(templates, max(args.confidences), color=color)
+                if use_regions:
+                    run_benchmark(corpus, detector, keys, args.confidences, args.tolerance)
+                report = run_benchmark(corpus, detector, keys, args.confidences,
+                                       args.tolerance, args.repeat, reference)
+                if args.metrics:
+                    report["metrics_overhead_us"] = metrics_overhead()
+                print_report(report)
+                reports.append(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"  Report written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
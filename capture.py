@@ -15,6 +15,8 @@ import cv2
 import numpy as np
 from PIL import Image, ImageTk
 
+from detection import OPTIONAL_IMAGES
+
 IMAGE_FOLDER = "images"
 
 # List of all buttons to capture with descriptions
@@ -29,6 +31,7 @@ BUTTONS_TO_CAPTURE = [
     ("startbattle",     "StartBattleButton", "The 'Start Battle' button"),
     ("legendspointer",  "LegendsPointer",    "Any element visible on team selection screen (e.g. 'Details' button)"),
     ("ready",           "ReadyButton",       "The 'Ready' button before combat"),
+    ("slot_selected",   "SlotSelected",      "OPTIONAL: the mark shown on a SELECTED team slot (checkmark, highlight...)"),
     ("finishedpointer", "FinishedPointer",   "End of combat indicator (victory text or icon)"),
     ("tap",             "TapArrow",          "'Tap to continue' arrow after combat (centered at bottom)"),
     ("tap2",            "TapArrow2",         "TAP icon variant (bottom right corner of screen)"),
@@ -201,7 +204,8 @@ class CaptureApp:
 
     def finish(self):
         total   = len(BUTTONS_TO_CAPTURE)
-        missing = [k for f, k, _ in BUTTONS_TO_CAPTURE if not os.path.exists(os.path.join(IMAGE_FOLDER, f+".png"))]
+        missing = [k for f, k, _ in BUTTONS_TO_CAPTURE
+                   if k not in OPTIONAL_IMAGES and not os.path.exists(os.path.join(IMAGE_FOLDER, f+".png"))]
 
         if missing:
             ans = messagebox.askyesno("Missing images",
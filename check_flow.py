@@ -0,0 +1,160 @@
+"""
+DBFarmer v2 - Headless flow check
+Runs the flow actions (DBFarmer._act_<action>) one at a time on the
+simulated game (simulator.py), with the fake input backend, and checks the
+clicks they recorded and the screen the game reached. No emulator, display
+or pyautogui needed: exit code 0 when every step passed.
+
+Each step puts the game on a screen, recognizes it like the flow engine,
+runs the action and compares the recorded clicks with the positions the
+simulator drew the images at. Run with and without the input queue.
+
+Usage:
+    python check_flow.py
+    python check_flow.py --queue on          → input_queue only
+    python check_flow.py -v                  → bot log on the console
+"""
+
+import sys
+import copy
+import time
+import logging
+import argparse
+
+from detection import load_templates
+from input_backends import RecordingInput
+from main import DBFarmer, load_config
+from screens import Screen
+from simulator import LAYOUT, SLOTS, SIM_CONFIG, SimulatedGame
+
+TOLERANCE = 2          # px between a recorded click and the image center
+REACH_TIMEOUT = 5.0    # sec for the game to show the expected screen after an action
+
+
+def at(screen: str, key: str) -> tuple:
+    """Center of an image on a simulated screen."""
+    return LAYOUT[screen][key]
+
+
+# (name, game screen + state, recognized screen, action, expected clicks, screens the game may end on)
+STEPS = [
+    ("open story",    {"screen": "home"},
+     Screen.HOME, "open_story",
+     [at("home", "StoryButton")], ("story_menu",)),
+    ("continue",      {"screen": "story_menu"},
+     Screen.STORY_MENU, "continue_story",
+     [at("story_menu", "ContinueButton")], ("stage", "cinematic")),
+    ("uncheck demo",  {"screen": "stage", "_demo_on": True},
+     Screen.STAGE, "start_battle",
+     [at("stage", "DemoCheckmark"), at("stage", "StartBattleButton")], ("team",)),
+    ("select team",   {"screen": "team", "_selected": set()},
+     Screen.TEAM_SELECT, "select_team",
+     [*SLOTS, at("team", "ReadyButton")], ("combat",)),
+    ("team ready",    {"screen": "team", "_selected": set(range(len(SLOTS)))},
+     Screen.TEAM_SELECT, "select_team",
+     [at("team", "ReadyButton")], ("combat",)),
+    ("taps",          {"screen": "taps", "_taps_left": 2},
+     Screen.POPUP, "dismiss",
+     [at("taps", "TapArrow")] * 2, ("results",)),
+    ("results",       {"screen": "results"},
+     Screen.RESULTS, "results",
+     [at("results", "OkBattleButton"), at("results2", "OkBattleButton"), at("replay", "YesButton")],
+     ("stage", "cinematic")),
+    ("skip",          {"screen": "cinematic"},
+     Screen.CINEMATIC, "skip",
+     [at("cinematic", "SkipButton"), at("skip_confirm", "YesButton")], ("stage", "cinematic")),
+]
+
+
+def show(game: SimulatedGame, state: dict):
+    """Puts the game on a screen right away (no transition in progress)."""
+    with game._lock:
+        game._pending = None
+        game._frozen  = 0.0
+        for name, value in state.items():
+            setattr(game, name, copy.copy(value))   # the game edits it (selected slots)
+
+
+def reached(game: SimulatedGame, screens) -> bool:
+    """Waits until the game shows one of `screens` (and no change is pending)."""
+    end = time.monotonic() + REACH_TIMEOUT
+    while time.monotonic() < end:
+        game.grab()
+        if game.screen in screens and game._pending is None:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def run_steps(farmer: DBFarmer, game: SimulatedGame, inputs: RecordingInput) -> list[str]:
+    """Runs STEPS; returns the failures (empty = every step passed)."""
+    failures = []
+    for name, state, screen, action, expected, ends in STEPS:
+        show(game, state)
+        farmer._last_action = time.monotonic()   # like a click: no capture from before counts
+        recognized = farmer._screen()
+        if recognized.screen is not screen:
+            failures.append(f"{name}: recognized {recognized}, expected {screen.value}")
+            continue
+        done = len(inputs.clicks())
+        ok = getattr(farmer, f"_act_{action}")(recognized)
+        if farmer.input_queue is not None:
+            farmer.input_queue.wait_settled(timeout=REACH_TIMEOUT)
+        clicks = inputs.clicks()[done:]
+
+        problems = []
+        if not ok:
+            problems.append("action returned False")
+        if len(clicks) != len(expected) or any(
+                abs(x - ex) > TOLERANCE or abs(y - ey) > TOLERANCE
+                for (x, y), (ex, ey) in zip(clicks, expected)):
+            problems.append(f"clicks {clicks}, expected {expected}")
+        if not reached(game, ends):
+            problems.append(f"game on {game.screen}, expected {'/'.join(ends)}")
+        print(f"  {'ok  ' if not problems else 'FAIL'} {name:<14} {action:<15} {len(clicks)} click(s)")
+        failures += [f"{name}: {p}" for p in problems]
+    return failures
+
+
+def check(queue: bool, images: dict, templates: dict) -> list[str]:
+    """All the steps on a fresh game and farmer, with or without the input queue."""
+    game = SimulatedGame(images, latency=0.1, team_ready=0.0, demo=0.0, popup=0.0, freeze=0.0)
+    inputs = RecordingInput(game.on_action)
+    config = {**load_config(), **SIM_CONFIG, **game.config(),
+              "events": False, "metrics": False, "region_index": False, "input_queue": queue}
+    farmer = DBFarmer(config, "check", (images, templates), frames=game, inputs=inputs)
+    try:
+        return run_steps(farmer, game, inputs)
+    finally:
+        farmer.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DBFarmer flow actions checked on a simulated game")
+    parser.add_argument("--queue", choices=("off", "on", "both"), default="both",
+                        help="input_queue setting(s) to check (default both)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="bot log on the console")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        for handler in logging.getLogger().handlers:
+            if type(handler) is logging.StreamHandler:
+                handler.setLevel(logging.WARNING)
+
+    config = load_config()
+    images, templates, _ = load_templates(config["image_folder"], (config["pyramid_scale"],),
+                                          bundle=config["template_bundle"])
+    failures = []
+    for queue in {"off": (False,), "on": (True,), "both": (False, True)}[args.queue]:
+        print(f"input_queue {'on' if queue else 'off'}:")
+        failures += [f"[queue {'on' if queue else 'off'}] {f}" for f in check(queue, images, templates)]
+    time.sleep(1.0)   # no frame after stop(): let the detection passes in progress end
+
+    for failure in failures:
+        print(f"  ✗ {failure}")
+    print(f"{'FAILED' if failures else 'OK'}: {len(STEPS)} steps x {1 if args.queue != 'both' else 2}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
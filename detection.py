@@ -0,0 +1,912 @@
+"""
+DBFarmer v2 - Template detection
+Capture once, match any set of images against that single frame.
+"""
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("DBFarmer")
+
+# Image filenames expected in the images/ folder
+# Capture these buttons from your game and save them with these exact names
+IMAGE_FILES = {
+    # ── INITIAL SETUP ──────────────────────────────────────────
+    "StoryButton":      "story.png",          # "Story" button on the home screen
+    "ContinueButton":   "continue.png",       # "Continue" button (resume progress)
+
+    # ── COMBAT SELECTION ───────────────────────────────────────
+    "MissionObject":    "mission.png",        # The level/stage to click
+    "DemoCheckmark":    "demo.png",           # "Play Demo" UNCHECKED (correct state → launch combat)
+    "DemoChecked":      "demo_checked.png",   # "Play Demo" CHECKED yellow (wrong state → click to uncheck)
+    "StartBattleButton":"startbattle.png",    # "Start Battle" button
+    "YesButton":        "yes.png",            # "Yes" / confirmation button
+    "NoButton":         "no.png",             # "No" button (to avoid)
+
+    # ── TEAM SELECTION ─────────────────────────────────────────
+    "LegendsPointer":   "legendspointer.png", # Reference point — signals team selection screen is ready
+    "ReadyButton":      "ready.png",          # "Ready" button
+    "SlotSelected":     "slot_selected.png",  # OPTIONAL: mark of a selected team slot (checked in each slot)
+
+    # ── DURING / END OF COMBAT ─────────────────────────────────
+    "FinishedPointer":  "finishedpointer.png",# End of combat indicator
+    "TapArrow":         "tap.png",            # "Tap to continue" arrow after combat (centered bottom)
+    "TapArrow2":        "tap2.png",           # TAP icon variant (bottom right corner)
+    "OkBattleButton":   "okbattle.png",       # "OK" button on results screen
+    "SkipButton":       "skip.png",           # "Skip" button (skip a cinematic)
+    "RematchButton":    "rematch.png",        # Rematch button (visible only on defeat screen)
+    "QuitBattleButton": "quitbattle.png",     # Quit Battle button (to exit a stuck combat)
+    "InCombatIndicator":"incombat.png",       # AUTO ON button — visible only during combat
+
+    # ── CINEMATIC LEVELS (story slides without combat) ─────────
+    "StorySlide":       "storyslide.png",     # Indicator that we're on a story slide
+
+    # ── NAVIGATION / ANTI-STUCK ────────────────────────────────
+    "BackButton":       "back.png",           # In-game back button
+    "HomeButton":       "home.png",           # In-game home button (returns to home screen)
+}
+
+# Images the bot works without (not reported as missing)
+OPTIONAL_IMAGES = ("SlotSelected",)
+
+# ─────────────────────────────────────────────────────────────
+#  FRAME
+# ─────────────────────────────────────────────────────────────
+
+class Frame:
+    """
+    One capture of the BlueStacks window, converted to BGR once.
+    region = (left, top, width, height) of the window at capture time,
+    used to turn relative hits into ABSOLUTE screen coordinates.
+
+    Every other representation (grayscale, downscaled) is computed on first
+    use and shared by all the matches run on this frame.
+    """
+
+    def __init__(self, bgr, region, timestamp: float = None):
+        self.bgr       = bgr
+        self.region    = region
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        self._views    = {("bgr", 1.0): bgr}
+        self._spectra  = {}
+        self.scene     = None   # set by DetectionCache.scene()
+
+    @classmethod
+    def from_rgb(cls, rgb, region, timestamp: float = None):
+        """Builds a frame from an RGB capture (PIL / ImageGrab order)."""
+        return cls(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), region, timestamp)
+
+    @property
+    def size(self) -> tuple:
+        """(width, height) of the frame in pixels."""
+        h, w = self.bgr.shape[:2]
+        return w, h
+
+    @property
+    def gray(self):
+        """Grayscale view of the frame (converted once)."""
+        return self.view("gray")
+
+    def to_abs(self, rel_x: int, rel_y: int) -> tuple:
+        """Relative frame position → absolute screen position."""
+        return (self.region[0] + rel_x, self.region[1] + rel_y)
+
+    def view(self, mode: str = "bgr", scale: float = 1.0):
+        """
+        Frame in the given color mode ("bgr" / "gray") and scale.
+        Computed once per frame, then served from cache.
+        """
+        img = self._views.get((mode, scale))
+        if img is None:
+            if scale != 1.0:
+                img = cv2.resize(self.view(mode), None, fx=scale, fy=scale,
+                                 interpolation=cv2.INTER_AREA)
+            else:
+                img = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+            self._views[(mode, scale)] = img
+        return img
+
+    def thumbnail(self, size: tuple):
+        """Tiny grayscale (width, height) version of the frame, for change checks (cached)."""
+        img = self._views.get(("thumb", size))
+        if img is None:
+            img = cv2.resize(self.bgr, size, interpolation=cv2.INTER_AREA)
+            img = self._views[("thumb", size)] = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return img
+
+    def spectrum(self, mode: str = "bgr") -> "Spectrum":
+        """Frame-side work of the FFT engine for this color mode (computed once per frame)."""
+        spectrum = self._spectra.get(mode)
+        if spectrum is None:
+            spectrum = self._spectra[mode] = Spectrum(self.view(mode))
+        return spectrum
+
+# ─────────────────────────────────────────────────────────────
+#  TEMPLATE (reference image, preprocessed at load time)
+# ─────────────────────────────────────────────────────────────
+
+class Template:
+    """
+    A reference image with every representation the matcher needs,
+    built once when the image is loaded:
+      (mode, scale) for mode in ("bgr", "gray") and each pyramid scale.
+    """
+
+    def __init__(self, key: str, bgr, scales=(1.0,), views: dict = None):
+        self.key    = key
+        self.bgr    = bgr
+        self.views  = dict(views or {})   # prebuilt views (template bundle)
+        self._fitted = {}
+        self._scaled = {}
+        self._centered = {}
+        for scale in dict.fromkeys((1.0,) + tuple(scales)):
+            for mode in ("bgr", "gray"):
+                if (mode, scale) not in self.views:
+                    self.views[(mode, scale)] = self._build(mode, scale)
+
+    @property
+    def size(self) -> tuple:
+        """(width, height) of the full-resolution image."""
+        h, w = self.bgr.shape[:2]
+        return w, h
+
+    def _build(self, mode: str, scale: float):
+        img = self.bgr if mode == "bgr" else cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        if scale != 1.0:
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return img
+
+    def view(self, mode: str = "bgr", scale: float = 1.0):
+        img = self.views.get((mode, scale))
+        if img is None:
+            img = self.views[(mode, scale)] = self._build(mode, scale)
+        return img
+
+    def centered(self, mode: str = "bgr") -> tuple:
+        """
+        (float32 image minus its per-channel mean, L2 norm of it): the
+        template side of TM_CCOEFF_NORMED, used by the FFT engine.
+        """
+        entry = self._centered.get(mode)
+        if entry is None:
+            img = self.view(mode).astype(np.float32)
+            img = img.reshape(img.shape[0], img.shape[1], -1)
+            img -= img.reshape(-1, img.shape[2]).mean(axis=0)
+            entry = self._centered[mode] = (img, float(np.sqrt((img.astype(np.float64) ** 2).sum())))
+        return entry
+
+    def scaled(self, factor: float) -> "Template":
+        """
+        Same template resized by `factor` (kept once per factor, see ScaleCalibrator).
+        Returns self for 1.0.
+        """
+        if factor == 1.0:
+            return self
+        scaled = self._scaled.get(factor)
+        if scaled is None:
+            tw, th = self.size
+            size = (max(1, round(tw * factor)), max(1, round(th * factor)))
+            interpolation = cv2.INTER_AREA if factor < 1.0 else cv2.INTER_LINEAR
+            scales = tuple(s for _, s in self.views if s != 1.0)
+            scaled = self._scaled[factor] = Template(
+                self.key, cv2.resize(self.bgr, size, interpolation=interpolation), scales)
+        return scaled
+
+    def fit(self, frame_size: tuple) -> "Template":
+        """
+        Same template shrunk to fit a smaller frame (kept once per frame size).
+        Returns self when it already fits.
+        """
+        fw, fh = frame_size
+        tw, th = self.size
+        if tw <= fw and th <= fh:
+            return self
+        fitted = self._fitted.get(frame_size)
+        if fitted is None:
+            logger.warning(f"Template {self.key} larger than screen, resizing...")
+            bgr = cv2.resize(self.bgr, (min(tw, fw-1), min(th, fh-1)))
+            scales = tuple(s for _, s in self.views if s != 1.0)
+            fitted = self._fitted[frame_size] = Template(self.key, bgr, scales)
+        return fitted
+
+# ─────────────────────────────────────────────────────────────
+#  FFT MATCHING (frame spectrum shared by every template)
+# ─────────────────────────────────────────────────────────────
+
+class Spectrum:
+    """
+    Everything TM_CCOEFF_NORMED needs from the frame side, computed once:
+      - the DFT of each channel, zero-padded to an optimal DFT size
+      - integral images (sum per channel, squared sum over channels)
+        giving the mean / variance of any window in O(1)
+
+    match() then costs one forward DFT per template channel and ONE inverse
+    DFT (channels are summed in the frequency domain), instead of
+    matchTemplate redoing the frame-side transforms for every template.
+    """
+
+    def __init__(self, image):
+        img = image.astype(np.float32)
+        img = img.reshape(img.shape[0], img.shape[1], -1)
+        h, w, channels = img.shape
+        self.size  = (w, h)
+        self.shape = (cv2.getOptimalDFTSize(h), cv2.getOptimalDFTSize(w))
+
+        self.channels = []
+        padded = np.zeros(self.shape, np.float32)
+        for c in range(channels):
+            padded[:h, :w] = img[..., c]
+            self.channels.append(cv2.dft(padded))
+
+        self.sums   = []     # one integral per channel (float64: exact window sums)
+        self.sqsums = None   # squared values, summed over the channels
+        for c in range(channels):
+            sums, sqsums = cv2.integral2(img[..., c], sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+            self.sums.append(sums)
+            self.sqsums = sqsums if self.sqsums is None else self.sqsums + sqsums
+        self._deviations = {}
+
+    def _inverse_deviation(self, tw: int, th: int):
+        """
+        1 / sqrt(sum of squared deviations) of every tw x th window, 0 for flat
+        windows (cached per template size).
+        """
+        dev = self._deviations.get((tw, th))
+        if dev is None:
+            def window(s):
+                out = s[th:, tw:] - s[:-th, tw:]
+                out -= s[th:, :-tw]
+                out += s[:-th, :-tw]
+                return out
+            var = window(self.sqsums)
+            for sums in self.sums:
+                mean = window(sums)
+                mean *= mean
+                mean *= 1.0 / (tw * th)
+                var  -= mean
+            flat = var < 0.5   # integer pixels: any non-flat window gives >= ~1, less is rounding
+            var[flat] = 1
+            dev = (1 / np.sqrt(var)).astype(np.float32)
+            dev[flat] = 0
+            self._deviations[(tw, th)] = dev
+        return dev
+
+    def match(self, centered, norm: float):
+        """TM_CCOEFF_NORMED map of a template given by Template.centered()."""
+        th, tw = centered.shape[:2]
+        w, h = self.size
+        total = None
+        for c, spectrum in enumerate(self.channels):
+            padded = np.zeros(self.shape, np.float32)
+            padded[:th, :tw] = centered[..., c]
+            product = cv2.mulSpectrums(spectrum, cv2.dft(padded), 0, conjB=True)
+            total = product if total is None else cv2.add(total, product)
+        corr = cv2.idft(total, flags=cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE)[:h - th + 1, :w - tw + 1]
+
+        if norm == 0:
+            return np.zeros_like(corr)   # flat template: no correlation (same as OpenCV)
+        result = cv2.multiply(corr, self._inverse_deviation(tw, th), scale=1.0 / norm)
+        return np.clip(result, -1.0, 1.0, out=result)   # rounding noise past ±1
+
+# ─────────────────────────────────────────────────────────────
+#  REGION INDEX (where each image usually shows up)
+# ─────────────────────────────────────────────────────────────
+
+class RegionIndex:
+    """
+    Remembers where each image was found, per window size, so the next
+    search can scan a padded crop around those spots instead of the whole frame.
+    Persisted as JSON (regions.json next to config.json) across sessions.
+
+    File layout:
+        {"SkipButton": {"1920x1032": {"size": [tw, th], "spots": [[x, y], ...]}}}
+    Spots are the RELATIVE top-left corners of past matches.
+    path=None keeps the index in memory only.
+    """
+
+    MAX_SPOTS = 4         # distinct positions remembered per image and window size
+    SAVE_INTERVAL = 30.0  # min seconds between two writes to disk
+
+    def __init__(self, path: str | None, padding: int = 40):
+        self.path      = path
+        self.padding   = padding
+        self.regions   = {}
+        self._lock     = threading.Lock()
+        self._dirty    = False
+        self._saved_at = 0.0
+        self.load()
+
+    @staticmethod
+    def _size_key(frame_size: tuple) -> str:
+        return f"{frame_size[0]}x{frame_size[1]}"
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                self.regions = json.load(f)
+            logger.debug(f"Region index loaded from {self.path} ({len(self.regions)} images)")
+        except Exception as e:
+            logger.warning(f"Region index read error: {e} -> starting empty")
+            self.regions = {}
+
+    def save(self, force: bool = False):
+        """Writes the index if it changed (at most every SAVE_INTERVAL unless forced)."""
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            if not force and time.monotonic() - self._saved_at < self.SAVE_INTERVAL:
+                return
+            data = json.dumps(self.regions)
+            self._dirty    = False
+            self._saved_at = time.monotonic()
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Region index write error: {e}")
+
+    def rois(self, key: str, frame_size: tuple, template_size: tuple) -> list:
+        """
+        Padded search boxes (x0, y0, x1, y1) for an image, clipped to the frame.
+        Empty list if the image was never seen at this window size
+        (or the reference image was recaptured with another size).
+        """
+        with self._lock:
+            entry = self.regions.get(key, {}).get(self._size_key(frame_size))
+            if not entry or tuple(entry["size"]) != tuple(template_size):
+                return []
+            spots = list(entry["spots"])
+
+        fw, fh = frame_size
+        tw, th = template_size
+        p = self.padding
+        return [(max(0, x - p), max(0, y - p), min(fw, x + tw + p), min(fh, y + th + p))
+                for x, y in spots]
+
+    def record(self, key: str, frame_size: tuple, template_size: tuple, x: int, y: int):
+        """Stores a match position (relative top-left). Most recent spot first."""
+        with self._lock:
+            per_size = self.regions.setdefault(key, {})
+            size_key = self._size_key(frame_size)
+            entry = per_size.get(size_key)
+            if not entry or tuple(entry["size"]) != tuple(template_size):
+                entry = per_size[size_key] = {"size": list(template_size), "spots": []}
+
+            spots = entry["spots"]
+            for i, (sx, sy) in enumerate(spots):
+                if abs(sx - x) <= self.padding // 2 and abs(sy - y) <= self.padding // 2:
+                    if i == 0:
+                        return  # Same place as last time, nothing new to store
+                    spots.pop(i)
+                    break
+            spots.insert(0, [int(x), int(y)])
+            del spots[self.MAX_SPOTS:]
+            self._dirty = True
+        self.save()
+
+# ─────────────────────────────────────────────────────────────
+#  DETECTION CACHE (no re-matching on an unchanged screen)
+# ─────────────────────────────────────────────────────────────
+
+class DetectionCache:
+    """
+    Reuses match results while the screen does not change.
+
+    Each frame is reduced to a THUMB_SIZE grayscale thumbnail. A frame whose
+    thumbnail is within `tolerance` gray levels of a recent scene on EVERY
+    cell (max difference, not mean: a button appearing only changes a few
+    cells) shows that same scene, and its results come from the cache.
+
+    Invalidation:
+      - any cell changed by more than `tolerance` → new scene, nothing reused
+      - window size changed → new scene
+      - a scene is compared to its FIRST thumbnail, so slow drifts add up
+      - results older than max_age seconds are matched again
+      - clear() when the reference images change
+    LRU of at most `size` results, keyed by (scene, image key, threshold).
+    """
+
+    THUMB_SIZE = (64, 36)
+    MAX_SCENES = 8    # recent scenes a new frame is compared with
+
+    def __init__(self, size: int = 512, tolerance: float = 6, max_age: float = 5.0):
+        self.size      = size
+        self.tolerance = tolerance
+        self.max_age   = max_age
+        self._lock     = threading.Lock()
+        self._results  = OrderedDict()   # (scene, key, threshold) -> (time, (score, rel))
+        self._scenes   = OrderedDict()   # scene -> (frame size, thumbnail)
+        self._next     = 0
+        self.hits = self.misses = self.evictions = self.new_scenes = 0
+
+    def scene(self, frame: Frame) -> int:
+        """Scene id of a frame (new id if it matches no recent scene)."""
+        if frame.scene is not None:
+            return frame.scene
+        thumb = frame.thumbnail(self.THUMB_SIZE).astype(np.int16)
+        with self._lock:
+            for scene, (size, known) in reversed(self._scenes.items()):
+                if size == frame.size and np.abs(thumb - known).max() <= self.tolerance:
+                    self._scenes.move_to_end(scene)
+                    break
+            else:
+                scene = self._next
+                self._next += 1
+                self.new_scenes += 1
+                self._scenes[scene] = (frame.size, thumb)
+                if len(self._scenes) > self.MAX_SCENES:
+                    old, _ = self._scenes.popitem(last=False)
+                    for entry in [e for e in self._results if e[0] == old]:
+                        del self._results[entry]
+        frame.scene = scene
+        return scene
+
+    def get(self, scene: int, key: str, threshold: float) -> tuple | None:
+        """Cached (score, rel) or None (counted as a miss)."""
+        with self._lock:
+            entry = self._results.get((scene, key, threshold))
+            if entry is not None and time.monotonic() - entry[0] <= self.max_age:
+                self._results.move_to_end((scene, key, threshold))
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, scene: int, key: str, threshold: float, result: tuple):
+        with self._lock:
+            self._results[(scene, key, threshold)] = (time.monotonic(), result)
+            self._results.move_to_end((scene, key, threshold))
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Forgets every scene and result (e.g. after reloading the images)."""
+        with self._lock:
+            self._results.clear()
+            self._scenes.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "scenes": self.new_scenes, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+# ─────────────────────────────────────────────────────────────
+#  SCALE CALIBRATION (images captured at another window size)
+# ─────────────────────────────────────────────────────────────
+
+class ScaleCalibrator:
+    """
+    Finds, per window size, the factor to resize the reference images by.
+
+    calibrate() looks for a few anchor images (buttons that are often on
+    screen) over a range of scales: a coarse pass on the half-size gray frame
+    (one step = STEP), then a 1% refinement at full resolution around the best
+    one. The scale is accepted when an anchor scores >= confidence.
+
+    Until a window size is calibrated, scale() returns an estimate: the scale
+    of a calibrated size, proportional to the window width (1.0 if none), and
+    retries at most every `interval` seconds (no anchor may be on screen).
+    `version` changes on every new calibration (cached results become stale).
+    """
+
+    STEP      = 1.08
+    MIN_SCALE = 0.4
+    MAX_SCALE = 2.5
+    COARSE    = 0.5          # frame downscale of the coarse pass
+    FINE      = (0.96, 0.97, 0.98, 0.99, 1.0, 1.01, 1.02, 1.03, 1.04)
+    MIN_SIDE  = 8            # smallest template side (px) worth matching
+    PRIOR_RANGE = 1.25       # coarse range around the estimate when there is one
+
+    def __init__(self, anchors, confidence: float = 0.8, interval: float = 10.0):
+        self.anchors    = list(anchors)
+        self.confidence = confidence
+        self.interval   = interval
+        self.scales     = {}    # frame size -> calibrated scale
+        self.version    = 0
+        self._tried     = {}    # frame size -> time of the last attempt
+        self._lock      = threading.Lock()
+
+    def scale(self, frame: Frame, templates: dict) -> float:
+        """Calibrated scale for the frame size (calibrates when due, estimate meanwhile)."""
+        size = frame.size
+        scale = self.scales.get(size)
+        if scale is not None:
+            return scale
+        now = time.monotonic()
+        if now - self._tried.get(size, -math.inf) >= self.interval and self._lock.acquire(blocking=False):
+            try:
+                self._tried[size] = now
+                scale = self.calibrate(frame, templates, self.estimate(size) if self.scales else None)
+            finally:
+                self._lock.release()
+            if scale is not None:
+                self.scales[size] = scale
+                self.version += 1
+                return scale
+        return self.estimate(size)
+
+    def estimate(self, size: tuple) -> float:
+        """Scale of the calibrated size with the nearest width, proportional to the width."""
+        if not self.scales:
+            return 1.0
+        (w, _), scale = min(self.scales.items(), key=lambda item: abs(item[0][0] - size[0]))
+        return round(scale * size[0] / w, 3)
+
+    def _grid(self, prior: float | None) -> list:
+        """Coarse scales: powers of STEP (1.0 included), around `prior` if given."""
+        low, high = self.MIN_SCALE, self.MAX_SCALE
+        if prior is not None:
+            low, high = max(low, prior / self.PRIOR_RANGE), min(high, prior * self.PRIOR_RANGE)
+        first = math.ceil(math.log(low) / math.log(self.STEP))
+        last  = math.floor(math.log(high) / math.log(self.STEP))
+        return [self.STEP ** k for k in range(first, last + 1)] or [prior or 1.0]
+
+    def _score(self, image, gray, scale: float) -> tuple[float, tuple]:
+        th, tw = gray.shape[:2]
+        size = (round(tw * scale), round(th * scale))
+        if min(size) < self.MIN_SIDE or size[0] > image.shape[1] or size[1] > image.shape[0]:
+            return -1.0, (0, 0)
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+        result = cv2.matchTemplate(image, cv2.resize(gray, size, interpolation=interpolation),
+                                   cv2.TM_CCOEFF_NORMED)
+        _, score, _, loc = cv2.minMaxLoc(result)
+        return score, loc
+
+    def calibrate(self, frame: Frame, templates: dict, prior: float = None) -> float | None:
+        """Best scale for this frame, or None if no anchor is recognized."""
+        start = time.perf_counter()
+        small = frame.view("gray", self.COARSE)
+        best_score, best_key, best_scale = -1.0, None, None
+        for key in self.anchors:
+            template = templates.get(key)
+            if template is None:
+                continue
+            gray = template.view("gray")
+            for scale in self._grid(prior):
+                score, _ = self._score(small, gray, scale * self.COARSE)
+                if score > best_score:
+                    best_score, best_key, best_scale = score, key, scale
+            if best_score >= self.confidence:
+                break   # clearly on screen: no need to try the other anchors
+        if best_key is None:
+            return None
+
+        image = frame.view("gray")
+        gray  = templates[best_key].view("gray")
+        score, scale = max((self._score(image, gray, best_scale * f)[0], best_scale * f) for f in self.FINE)
+        elapsed = time.perf_counter() - start
+        if score < self.confidence:
+            logger.debug(f"Scale calibration: no anchor found ({best_key} {score:.2f}, {elapsed:.2f}s)")
+            return None
+        scale = 1.0 if abs(scale - 1.0) < 0.015 else round(scale, 3)
+        w, h = frame.size
+        logger.info(f"Scale calibration: {w}x{h} → x{scale:g} ({best_key} {score:.2f}, {elapsed:.2f}s)")
+        return scale
+
+# ─────────────────────────────────────────────────────────────
+#  DETECTOR
+# ─────────────────────────────────────────────────────────────
+
+class Detector:
+    """
+    Matches reference images against a Frame with TM_CCOEFF_NORMED.
+    detect() scores every requested key on the SAME frame and returns
+    {key: (score, coords)} — coords are absolute, None if below threshold.
+
+    Engines for the full-frame search:
+      "single"  → one matchTemplate at full resolution (reference behaviour)
+      "pyramid" → coarse match on a downscaled frame, then full-resolution
+                  refinement around the best peaks only
+      "fft"     → every template correlated against ONE frame spectrum
+                  (Frame.spectrum), same scores as "single" within ~1e-3
+    color = "bgr" (reference behaviour) or "gray" (one channel, ~3x less work).
+    cache = optional DetectionCache: unchanged frames reuse earlier results.
+    calibrator = optional ScaleCalibrator: images resized to the window size.
+    metrics = optional metrics.Metrics: time of every match, per image ("match").
+    """
+
+    ENGINES = ("single", "pyramid", "fft")
+    COLORS  = ("bgr", "gray")
+    PYRAMID_MIN_SIZE = 12   # smallest downscaled template side (px) still worth a coarse pass
+
+    def __init__(self, templates: dict, confidence: float, regions: RegionIndex = None,
+                 engine: str = "single", pyramid_scale: float = 0.5,
+                 pyramid_candidates: int = 3, pyramid_margin: float = 0.15,
+                 color: str = "bgr", cache: DetectionCache = None, metrics=None,
+                 calibrator: ScaleCalibrator = None):
+        if engine not in self.ENGINES:
+            logger.warning(f"Unknown match engine '{engine}' -> using 'single'")
+            engine = "single"
+        if color not in self.COLORS:
+            logger.warning(f"Unknown match color '{color}' -> using 'bgr'")
+            color = "bgr"
+        self.templates  = templates     # key -> Template (shared with DBFarmer)
+        self.confidence = confidence
+        self.regions    = regions       # optional RegionIndex (ROI-first search)
+        self.cache      = cache         # optional DetectionCache (unchanged frames)
+        self.metrics    = metrics       # optional metrics.Metrics
+        self.calibrator = calibrator    # optional ScaleCalibrator
+        self._calibration = 0           # calibrator.version the cache was filled with
+        self.engine     = engine
+        self.color      = color
+        self.pyramid_scale      = pyramid_scale
+        self.pyramid_candidates = pyramid_candidates
+        self.pyramid_margin     = pyramid_margin   # coarse peaks this far below threshold are still refined
+
+    def _match_full(self, image, template) -> tuple[float, tuple]:
+        """Single TM_CCOEFF_NORMED pass. Returns (score, top-left)."""
+        result = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        return max_val, max_loc
+
+    def _match_pyramid(self, frame: Frame, template: Template, threshold: float) -> tuple[float, tuple]:
+        """
+        Coarse-to-fine search. Returns (score, top-left) like _match_full.
+        The coarse pass only picks WHERE to look: every returned score comes from
+        a full-resolution TM_CCOEFF_NORMED refinement, so thresholds mean the same.
+        Falls back to _match_full when the template is too small to downscale.
+        """
+        s     = self.pyramid_scale
+        image = frame.view(self.color)
+        tpl   = template.view(self.color)
+        tw, th = template.size
+        if min(tw, th) * s < self.PYRAMID_MIN_SIZE:
+            return self._match_full(image, tpl)
+
+        small_img = frame.view(self.color, s)
+        small_tpl = template.view(self.color, s)
+        sth, stw = small_tpl.shape[:2]
+        if sth > small_img.shape[0] or stw > small_img.shape[1]:
+            return self._match_full(image, tpl)
+
+        coarse = cv2.matchTemplate(small_img, small_tpl, cv2.TM_CCOEFF_NORMED)
+        sw, sh = frame.size
+        m = int(round(1 / s)) + 2       # refinement margin around a peak (px, full res)
+        floor = threshold - self.pyramid_margin
+
+        best_score, best_loc = -1.0, (0, 0)
+        for i in range(self.pyramid_candidates):
+            _, peak, _, (px, py) = cv2.minMaxLoc(coarse)
+            if i > 0 and peak < floor:
+                break   # The best peak is always refined, the others only if plausible
+
+            # Refine around the peak at full resolution
+            cx, cy = int(round(px / s)), int(round(py / s))
+            x0, y0 = max(0, cx - m), max(0, cy - m)
+            x1, y1 = min(sw, cx + tw + m), min(sh, cy + th + m)
+            if x1 - x0 >= tw and y1 - y0 >= th:
+                score, loc = self._match_full(image[y0:y1, x0:x1], tpl)
+                if score > best_score:
+                    best_score, best_loc = score, (x0 + loc[0], y0 + loc[1])
+
+            # Suppress this peak before looking for the next one
+            coarse[max(0, py - sth // 2):py + sth // 2 + 1,
+                   max(0, px - stw // 2):px + stw // 2 + 1] = -1.0
+
+        return best_score, best_loc
+
+    def _match_fft(self, frame: Frame, template: Template) -> tuple[float, tuple]:
+        """Full-frame TM_CCOEFF_NORMED through the frame spectrum. Returns (score, top-left)."""
+        result = frame.spectrum(self.color).match(*template.centered(self.color))
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+        return max_val, max_loc
+
+    def template(self, key: str, frame: Frame) -> Template | None:
+        """
+        The image as it is matched on this frame: resized to the calibrated
+        scale (with a calibrator), shrunk if larger than the frame. None if not loaded.
+        """
+        template = self.templates.get(key)
+        if template is None:
+            return None
+        if self.calibrator is not None:
+            template = template.scaled(self.calibrator.scale(frame, self.templates))
+        return template.fit(frame.size)
+
+    def match(self, frame: Frame, key: str, threshold: float = None) -> tuple[float, tuple | None]:
+        """
+        Best match of one image in the frame.
+        Returns (score, (rel_x, rel_y)) — the RELATIVE center of the match,
+        or (0.0, None) if the image is not loaded.
+
+        With a region index, the padded crops where the image was seen before
+        are searched first; a score >= threshold there is accepted as is,
+        otherwise the whole frame is searched.
+        """
+        template = self.template(key, frame)
+        if template is None:
+            return 0.0, None
+        threshold = self.confidence if threshold is None else threshold
+
+        frame_size = frame.size
+        tw, th = template.size
+        image = frame.view(self.color)
+        tpl   = template.view(self.color)
+
+        # ── 1. Known spots first ───────────────────────────────
+        if self.regions is not None:
+            for x0, y0, x1, y1 in self.regions.rois(key, frame_size, (tw, th)):
+                if x1 - x0 < tw or y1 - y0 < th:
+                    continue
+                score, loc = self._match_full(image[y0:y1, x0:x1], tpl)
+                if score >= threshold:
+                    x, y = x0 + loc[0], y0 + loc[1]
+                    self.regions.record(key, frame_size, (tw, th), x, y)
+                    return score, (x + tw // 2, y + th // 2)
+
+        # ── 2. Full frame ──────────────────────────────────────
+        if self.engine == "pyramid":
+            score, (x, y) = self._match_pyramid(frame, template, threshold)
+        elif self.engine == "fft":
+            score, (x, y) = self._match_fft(frame, template)
+        else:
+            score, (x, y) = self._match_full(image, tpl)
+        if self.regions is not None and score >= threshold:
+            self.regions.record(key, frame_size, (tw, th), x, y)
+        return score, (x + tw // 2, y + th // 2)
+
+    def detect(self, frame: Frame, keys, confidence: float = None, use_cache: bool = True) -> dict:
+        """
+        Scores every key on the same frame.
+        Returns {key: (score, coords)} with ABSOLUTE coords, or None if below threshold.
+        use_cache=False → matched again, for states the cache cannot see change
+        (a checkbox toggling moves a thumbnail cell by less than its tolerance).
+        """
+        threshold = self.confidence if confidence is None else confidence
+        if self.calibrator is not None:
+            self.calibrator.scale(frame, self.templates)   # calibrates when due
+            if self.cache is not None and self._calibration != self.calibrator.version:
+                self._calibration = self.calibrator.version
+                self.cache.clear()   # results matched at the previous scale
+        scene = self.cache.scene(frame) if self.cache is not None and use_cache else None
+        hits = {}
+        for key in keys:
+            result = None if scene is None else self.cache.get(scene, key, threshold)
+            if result is None:
+                if self.metrics is not None:
+                    with self.metrics.timer("match", key=key):
+                        result = self.match(frame, key, threshold)
+                else:
+                    result = self.match(frame, key, threshold)
+                if scene is not None:
+                    self.cache.put(scene, key, threshold, result)
+            score, rel = result
+            if rel is not None and score >= threshold:
+                coords = frame.to_abs(*rel)
+                logger.debug(f"Found [{key}] confidence={score:.2f} pos=({coords[0]},{coords[1]})")
+                hits[key] = (score, coords)
+            else:
+                hits[key] = (score, None)
+        return hits
+
+# ─────────────────────────────────────────────────────────────
+#  LOADING
+# ─────────────────────────────────────────────────────────────
+
+# Preprocessed templates of an image folder, rebuilt when an image changes
+TEMPLATE_BUNDLE = ".templates.npz"
+BUNDLE_VERSION  = 1
+
+
+def _bundle_signature(folder: str, scales, files: dict) -> dict:
+    """What the bundle was built from: file sizes / mtimes and pyramid scales."""
+    stats = {}
+    for key, filename in files.items():
+        try:
+            st = os.stat(os.path.join(folder, filename))
+            stats[key] = [filename, st.st_mtime_ns, st.st_size]
+        except OSError:
+            stats[key] = None
+    return {"version": BUNDLE_VERSION, "scales": [float(s) for s in scales], "files": stats}
+
+
+def _read_bundle(path: str, signature: dict):
+    """(images, templates, missing) from the bundle, or None if absent / outdated."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["signature"] != signature:
+                return None
+            blob = data["blob"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Template bundle unreadable ({e}), rebuilding")
+        return None
+
+    # Every view is a slice of the single blob (no copy)
+    images, templates, missing = {}, {}, []
+    for key, stat in signature["files"].items():
+        index = meta["templates"].get(key)
+        if stat is None or index is None:
+            missing.append(key)
+            continue
+        views = {}
+        for mode, scale, offset, shape in index:
+            size = int(np.prod(shape))
+            views[(mode, scale)] = blob[offset:offset + size].reshape(shape)
+        images[key]    = views[("bgr", 1.0)]
+        templates[key] = Template(key, images[key], views=views)
+    return images, templates, missing
+
+
+def _write_bundle(path: str, signature: dict, templates: dict):
+    """One uint8 blob with every view + a JSON index (key -> [mode, scale, offset, shape])."""
+    chunks, index, offset = [], {}, 0
+    for key, template in templates.items():
+        index[key] = []
+        for (mode, scale), view in template.views.items():
+            chunks.append(np.ascontiguousarray(view, dtype=np.uint8).ravel())
+            index[key].append([mode, scale, offset, list(view.shape)])
+            offset += view.size
+    meta = {"signature": signature, "templates": index}
+    tmp = path + ".tmp.npz"
+    try:
+        np.savez(tmp, meta=np.array(json.dumps(meta)),   # uncompressed: loading is a plain read
+                 blob=np.concatenate(chunks) if chunks else np.zeros(0, np.uint8))
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not write the template bundle: {e}")
+
+
+def load_templates(folder: str, scales=(1.0,), files: dict = None,
+                   bundle: bool = False, workers: int = 8) -> tuple[dict, dict, list]:
+    """
+    Reads the reference images of `files` (default IMAGE_FILES) from folder.
+    Returns (images, templates, missing):
+      images    → key -> BGR image as read from disk
+      templates → key -> preprocessed Template
+      missing   → keys whose file is absent or unreadable (except OPTIONAL_IMAGES)
+    With `bundle`, the preprocessed templates are read from <folder>/.templates.npz
+    while no image changed (written after decoding otherwise).
+    Images are decoded and preprocessed in `workers` threads.
+    """
+    files = IMAGE_FILES if files is None else files
+    scales = tuple(dict.fromkeys((1.0,) + tuple(scales)))
+    if bundle:
+        path = os.path.join(folder, TEMPLATE_BUNDLE)
+        signature = _bundle_signature(folder, scales, files)
+        loaded = _read_bundle(path, signature)
+        if loaded is not None:
+            logger.debug(f"Templates read from {path}")
+            images, templates, missing = loaded
+            return images, templates, [k for k in missing if k not in OPTIONAL_IMAGES]
+
+    def read(item):
+        key, filename = item
+        path = os.path.join(folder, filename)
+        if not os.path.exists(path):
+            return key, None
+        img = cv2.imread(path)   # decoding releases the GIL
+        if img is None:
+            logger.warning(f"Could not read image: {filename}")
+            return key, None
+        logger.debug(f"Image loaded: {key} ({filename})")
+        return key, Template(key, img, scales)
+
+    images, templates, missing = {}, {}, []
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        for key, template in pool.map(read, files.items()):
+            if template is None:
+                if key not in OPTIONAL_IMAGES:
+                    missing.append(key)
+            else:
+                images[key]    = template.bgr
+                templates[key] = template
+    if bundle:
+        _write_bundle(path, signature, templates)
+    return images, templates, missing
@@ -0,0 +1,102 @@
+"""
+DBFarmer v2 - Event stream
+Typed events of a run, one JSON object per line (logs/<session>.events.jsonl),
+read back by report.py.
+
+Every event has:
+    type      → one of EVENT_TYPES
+    t         → monotonic clock (sec): orders events and measures gaps in a session
+    time      → wall clock (unix sec), for humans
+    session   → session id (log file name), instance → farmer name
+    duration  → sec, or null when the event is instantaneous
+plus its own fields, e.g.
+    {"type": "combat_finished", "t": 5231.4, "time": 1760783231.2,
+     "session": "2026-10-18_13-21-37", "instance": "main", "duration": 112.3, "learned": true}
+"""
+
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger("DBFarmer")
+
+EVENT_TYPES = (
+    "session_start",      # config
+    "session_end",
+    "level_detected",     # kind: "combat" / "cinematic"
+    "level_completed",    # kind; duration = cycle time (since the previous level completed)
+    "combat_started",     # rematch: bool
+    "combat_finished",    # duration = since the Ready / Rematch click; learned: False if joined midway
+    "defeat",
+    "rematch",
+    "recovery",           # reason, start / end screen, steps; duration = time lost
+    "anti_stuck_fix",     # fix: "tap" / "recovery_request", reason
+    "click",              # x, y
+)
+
+# ─────────────────────────────────────────────────────────────
+#  WRITER
+# ─────────────────────────────────────────────────────────────
+
+class EventLog:
+    """Appends events to a JSONL file (thread-safe, one flushed line per event)."""
+
+    def __init__(self, path: str, session: str, instance: str = "main"):
+        self.path     = path
+        self.session  = session
+        self.instance = instance
+        self._lock    = threading.Lock()
+        self._file    = open(path, "a", encoding="utf-8")
+
+    def emit(self, type: str, duration: float = None, **fields):
+        if type not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type '{type}'")
+        event = {
+            "type": type, "t": round(time.monotonic(), 3), "time": round(time.time(), 3),
+            "session": self.session, "instance": self.instance,
+            "duration": None if duration is None else round(duration, 3),
+            **fields,
+        }
+        line = json.dumps(event, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._file.write(line + "\n")
+                self._file.flush()
+            except Exception as e:
+                logger.warning(f"Event write error: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+# ─────────────────────────────────────────────────────────────
+#  READER
+# ─────────────────────────────────────────────────────────────
+
+def read_events(paths) -> dict:
+    """
+    Reads JSONL event files → {(session, instance): [event, ...]} sorted by t.
+    Unreadable lines (e.g. a line cut by a crash) are skipped.
+    """
+    sessions = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"{path}:{n}: unreadable event skipped")
+                    continue
+                key = (event.get("session", path), event.get("instance", "main"))
+                sessions.setdefault(key, []).append(event)
+    for events in sessions.values():
+        events.sort(key=lambda e: e["t"])
+    return sessions
@@ -0,0 +1,270 @@
+"""
+DBFarmer v2 - Flow engine
+The farming flow as a transition table: screen → action → expected next
+screens. The engine runs it, times every transition and recovers by
+walking the shortest path from wherever the game currently is.
+"""
+
+import time
+import logging
+from collections import deque
+
+import numpy as np
+
+from screens import Screen, ScreenState
+
+logger = logging.getLogger("DBFarmer")
+
+# ─────────────────────────────────────────────────────────────
+#  TRANSITION TABLE
+# ─────────────────────────────────────────────────────────────
+
+class Transition:
+    """
+    One edge of the flow: on `source` run `action`, then wait up to
+    `timeout` seconds for one of the `targets` screens.
+
+      exclusive → anti-stuck stays paused while the edge runs (combat, results)
+      cycle_end → finishing this edge completes a level
+      recovery  → only used to get back on track, never in the normal flow;
+                  any other known screen counts as arrived (the recovery
+                  re-plans from there)
+    """
+
+    def __init__(self, source, action: str, targets, timeout: float,
+                 exclusive: bool = False, cycle_end: bool = False, recovery: bool = False):
+        self.sources   = tuple(source) if isinstance(source, (tuple, list)) else (source,)
+        self.action    = action
+        self.targets   = tuple(targets)
+        self.timeout   = timeout
+        self.exclusive = exclusive
+        self.cycle_end = cycle_end
+        self.recovery  = recovery
+
+    def label(self, source: Screen) -> str:
+        return f"{source.value}:{self.action}"
+
+    def __repr__(self):
+        return f"<{'/'.join(s.value for s in self.sources)} --{self.action}--> " \
+               f"{'/'.join(s.value for s in self.targets)}>"
+
+# ─────────────────────────────────────────────────────────────
+#  ENGINE
+# ─────────────────────────────────────────────────────────────
+
+class FlowEngine:
+    """
+    Runs a transition table.
+
+      actions    → {action name: callable(ScreenState) -> bool}
+      recognize  → callable(screens=None) -> ScreenState (one capture)
+      wait       → callable(screens, timeout) -> ScreenState | None
+      requested  → callable() -> bool, True once when an external recovery
+                   request (anti-stuck) is pending
+      metrics    → optional metrics.Metrics: every transition is observed as
+                   "transition" {transition, result="ok"/"failed"}
+      events     → optional events.EventLog: one "recovery" event per recovery
+      settle     → optional callable(timeout): returns once the screen stopped
+                   moving (at most timeout sec); default = sleep(timeout)
+
+    Normal flow: take the (non-recovery) edge of the current screen.
+    Recovery: recognize the screen, then follow the shortest path to a screen
+    whose normal edge can be retried (a failed edge is retried once before it
+    is routed around; HOME after max_failures failed edges in a row),
+    re-planning after every step.
+    """
+
+    MAX_SAMPLES = 200   # durations kept per transition
+
+    def __init__(self, transitions, actions: dict, recognize, wait, requested,
+                 max_failures: int = 3, max_recovery_steps: int = 15, metrics=None, events=None,
+                 settle=None):
+        self.transitions = list(transitions)
+        self.actions     = actions
+        self.recognize   = recognize
+        self.wait        = wait
+        self.requested   = requested
+        self.max_failures       = max_failures
+        self.max_recovery_steps = max_recovery_steps
+        self.metrics            = metrics
+        self.events             = events
+        self.settle             = settle or time.sleep
+
+        self.known = tuple(dict.fromkeys(
+            s for edge in self.transitions for s in edge.sources + edge.targets
+            if s is not Screen.UNKNOWN
+        ))
+        self.forward = {}
+        for edge in self.transitions:
+            if edge.action not in actions:
+                raise ValueError(f"No action for transition {edge}")
+            for source in edge.sources:
+                if not edge.recovery:
+                    if source in self.forward:
+                        raise ValueError(f"Two normal transitions from {source.value}")
+                    self.forward[source] = edge
+
+        self.exclusive  = False   # True while an exclusive edge runs
+        self.previous   = None    # action of the last edge taken
+        self.failures   = 0       # failed edges since the last completed level
+        self.retried    = None    # failed edge already given its retry
+        self.recoveries = 0
+        self.timings    = {}      # label -> deque of seconds (successful transitions)
+        self._cycle     = []      # (label, seconds) since the last completed level
+        self._cycle_start = None
+
+    # ── Planning ───────────────────────────────────────────────
+
+    def path(self, source: Screen, goals, avoid=None) -> list | None:
+        """
+        Shortest list of edges from `source` to any screen in `goals`
+        (breadth-first; an edge is assumed to reach any of its targets).
+        `avoid` is an edge that must not be taken first. [] if already there.
+        """
+        if source in goals:
+            return []
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            screen = queue.popleft()
+            for edge in self.transitions:
+                if screen not in edge.sources or (screen == source and edge is avoid):
+                    continue
+                for target in edge.targets:
+                    if target in previous:
+                        continue
+                    previous[target] = (screen, edge)
+                    if target in goals:
+                        steps = []
+                        while previous[target]:
+                            target, step = previous[target]
+                            steps.append(step)
+                        return steps[::-1]
+                    queue.append(target)
+        return None
+
+    # ── Execution ──────────────────────────────────────────────
+
+    def take(self, edge: Transition, state: ScreenState) -> ScreenState | None:
+        """Runs one edge. Returns the screen reached, None on failure."""
+        label = edge.label(state.screen)
+        targets = edge.targets
+        if edge.recovery:
+            targets = tuple(s for s in self.known if s != state.screen)
+        logger.debug(f"Transition {label} → {'/'.join(s.value for s in edge.targets)}")
+        start = time.monotonic()
+        self.exclusive = edge.exclusive
+        try:
+            reached = None
+            if self.actions[edge.action](state):
+                reached = self.wait(targets, edge.timeout)
+        finally:
+            self.exclusive = False
+            self.previous  = edge.action
+        duration = time.monotonic() - start
+        if self.metrics is not None:
+            self.metrics.observe("transition", duration, transition=label,
+                                 result="failed" if reached is None else "ok")
+
+        if reached is None:
+            self.failures += 1
+            logger.warning(f"Transition {label} failed after {duration:.1f}s")
+            return None
+
+        if edge is self.retried:
+            self.retried = None
+        self.timings.setdefault(label, deque(maxlen=self.MAX_SAMPLES)).append(duration)
+        self._cycle.append((label, duration))
+        logger.info(f"{label} → {reached.screen.value} in {duration:.1f}s")
+        if edge.cycle_end:
+            self._end_cycle()
+        return reached
+
+    def _end_cycle(self):
+        self.failures = 0
+        self.retried  = None
+        now = time.monotonic()
+        if self._cycle_start is not None:
+            parts = " | ".join(f"{label} {seconds:.1f}s" for label, seconds in self._cycle)
+            logger.info(f"Cycle {now - self._cycle_start:.1f}s: {parts}")
+        self._cycle = []
+        self._cycle_start = now
+
+    def recover(self, failed: Transition = None, reason: str = "failed") -> ScreenState:
+        """
+        Gets back to a screen the normal flow can continue from.
+        `failed` = the edge that just failed: its source stays a goal once
+                   (the edge is retried), the next time it fails it is routed around.
+        reason   = why ("failed", "requested", "unknown_screen"), for the event stream.
+        """
+        logger.warning("═══ RECOVERY ═══")
+        self.recoveries += 1
+        self.requested()   # this recovery answers any pending request
+        start = time.monotonic()
+        state = first = self.recognize()
+        steps = 0
+        avoid = failed
+        if failed is not None and failed is not self.retried:
+            self.retried = failed
+            avoid = None
+
+        def done(state: ScreenState) -> ScreenState:
+            if self.events is not None:
+                self.events.emit("recovery", time.monotonic() - start, reason=reason,
+                                 failed=failed.action if failed else None,
+                                 start=first.screen.value, end=state.screen.value, steps=steps)
+            return state
+
+        for _ in range(self.max_recovery_steps):
+            if self.failures >= self.max_failures:
+                goals = {Screen.HOME}
+            else:
+                goals = {s for s, edge in self.forward.items() if edge is not avoid}
+            if state.screen in goals:
+                if goals == {Screen.HOME}:
+                    self.failures = 0
+                logger.info(f"Recovery: {'retrying' if self.forward.get(state.screen) is failed else 'resuming'} "
+                            f"from {state.screen.value}")
+                return done(state)
+
+            route = self.path(state.screen, goals, avoid)
+            if route is None:
+                if state.screen in self.forward:
+                    logger.info(f"Recovery: no other way out of {state.screen.value} → retrying")
+                    return done(state)
+                logger.warning(f"Recovery: no path from {state.screen.value}")
+                self.settle(1.0)
+                state = self.recognize()
+                continue
+            logger.info(f"Recovery: {state.screen.value} → {' → '.join(edge.action for edge in route)}")
+            state = self.take(route[0], state) or self.recognize()
+            steps += 1
+
+        logger.error("Recovery: no known screen reached after multiple attempts")
+        return done(state)
+
+    def run(self):
+        """Runs the flow forever (until interrupted by an exception)."""
+        state = self.recognize()
+        while True:
+            if self.requested():
+                logger.warning("Recovery requested by anti-stuck → handling")
+                state = self.recover(reason="requested")
+                continue
+            edge = self.forward.get(state.screen)
+            if edge is None:
+                state = self.recover(reason="unknown_screen")
+                continue
+            reached = self.take(edge, state)
+            state = reached if reached is not None else self.recover(edge)
+
+    # ── Report ─────────────────────────────────────────────────
+
+    def timing_report(self) -> list[str]:
+        """One line per transition: count, mean, p50, p95 (seconds)."""
+        lines = []
+        for label, values in sorted(self.timings.items(), key=lambda x: -sum(x[1])):
+            v = np.array(values)
+            lines.append(f"{label:<28} n={len(v):<4} mean={v.mean():6.1f}s "
+                         f"p50={np.percentile(v, 50):6.1f}s p95={np.percentile(v, 95):6.1f}s")
+        return lines
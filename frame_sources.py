@@ -0,0 +1,548 @@
+"""
+DBFarmer v2 - Frame sources
+Where frames come from: live window capture (ImageGrab / mss) or a replay
+of recorded frames, so the detection stack can run without an emulator.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+import cv2
+import numpy as np
+
+from detection import Frame
+
+logger = logging.getLogger("DBFarmer")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+TIMESTAMPS_FILE  = "timestamps.json"   # {"000001.png": 0.0, ...} seconds since start
+
+# ─────────────────────────────────────────────────────────────
+#  INTERFACE
+# ─────────────────────────────────────────────────────────────
+
+class FrameSource:
+    """
+    Produces Frames on demand.
+    grab() returns a Frame or None when no frame could be captured.
+    """
+
+    name = "base"
+
+    def grab(self) -> Frame | None:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+# ─────────────────────────────────────────────────────────────
+#  WINDOW GEOMETRY
+# ─────────────────────────────────────────────────────────────
+
+class WindowTracker:
+    """
+    Cached (left, top, width, height) of the emulator window.
+
+    Enumerating every window by title (pyautogui.getWindowsWithTitle) is slow,
+    so the geometry is only re-read every `refresh_interval` seconds, from the
+    window handle we already have; the title lookup only runs when that handle
+    is lost. invalidate() forces a refresh on the next call (capture failure,
+    size mismatch, window moved by us).
+    """
+
+    MISSING_RETRY = 0.5   # min seconds between two lookups while the window is missing
+
+    def __init__(self, title: str, find_windows, window=None, refresh_interval: float = 2.0):
+        self.title            = title
+        self.find_windows     = find_windows    # title -> [window, ...] (pyautogui.getWindowsWithTitle)
+        self.window           = window
+        self.refresh_interval = refresh_interval
+        self._region     = None
+        self._checked_at = float("-inf")
+        self._lock       = threading.Lock()
+
+    def region(self) -> tuple | None:
+        with self._lock:
+            age = time.monotonic() - self._checked_at
+            limit = self.refresh_interval if self._region else self.MISSING_RETRY
+            if age >= limit:
+                self._refresh()
+            return self._region
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = float("-inf")
+
+    @staticmethod
+    def _rect(win) -> tuple | None:
+        region = (win.left, win.top, win.width, win.height)
+        return region if region[2] > 0 and region[3] > 0 else None
+
+    def _refresh(self):
+        region = None
+        if self.window is not None:
+            try:
+                region = self._rect(self.window)
+            except Exception:
+                self.window = None
+        if region is None:
+            try:
+                wins = self.find_windows(self.title)
+                if wins:
+                    self.window = wins[0]
+                    region = self._rect(self.window)
+            except Exception as e:
+                logger.debug(f"Window lookup error: {e}")
+        if region != self._region:
+            logger.debug(f"Window geometry: {self._region} → {region}")
+        self._region     = region
+        self._checked_at = time.monotonic()
+
+# ─────────────────────────────────────────────────────────────
+#  LIVE CAPTURE
+# ─────────────────────────────────────────────────────────────
+
+class ImageGrabSource(FrameSource):
+    """
+    PIL.ImageGrab over the window bbox (reference backend).
+    get_region() → (left, top, width, height) or None if the window is gone.
+    """
+
+    name = "imagegrab"
+
+    def __init__(self, get_region):
+        from PIL import ImageGrab
+        self._grab_image = ImageGrab.grab
+        self.get_region  = get_region
+
+    def grab(self) -> Frame | None:
+        region = self.get_region()
+        if region is None:
+            return None
+        l, t, w, h = region
+        img = self._grab_image(bbox=(l, t, l+w, t+h))
+        return Frame.from_rgb(np.array(img), region)
+
+
+class MssSource(FrameSource):
+    """
+    Region capture with the mss library (pip install mss).
+    Much cheaper than ImageGrab on Windows: BitBlt of the window area only.
+    One mss handle per thread (mss handles are not thread-safe).
+    """
+
+    name = "mss"
+
+    def __init__(self, get_region):
+        import mss
+        self._mss       = mss
+        self._local     = threading.local()
+        self.get_region = get_region
+
+    def _handle(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = self._local.sct = self._mss.mss()
+        return sct
+
+    def grab(self) -> Frame | None:
+        region = self.get_region()
+        if region is None:
+            return None
+        l, t, w, h = region
+        shot = self._handle().grab({"left": l, "top": t, "width": w, "height": h})
+        bgr = cv2.cvtColor(np.asarray(shot), cv2.COLOR_BGRA2BGR)
+        return Frame(bgr, region)
+
+    def close(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is not None:
+            sct.close()
+            self._local.sct = None
+
+# ─────────────────────────────────────────────────────────────
+#  REPLAY (recorded frames)
+# ─────────────────────────────────────────────────────────────
+
+class ReplaySource(FrameSource):
+    """
+    Plays back a recording instead of capturing the screen:
+      - a directory of images (sorted by name), with optional timestamps.json
+        {"000001.png": 0.0, "000002.png": 0.48, ...} — default spacing 1/fps
+      - a video file (timestamps from the container)
+
+    speed = 0    → every grab() returns the next frame (as fast as possible)
+    speed = 1.0  → frames follow the recorded timing (real time)
+    speed = 4.0  → 4x faster than real time (frames in between are skipped)
+    At the end: start over if loop=True, else grab() returns None.
+
+    region = (left, top, width, height) reported with each frame
+    (defaults to (0, 0, frame width, frame height)).
+    """
+
+    name = "replay"
+
+    def __init__(self, path: str, speed: float = 0.0, loop: bool = True,
+                 fps: float = 2.0, region: tuple = None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Replay source not found: {path}")
+        self.path   = path
+        self.speed  = speed
+        self.loop   = loop
+        self.fps    = fps
+        self._region = tuple(region) if region else None
+        self._lock  = threading.Lock()
+        self._index = -1
+        self._start = None
+        self._cap   = None
+        self._cap_next = None   # (timestamp, bgr) read ahead from the video
+
+        if os.path.isdir(path):
+            files = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+            if not files:
+                raise FileNotFoundError(f"No images in replay directory: {path}")
+            self.files = files
+            self.timestamps = self._load_timestamps(path, files, fps)
+        else:
+            self.files = None
+            self._open_video()
+
+        logger.info(f"Replay source: {path} (speed={speed or 'max'}, loop={loop})")
+
+    @staticmethod
+    def _load_timestamps(path: str, files: list, fps: float) -> list:
+        ts_path = os.path.join(path, TIMESTAMPS_FILE)
+        if os.path.exists(ts_path):
+            with open(ts_path, "r") as f:
+                known = json.load(f)
+            if all(name in known for name in files):
+                return [float(known[name]) for name in files]
+            logger.warning(f"{TIMESTAMPS_FILE} incomplete → using {fps} fps")
+        return [i / fps for i in range(len(files))]
+
+    @property
+    def region(self) -> tuple | None:
+        return self._region
+
+    def __len__(self):
+        if self.files is not None:
+            return len(self.files)
+        return int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # ── Directory playback ─────────────────────────────────────
+
+    def _target_index(self) -> int | None:
+        """Index of the frame to show now, or None when the recording is over."""
+        n = len(self.files)
+        if self.speed <= 0:
+            index = self._index + 1
+        else:
+            if self._start is None:
+                self._start = time.monotonic()
+            elapsed = (time.monotonic() - self._start) * self.speed
+            duration = self.timestamps[-1] + 1 / self.fps
+            if self.loop:
+                elapsed %= duration
+            elif elapsed >= duration:
+                return None
+            index = int(np.searchsorted(self.timestamps, elapsed, side="right")) - 1
+            index = max(index, 0)
+        if index >= n:
+            if not self.loop:
+                return None
+            index = 0
+        return index
+
+    def _read_image(self, index: int) -> Frame | None:
+        bgr = cv2.imread(os.path.join(self.path, self.files[index]))
+        if bgr is None:
+            logger.warning(f"Replay: could not read {self.files[index]}")
+            return None
+        return self._frame(bgr)
+
+    # ── Video playback ─────────────────────────────────────────
+
+    def _open_video(self):
+        if self._cap is not None:
+            self._cap.release()
+        self._cap = cv2.VideoCapture(self.path)
+        if not self._cap.isOpened():
+            raise IOError(f"Cannot open replay video: {self.path}")
+        self._cap_next = None
+
+    def _read_video(self) -> tuple | None:
+        """Next (timestamp, bgr) from the video, rewinding if looping."""
+        ok, bgr = self._cap.read()
+        if not ok:
+            if not self.loop:
+                return None
+            self._open_video()
+            ok, bgr = self._cap.read()
+            if not ok:
+                return None
+        return self._cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, bgr
+
+    def _next_video_frame(self) -> Frame | None:
+        if self.speed <= 0:
+            item = self._read_video()
+            return self._frame(item[1]) if item else None
+
+        # Real-time(ish) playback: skip frames until the recorded clock catches up
+        if self._start is None:
+            self._start = time.monotonic()
+        elapsed = (time.monotonic() - self._start) * self.speed
+        current = self._cap_next or self._read_video()
+        if current is None:
+            return None
+        while True:
+            ahead = self._read_video()
+            if ahead is None or ahead[0] > elapsed:
+                self._cap_next = ahead
+                break
+            if ahead[0] < current[0]:
+                # Rewound (loop): restart the clock from this frame
+                self._cap_next = ahead
+                self._start = time.monotonic()
+                break
+            current = ahead
+        return self._frame(current[1])
+
+    # ── Common ─────────────────────────────────────────────────
+
+    def _frame(self, bgr) -> Frame:
+        h, w = bgr.shape[:2]
+        region = self._region or (0, 0, w, h)
+        self._region = region
+        return Frame(bgr, region)
+
+    def grab(self) -> Frame | None:
+        with self._lock:
+            if self.files is None:
+                return self._next_video_frame()
+            index = self._target_index()
+            if index is None:
+                return None
+            self._index = index
+            return self._read_image(index)
+
+    def close(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+# ─────────────────────────────────────────────────────────────
+#  RECORDER (builds replay directories from a live source)
+# ─────────────────────────────────────────────────────────────
+
+class RecordingSource(FrameSource):
+    """
+    Wraps another source and saves one frame every `interval` seconds
+    into out_dir (numbered PNGs + timestamps.json), ready for ReplaySource.
+    """
+
+    def __init__(self, inner: FrameSource, out_dir: str, interval: float = 0.5):
+        self.inner    = inner
+        self.name     = f"{inner.name}+record"
+        self.out_dir  = out_dir
+        self.interval = interval
+        self._count   = 0
+        self._start   = None
+        self._last    = 0.0
+        self._stamps  = {}
+        self._lock    = threading.Lock()
+        os.makedirs(out_dir, exist_ok=True)
+        logger.info(f"Recording frames to {out_dir}/ every {interval}s")
+
+    @property
+    def region(self) -> tuple | None:
+        """Region of the wrapped source (replay: the recorded window, read by DBFarmer)."""
+        return getattr(self.inner, "region", None)
+
+    def grab(self) -> Frame | None:
+        frame = self.inner.grab()
+        if frame is None:
+            return None
+        with self._lock:
+            if self._start is None:
+                self._start = frame.timestamp
+                self._last  = frame.timestamp - self.interval
+            if frame.timestamp - self._last >= self.interval:
+                self._last = frame.timestamp
+                self._count += 1
+                name = f"{self._count:06d}.png"
+                cv2.imwrite(os.path.join(self.out_dir, name), frame.bgr)
+                self._stamps[name] = round(frame.timestamp - self._start, 3)
+                if self._count % 20 == 0:
+                    self._write_stamps()
+        return frame
+
+    def _write_stamps(self):
+        with open(os.path.join(self.out_dir, TIMESTAMPS_FILE), "w") as f:
+            json.dump(self._stamps, f, indent=1)
+
+    def close(self):
+        with self._lock:
+            self._write_stamps()
+        self.inner.close()
+
+# ─────────────────────────────────────────────────────────────
+#  CAPTURE SERVICE (one producer thread shared by every consumer)
+# ─────────────────────────────────────────────────────────────
+
+class CaptureService:
+    """
+    The only thread that calls source.grab(). Frames land in a small ring
+    buffer, stamped with the time their capture STARTED.
+
+    Capture is on demand: the thread grabs while a consumer waits for a
+    newer frame, at most `fps` times per second, so the main loop and the
+    anti-stuck thread asking at the same moment share ONE capture instead
+    of fighting over ImageGrab. Nobody waiting → no capture.
+
+        latest()                 → newest frame (no wait, may be old)
+        wait_newer(after, ...)   → first frame captured after `after`
+        grab(after, max_age)     → fresh frame, never the same twice per thread
+        frames()                 → buffered frames, oldest first
+    """
+
+    FAILURE_RETRY = 0.2   # seconds before retrying a capture that returned nothing
+
+    def __init__(self, source: FrameSource, fps: float = 5.0, buffer_size: int = 8,
+                 thread_name: str = "capture"):
+        self.source   = source
+        self.name     = f"{source.name}+service"
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self._buffer  = deque(maxlen=max(1, buffer_size))
+        self._cond    = threading.Condition()
+        self._waiting = 0            # consumers blocked in wait_newer()
+        self._failed  = -1.0         # start time of the last capture that returned nothing
+        self._stopped = False
+        self._seen    = threading.local()   # per-thread timestamp of the last frame handed out
+        self._thread  = threading.Thread(target=self._run, name=thread_name, daemon=True)
+        self._thread.start()
+
+    # ── Producer ───────────────────────────────────────────────
+
+    def _run(self):
+        last = 0.0
+        while True:
+            with self._cond:
+                while not self._stopped and not self._waiting:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+            delay = last + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            start = time.monotonic()
+            last  = start
+            try:
+                frame = self.source.grab()
+            except Exception as e:
+                logger.error(f"Capture error: {e}")
+                frame = None
+            with self._cond:
+                if frame is None:
+                    self._failed = start
+                else:
+                    frame.timestamp = start
+                    self._buffer.append(frame)
+                self._cond.notify_all()
+            if frame is None:
+                time.sleep(self.FAILURE_RETRY)
+
+    # ── Consumers ──────────────────────────────────────────────
+
+    def latest(self) -> Frame | None:
+        with self._cond:
+            return self._buffer[-1] if self._buffer else None
+
+    def frames(self) -> list[Frame]:
+        with self._cond:
+            return list(self._buffer)
+
+    def wait_newer(self, after: float, timeout: float = 5.0) -> Frame | None:
+        """
+        Returns the newest frame captured after `after` (monotonic time),
+        waiting for the producer if needed. None on timeout or if a capture
+        started after the request came back empty.
+        """
+        requested = time.monotonic()
+        deadline  = requested + timeout
+        with self._cond:
+            if self._buffer and self._buffer[-1].timestamp > after:
+                return self._buffer[-1]
+            self._waiting += 1
+            self._cond.notify_all()
+            try:
+                while True:
+                    if self._buffer and self._buffer[-1].timestamp > after:
+                        return self._buffer[-1]
+                    remaining = deadline - time.monotonic()
+                    if self._stopped or remaining <= 0 or self._failed >= requested:
+                        return None
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def grab(self, after: float = 0.0, max_age: float = None) -> Frame | None:
+        """
+        Frame captured after `after` (e.g. the last click), at most `max_age`
+        seconds old (default: one capture interval) and never a frame this
+        thread already got, so polling loops never re-check the same image.
+        """
+        if max_age is None:
+            max_age = max(self.interval, 0.1)
+        seen  = getattr(self._seen, "timestamp", -1.0)
+        frame = self.wait_newer(max(after, seen, time.monotonic() - max_age))
+        if frame is not None:
+            self._seen.timestamp = frame.timestamp
+        return frame
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout=2.0)
+        self.source.close()
+
+# ─────────────────────────────────────────────────────────────
+#  FACTORY
+# ─────────────────────────────────────────────────────────────
+
+CAPTURE_BACKENDS = ("imagegrab", "mss", "replay")
+
+def make_frame_source(config: dict, get_region) -> FrameSource:
+    """
+    Builds the source selected by config["capture_backend"].
+    "mss" falls back to "imagegrab" if the mss package is not installed.
+    """
+    backend = config.get("capture_backend", "imagegrab")
+    if backend not in CAPTURE_BACKENDS:
+        logger.warning(f"Unknown capture backend '{backend}' -> using 'imagegrab'")
+        backend = "imagegrab"
+
+    if backend == "replay":
+        source = ReplaySource(
+            config["replay_path"],
+            speed=config.get("replay_speed", 0.0),
+            loop=config.get("replay_loop", True),
+        )
+    elif backend == "mss":
+        try:
+            source = MssSource(get_region)
+        except ImportError:
+            logger.warning("mss not installed (pip install mss) -> using 'imagegrab'")
+            source = ImageGrabSource(get_region)
+    else:
+        source = ImageGrabSource(get_region)
+
+    if config.get("record_frames_dir"):
+        source = RecordingSource(source, config["record_frames_dir"],
+                                 config.get("record_interval", 0.5))
+    logger.info(f"Capture backend: {source.name}")
+    return source
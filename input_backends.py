@@ -0,0 +1,218 @@
+"""
+DBFarmer v2 - Input backends
+Where clicks and key presses go: the real mouse / keyboard (pyautogui) or a
+recording fake, so the control flow can run headless (replays, simulator,
+CI). InputQueue sends them from a background thread: the next screen is
+captured and matched while a click and its delay are still running.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger("DBFarmer")
+
+# ─────────────────────────────────────────────────────────────
+#  INTERFACE
+# ─────────────────────────────────────────────────────────────
+
+class InputBackend:
+    """
+    Sends input to the game.
+      click(x, y)            → left click at an ABSOLUTE screen position
+      press(key, window)     → key press; window = the window to focus first (or None)
+    """
+
+    name = "base"
+
+    def click(self, x: int, y: int):
+        raise NotImplementedError
+
+    def press(self, key: str, window=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+# ─────────────────────────────────────────────────────────────
+#  BACKENDS
+# ─────────────────────────────────────────────────────────────
+
+class PyAutoGuiInput(InputBackend):
+    """Real mouse and keyboard (reference backend). Mouse to top-left corner = emergency stop."""
+
+    name = "pyautogui"
+
+    def __init__(self):
+        import pyautogui
+        pyautogui.FAILSAFE = True
+        pyautogui.PAUSE    = 0.05
+        self._gui = pyautogui
+
+    def click(self, x: int, y: int):
+        self._gui.click(x, y)
+
+    def press(self, key: str, window=None):
+        # Keys go to the focused window: make sure it is ours
+        if window is not None:
+            try:
+                window.activate()
+            except Exception:
+                pass
+        self._gui.press(key)
+
+
+class RecordingInput(InputBackend):
+    """
+    Sends nothing: records every action as (time, kind, args), e.g.
+    (12.5, "click", (845, 631)), for tests, replays and the simulator.
+    on_action(kind, *args) is called for each one (e.g. a simulated game).
+    Keeps the last `size` actions.
+    """
+
+    name = "fake"
+
+    def __init__(self, on_action=None, size: int = 10000):
+        self.on_action = on_action
+        self.actions   = deque(maxlen=size)
+
+    def _record(self, kind: str, *args):
+        self.actions.append((time.monotonic(), kind, args))
+        if self.on_action is not None:
+            self.on_action(kind, *args)
+
+    def click(self, x: int, y: int):
+        self._record("click", x, y)
+
+    def press(self, key: str, window=None):
+        self._record("press", key)
+
+    def clicks(self) -> list:
+        """[(x, y), ...] of the recorded clicks, oldest first."""
+        return [args for _, kind, args in self.actions if kind == "click"]
+
+# ─────────────────────────────────────────────────────────────
+#  DISPATCH QUEUE
+# ─────────────────────────────────────────────────────────────
+
+class InputQueue:
+    """
+    Sends the actions of a backend from one thread, in submission order.
+
+        submit("click", x, y, delay=0.5)   → returns at once
+        wait_sent()                        → blocks until every submitted action was sent
+        wait_settled()                     → ... and until `delay` after the last one
+
+    After an action, the next one waits `delay` seconds (the click_delay the
+    caller used to sleep). The screen must only be captured again once
+    wait_settled() returns: before that, the game may not have reacted to
+    the click yet. So only the click calls themselves leave the caller's
+    thread, not the delay (opt-in: "input_queue").
+    lock = input lock shared by the farmers of the process (one action at a time).
+    on_sent(kind, sent_at, seconds) is called after each action.
+    """
+
+    def __init__(self, backend: InputBackend, lock, on_sent=None, thread_name: str = "input"):
+        self.backend  = backend
+        self.lock     = lock
+        self.on_sent  = on_sent
+        self._pending = deque()
+        self._cond    = threading.Condition()
+        self._busy    = False       # an action is being sent
+        self._ready   = 0.0         # monotonic time the next action may be sent
+        self._stopped = False
+        self._thread  = threading.Thread(target=self._run, name=thread_name, daemon=True)
+        self._thread.start()
+
+    def submit(self, kind: str, *args, delay: float = 0.0):
+        with self._cond:
+            if self._stopped:
+                return
+            self._pending.append((kind, args, delay))
+            self._cond.notify_all()
+
+    def wait_sent(self, timeout: float = None) -> bool:
+        """True once nothing is pending or being sent (False on timeout)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def wait_settled(self, timeout: float = None) -> float | None:
+        """
+        Blocks until every submitted action was sent AND its `delay` passed.
+        Returns that time (monotonic; captures must be taken after it), None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                left = None if deadline is None else deadline - time.monotonic()
+                if not self._cond.wait_for(lambda: not self._pending and not self._busy, left):
+                    return None
+                now = time.monotonic()
+                if self._ready <= now:
+                    return self._ready
+                if deadline is not None and deadline <= now:
+                    return None
+                wait = self._ready - now
+                self._cond.wait(wait if deadline is None else min(wait, deadline - now))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopped)
+                if self._stopped:
+                    return
+                kind, args, delay = self._pending.popleft()
+                self._busy = True
+                wait = self._ready - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            start = time.perf_counter()
+            try:
+                with self.lock:
+                    getattr(self.backend, kind)(*args)
+            except Exception as e:
+                logger.error(f"Input error ({kind} {args}): {e}")
+            sent_at = time.monotonic()
+            if self.on_sent is not None:
+                self.on_sent(kind, sent_at, time.perf_counter() - start)
+            with self._cond:
+                self._busy  = False
+                self._ready = sent_at + delay
+                self._cond.notify_all()
+
+    def close(self):
+        """Stops the thread. Actions not sent yet are dropped."""
+        with self._cond:
+            self._stopped = True
+            dropped = len(self._pending)
+            self._pending.clear()
+            self._cond.notify_all()
+        if dropped:
+            logger.debug(f"Input queue closed, {dropped} action(s) dropped")
+        self._thread.join(timeout=2.0)
+        self.backend.close()
+
+# ─────────────────────────────────────────────────────────────
+#  FACTORY
+# ─────────────────────────────────────────────────────────────
+
+INPUT_BACKENDS = ("auto", "pyautogui", "fake")
+
+def make_input_backend(config: dict) -> InputBackend:
+    """
+    Builds the backend selected by config["input_backend"].
+    "auto" = pyautogui for live capture, fake (recording) for a replay:
+    a recording must not click on the desktop.
+    """
+    backend = config.get("input_backend", "auto")
+    if backend not in INPUT_BACKENDS:
+        logger.warning(f"Unknown input backend '{backend}' -> using 'auto'")
+        backend = "auto"
+    if backend == "auto":
+        backend = "fake" if config.get("capture_backend") == "replay" else "pyautogui"
+
+    inputs = RecordingInput() if backend == "fake" else PyAutoGuiInput()
+    logger.info(f"Input backend: {inputs.name}")
+    return inputs
@@ -4,19 +4,33 @@ Modernized for BlueStacks 5 based on the original DBFarmer by LUXTACO
 Compatible: BlueStacks 5, Windows 10/11, Python 3.8+
 """
 
+import time
+_IMPORT_START = time.perf_counter()   # startup breakdown (see DBFarmer.__init__)
 import os
 import sys
 import json
-import time
 import logging
 import datetime
+import collections
 import threading
-import tkinter as tk
-from tkinter import ttk
-import pyautogui
+import contextlib
 import cv2
 import numpy as np
-from PIL import ImageGrab
+
+from detection import Frame, Detector, DetectionCache, RegionIndex, ScaleCalibrator, load_templates
+from frame_sources import CaptureService, FrameSource, WindowTracker, make_frame_source
+from screens import Screen, ScreenRecognizer, ScreenState
+from flow import Transition, FlowEngine
+from metrics import Metrics, MetricsExporter
+from events import EventLog
+from input_backends import InputBackend, InputQueue, make_input_backend
+
+try:
+    import pyautogui   # window lookup (+ mouse / keyboard, see input_backends.py)
+except Exception:      # no display (headless Linux): replay capture + fake input only
+    pyautogui = None
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
 
 # ─────────────────────────────────────────────────────────────
 #  DEFAULT CONFIGURATION
@@ -25,18 +39,64 @@ from PIL import ImageGrab
 DEFAULT_CONFIG = {
     "window_name": "BlueStacks App Player",   # BlueStacks 5 window title
     "image_folder": "images",                  # Reference images folder
+    "template_bundle": True,                   # Keep preprocessed images in <image_folder>/.templates.npz (faster startup)
     "confidence": 0.75,                        # Detection threshold (0.0 to 1.0)
     "loop_delay": 1.0,                         # Delay between each check (sec)
+    "poll_min": 0.1,                           # Fastest polling interval, right after an action (sec)
+    "poll_backoff": 1.5,                       # Polling interval growth per check (up to loop_delay)
     "click_delay": 0.5,                        # Delay after a click (sec)
-    "anti_stuck_delay": 60.0,                  # Anti-stuck interval (sec)
+    "input_backend": "auto",                   # "auto", "pyautogui" or "fake" (records, sends nothing)
+    "input_queue": False,                      # Send input from a thread (the caller does not wait for the click itself)
+    "anti_stuck_delay": 60.0,                  # Anti-stuck screen check (TAP, unknown screen) interval (sec)
+    "stall_seconds": 45.0,                     # Screen static for N sec = game stuck (> longest flow wait, 30 s)
+    "stall_check_interval": 1.0,               # Motion sample interval (sec)
+    "stall_motion": 0.1,                       # Min weighted mean change (gray levels) that counts as motion
+    "stall_regions": [],                       # [{"rect": [x0, y0, x1, y1], "weight": 0}] (0-1 of the window), e.g. ignore an animated corner
+    "settle_time": 0.3,                        # Screen still for N sec after an action = transition over
+    "settle_motion": 0.5,                      # Max weighted mean change (gray levels) of a still screen
     "max_tries": 15,                           # Max attempts per button
     "combat_timeout": 600,                     # Max combat duration (sec) = 10 min
+    "combat_adaptive": True,                   # Learn combat durations, check cheaply until near the end
+    "combat_slow_interval": 3.0,               # Early combat: AUTO ON check every N sec
+    "combat_fast_interval": 0.3,               # Near expected end: FinishedPointer check every N sec
+    "combat_lead": 5.0,                        # Start fast checks N sec before the earliest expected end
+    "combat_min_samples": 3,                   # Combats to observe before trusting the learned durations
     "overlay_enabled": True,                   # Show overlay
     "log_level": "INFO",
+    "window_refresh_interval": 2.0,            # Re-read the window position/size every N sec
+    "region_index": True,                      # Search first where each image was found before
+    "region_padding": 40,                      # Margin around a known spot (px)
+    "match_engine": "single",                  # "single" (full resolution), "pyramid" (coarse-to-fine) or "fft" (batched)
+    "pyramid_scale": 0.5,                      # Downscale factor of the coarse pyramid pass
+    "pyramid_candidates": 3,                   # Coarse peaks refined at full resolution
+    "match_color": "bgr",                      # "bgr" (full color) or "gray" (faster, 1 channel)
+    "detection_cache": False,                  # Reuse results while the screen does not change (misses small changes)
+    "detection_cache_size": 512,               # Max cached results (LRU)
+    "detection_cache_tolerance": 6,            # Max gray level change per thumbnail cell for "unchanged"
+    "detection_cache_max_age": 5.0,            # Cached results are matched again after N sec
+    "scale_calibration": False,                # Resize the images to the window size (captured at another resolution)
+    "calibration_anchors": ["StoryButton", "HomeButton", "BackButton",
+                            "SkipButton", "InCombatIndicator", "OkBattleButton"],  # Images used to find the scale
+    "calibration_interval": 10.0,              # Retry interval while no anchor is on screen (sec)
+    "metrics": True,                           # Time screenshots, matches, clicks and transitions
+    "metrics_file": "",                        # Write the timings (Prometheus text format) to this file
+    "metrics_port": 0,                         # Serve them on http://127.0.0.1:<port>/metrics (0 = off)
+    "metrics_interval": 15.0,                  # metrics_file rewrite interval (sec)
+    "events": True,                            # Write typed events to logs/<session>.events.jsonl (python report.py)
+    "capture_backend": "imagegrab",            # "imagegrab", "mss" (faster, pip install mss) or "replay"
+    "replay_path": "",                         # Replay: folder of PNGs (+ timestamps.json) or a video file
+    "replay_speed": 0.0,                       # Replay: 0 = as fast as possible, 1.0 = real time, 4.0 = 4x
+    "replay_loop": True,                       # Replay: start over at the end of the recording
+    "record_frames_dir": "",                   # If set, save captured frames there (replayable)
+    "record_interval": 0.5,                    # Seconds between two recorded frames
+    "capture_service": True,                   # One capture thread shared by the main loop and anti-stuck
+    "capture_fps": 5.0,                        # Capture service: max captures per second (0 = no limit)
+    "capture_buffer": 8,                       # Capture service: recent frames kept in memory
     "skip_position": {
         "x_pct": 0.82,   # X position as % of window width (0.82 = 82% = right side)
         "y_pct": 0.05    # Y position as % of window height (0.05 = 5% = top)
     },
+    "team_slot_radius": 40,                    # Area checked around each team slot (px)
     "team_slots": [
         {"x": 845, "y": 631},
         {"x": 945, "y": 631},
@@ -48,71 +108,72 @@ DEFAULT_CONFIG = {
 }
 
 CONFIG_PATH = "config.json"
+REGIONS_PATH = os.path.join(os.path.dirname(CONFIG_PATH), "regions.json")  # learned search regions
 LOG_DIR = "logs"
 
-# Image filenames expected in the images/ folder
-# Capture these buttons from your game and save them with these exact names
-IMAGE_FILES = {
-    # ── INITIAL SETUP ──────────────────────────────────────────
-    "StoryButton":      "story.png",          # "Story" button on the home screen
-    "ContinueButton":   "continue.png",       # "Continue" button (resume progress)
-
-    # ── COMBAT SELECTION ───────────────────────────────────────
-    "MissionObject":    "mission.png",        # The level/stage to click
-    "DemoCheckmark":    "demo.png",           # "Play Demo" UNCHECKED (correct state → launch combat)
-    "DemoChecked":      "demo_checked.png",   # "Play Demo" CHECKED yellow (wrong state → click to uncheck)
-    "StartBattleButton":"startbattle.png",    # "Start Battle" button
-    "YesButton":        "yes.png",            # "Yes" / confirmation button
-    "NoButton":         "no.png",             # "No" button (to avoid)
-
-    # ── TEAM SELECTION ─────────────────────────────────────────
-    "LegendsPointer":   "legendspointer.png", # Reference point — signals team selection screen is ready
-    "ReadyButton":      "ready.png",          # "Ready" button
-
-    # ── DURING / END OF COMBAT ─────────────────────────────────
-    "FinishedPointer":  "finishedpointer.png",# End of combat indicator
-    "TapArrow":         "tap.png",            # "Tap to continue" arrow after combat (centered bottom)
-    "TapArrow2":        "tap2.png",           # TAP icon variant (bottom right corner)
-    "OkBattleButton":   "okbattle.png",       # "OK" button on results screen
-    "SkipButton":       "skip.png",           # "Skip" button (skip a cinematic)
-    "RematchButton":    "rematch.png",        # Rematch button (visible only on defeat screen)
-    "QuitBattleButton": "quitbattle.png",     # Quit Battle button (to exit a stuck combat)
-    "InCombatIndicator":"incombat.png",       # AUTO ON button — visible only during combat
-
-    # ── CINEMATIC LEVELS (story slides without combat) ─────────
-    "StorySlide":       "storyslide.png",     # Indicator that we're on a story slide
-
-    # ── NAVIGATION / ANTI-STUCK ────────────────────────────────
-    "BackButton":       "back.png",           # In-game back button
-    "HomeButton":       "home.png",           # In-game home button (returns to home screen)
-}
+# Team slots are now configured directly in config.json under "team_slots"
 
-# Priority for anti-stuck (higher number = higher priority)
-PRIORITY_LIST = {
-    "SkipButton":        15,
-    "ArrowObject":       13,
-    "TapArrow":          11,
-    "TapArrow2":         11,
-    "QuitBattleButton":  10,
-    "NoButton":          10,
-    "YesButton":          9,
-    "StartBattleButton":  8,
-    "DemoCheckmark":      7,
-    "OkBattleButton":     6,
-    "ReadyButton":        5,
-    "StoryButton":        3,
-    "ContinueButton":     1,
-    "MissionObject":      0,
-}
+# ─────────────────────────────────────────────────────────────
+#  FARMING FLOW
+# ─────────────────────────────────────────────────────────────
 
-# Team slots are now configured directly in config.json under "team_slots"
+KNOWN_SCREENS = tuple(s for s in Screen if s is not Screen.UNKNOWN)
+
+# screen → action (DBFarmer._act_<action>) → expected next screens, max wait (sec)
+FARMING_FLOW = (
+    Transition(Screen.HOME,        "open_story",     (Screen.STORY_MENU,),                           60),
+    Transition(Screen.STORY_MENU,  "continue_story", (Screen.STAGE, Screen.CINEMATIC, Screen.POPUP), 60),
+    Transition(Screen.POPUP,       "dismiss",        [s for s in KNOWN_SCREENS if s is not Screen.POPUP], 15),
+    Transition(Screen.STAGE,       "start_battle",   (Screen.TEAM_SELECT,),                          30),
+    Transition(Screen.TEAM_SELECT, "select_team",    (Screen.COMBAT,),                               60),
+    Transition(Screen.COMBAT,      "fight",          (Screen.RESULTS, Screen.DEFEAT, Screen.POPUP),  30, exclusive=True),
+    Transition(Screen.DEFEAT,      "rematch",        (Screen.COMBAT,),                               60, exclusive=True),
+    Transition(Screen.RESULTS,     "results",        (Screen.STAGE, Screen.CINEMATIC),               30, exclusive=True, cycle_end=True),
+    Transition(Screen.CINEMATIC,   "skip",           (Screen.STAGE, Screen.CINEMATIC),               30, cycle_end=True),
+
+    # Recovery only (shortest path back to a screen the flow can continue from)
+    Transition(Screen.TEAM_SELECT, "back",           (Screen.STAGE,),                                15, recovery=True),
+    Transition(Screen.UNKNOWN,     "back",           KNOWN_SCREENS,                                  5,  recovery=True),
+    Transition((Screen.STAGE, Screen.TEAM_SELECT, Screen.COMBAT, Screen.RESULTS, Screen.DEFEAT,
+                Screen.CINEMATIC, Screen.STORY_MENU, Screen.POPUP),
+               "go_home",        (Screen.HOME,),                                 8,  recovery=True),
+)
 
 # ─────────────────────────────────────────────────────────────
 #  LOGGING
 # ─────────────────────────────────────────────────────────────
 
+class RecentLogHandler(logging.Handler):
+    """
+    Keeps the last `size` formatted records in memory for the Overlay
+    (constant cost, however long the log file gets). `seq` counts the
+    records received: the Overlay redraws only when it has changed.
+    """
+
+    def __init__(self, size: int = 12):
+        super().__init__()
+        self.records = collections.deque(maxlen=size)
+        self.seq     = 0
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self.records.append(line)
+            self.seq += 1
+
+    def snapshot(self) -> tuple[int, list]:
+        """(seq, last lines) taken under the lock."""
+        with self.lock:
+            return self.seq, list(self.records)
+
+
 os.makedirs(LOG_DIR, exist_ok=True)
 log_file = os.path.join(LOG_DIR, f"{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log")
+recent_logs = RecentLogHandler(12)
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -120,6 +181,7 @@ logging.basicConfig(
     handlers=[
         logging.FileHandler(log_file, encoding="utf-8"),
         logging.StreamHandler(sys.stdout),
+        recent_logs,
     ]
 )
 logger = logging.getLogger("DBFarmer")
@@ -146,12 +208,116 @@ def load_config() -> dict:
     logger.info(f"Default config created at {CONFIG_PATH}")
     return DEFAULT_CONFIG.copy()
 
+# ─────────────────────────────────────────────────────────────
+#  COMBAT DURATION MODEL
+# ─────────────────────────────────────────────────────────────
+
+class CombatDurations:
+    """
+    Combat durations observed during the session, overall and per stage.
+    A stage is recognized by a fingerprint of its Start Battle screen
+    (16x9 average hash, matched with a small Hamming tolerance), so rematches
+    and replays of the same stage use their own history.
+    """
+
+    HASH_SIZE = (16, 9)
+    HASH_TOLERANCE = 12   # max differing bits (out of 144) for "same stage"
+
+    def __init__(self, min_samples: int = 3):
+        self.min_samples = min_samples
+        self.session = []
+        self.stages  = {}    # fingerprint -> [durations]
+
+    @classmethod
+    def fingerprint(cls, frame: Frame) -> int:
+        small = cv2.resize(frame.gray, cls.HASH_SIZE, interpolation=cv2.INTER_AREA)
+        bits = (small > small.mean()).flatten()
+        return int("".join("1" if b else "0" for b in bits), 2)
+
+    def _stage(self, stage: int | None) -> list | None:
+        if stage is None:
+            return None
+        best, best_dist = None, self.HASH_TOLERANCE + 1
+        for known in self.stages:
+            dist = bin(known ^ stage).count("1")
+            if dist < best_dist:
+                best, best_dist = known, dist
+        return self.stages[best] if best is not None else None
+
+    def record(self, duration: float, stage: int | None = None):
+        self.session.append(duration)
+        if stage is not None:
+            history = self._stage(stage)
+            if history is None:
+                history = self.stages[stage] = []
+            history.append(duration)
+
+    def expected(self, stage: int | None = None) -> tuple | None:
+        """
+        (earliest, typical, late) finish in seconds — p10 / p50 / p95 of the
+        stage history if big enough, else of the session. None if not enough data.
+        """
+        history = self._stage(stage)
+        if not history or len(history) < self.min_samples:
+            history = self.session
+        if len(history) < self.min_samples:
+            return None
+        p10, p50, p95 = np.percentile(history, (10, 50, 95))
+        return float(p10), float(p50), float(p95)
+
+# ─────────────────────────────────────────────────────────────
+#  STALL DETECTION
+# ─────────────────────────────────────────────────────────────
+
+class MotionMonitor:
+    """
+    Streaming "is the screen frozen?" check. Each sample is a 64x36 gray
+    thumbnail (the same whatever the window size), compared with the one
+    that STARTED the current static period — so slow fades count as motion.
+    The screen moved if the weighted mean absolute difference, in gray
+    levels, is above `motion`.
+
+    regions = [{"rect": [x0, y0, x1, y1], "weight": w}] in fractions of the
+    window: weight 0 ignores an animated area, > 1 makes an area count more.
+    """
+
+    SIZE = (64, 36)
+
+    def __init__(self, motion: float = 0.1, regions=()):
+        w, h = self.SIZE
+        weights = np.ones((h, w), np.float32)
+        for region in regions:
+            x0, y0, x1, y1 = region["rect"]
+            weights[int(y0 * h):int(np.ceil(y1 * h)),
+                    int(x0 * w):int(np.ceil(x1 * w))] = region.get("weight", 0.0)
+        self.weights = weights / max(float(weights.sum()), 1e-6)
+        self.motion  = motion
+        self.reset()
+
+    def reset(self):
+        """Starts a new static period at the next sample."""
+        self._anchor = None
+        self._size   = None
+        self._since  = None
+        self.moved   = False   # motion seen since the first sample
+
+    def update(self, frame: Frame) -> float:
+        """Adds a sample. Returns for how long (sec) the screen has been static."""
+        thumb = frame.thumbnail(self.SIZE).astype(np.float32)
+        now   = time.monotonic()
+        if (self._anchor is None or frame.size != self._size or
+                float((cv2.absdiff(thumb, self._anchor) * self.weights).sum()) > self.motion):
+            self.moved = self._anchor is not None
+            self._anchor, self._size, self._since = thumb, frame.size, now
+        return now - self._since
+
 # ─────────────────────────────────────────────────────────────
 #  TKINTER OVERLAY (real-time display)
 # ─────────────────────────────────────────────────────────────
 
 class Overlay:
     def __init__(self, get_data_callback):
+        import tkinter as tk   # only imported when the overlay is enabled
         self.get_data = get_data_callback
         self.root = tk.Tk()
         self.root.title("DBFarmer v2")
@@ -175,12 +341,14 @@ class Overlay:
         self.loop_var   = tk.StringVar(value="Loops: 0")
         self.stuck_var  = tk.StringVar(value="Anti-stuck: OK")
         self.action_var = tk.StringVar(value="Action: Waiting")
+        self.perf_var   = tk.StringVar(value="")
 
         for var, color in [
             (self.status_var, "#ffffff"),
             (self.loop_var,   "#b060ff"),
             (self.stuck_var,  "#60ff90"),
             (self.action_var, "#ffcc00"),
+            (self.perf_var,   "#60c0ff"),
         ]:
             tk.Label(self.root, textvariable=var,
                      fg=color, bg="#0d0d0d",
@@ -191,6 +359,7 @@ class Overlay:
                                bg="#111111", fg="#b060ff",
                                font=("Consolas", 8), borderwidth=0)
         self.console.pack(fill="both", padx=4, pady=4)
+        self._log_seq = None   # recent_logs.seq shown in the console
 
         # Drag
         bar.bind("<ButtonPress-1>", self._start_drag)
@@ -214,16 +383,15 @@ class Overlay:
             self.loop_var.set(f"🔁 Loops: {data.get('loops', 0)} | Completed: {data.get('completed', 0)}")
             self.stuck_var.set(f"🛡 Anti-stuck: {data.get('stuck_fixed', 0)} fix(s)")
             self.action_var.set(f"⚡ Action: {data.get('action', '...')}")
+            self.perf_var.set(f"⏱ {data['perf']}" if data.get("perf") else "")
 
-            # Show last log lines
-            try:
-                with open(log_file, "r", encoding="utf-8") as lf:
-                    lines = lf.readlines()[-12:]
+            # Show last log lines (only redrawn when new records arrived)
+            seq, lines = recent_logs.snapshot()
+            if seq != self._log_seq:
+                self._log_seq = seq
                 self.console.delete("1.0", "end")
-                self.console.insert("end", "".join(lines))
+                self.console.insert("end", "\n".join(lines))
                 self.console.see("end")
-            except:
-                pass
         except:
             pass
         self.root.after(500, self._update)
@@ -235,15 +403,56 @@ class Overlay:
 #  MAIN FARMER CLASS
 # ─────────────────────────────────────────────────────────────
 
+# Mouse and keyboard are shared by every farmer of the process
+# (orchestrator.py): one click / key press at a time
+INPUT_LOCK = threading.RLock()
+
+
+def find_windows(title: str) -> list:
+    """
+    Windows whose title contains `title`, exact matches first
+    ("BlueStacks App Player" must not pick "BlueStacks App Player 2").
+    """
+    wins = pyautogui.getWindowsWithTitle(title)
+    return sorted(wins, key=lambda w: w.title != title)
+
+
 class DBFarmer:
 
-    def __init__(self):
-        self.config = load_config()
+    def __init__(self, config: dict = None, name: str = "main",
+                 templates: tuple = None, input_lock=None,
+                 frames: FrameSource = None, inputs: InputBackend = None, session: str = None):
+        """
+        Defaults = one farmer for the window of config.json.
+        The orchestrator passes, per instance: its config (with overrides),
+        a name (log file, regions file, thread names), the (images, templates)
+        loaded once for every instance and the input lock of the process.
+        frames / inputs replace the configured capture and input backends
+        (e.g. the game simulator, see simulator.py): no window is looked up.
+        session = id the events are tagged with (default: this process's log
+        file name; worker processes get the orchestrator's).
+        """
+        started = time.perf_counter()
+        self.startup = {"imports": IMPORT_SECONDS}   # phase -> sec, logged at the end
+
+        def phase(key, since):
+            now = time.perf_counter()
+            self.startup[key] = self.startup.get(key, 0.0) + now - since
+            return now
+
+        self.config = config if config is not None else load_config()
+        self.name   = name
+        self.input_lock = input_lock or INPUT_LOCK
         self.image_folder = self.config["image_folder"]
         self.confidence   = self.config["confidence"]
         self.loop_delay   = self.config["loop_delay"]
         self.click_delay  = self.config["click_delay"]
         self.max_tries    = self.config["max_tries"]
+        self.poll_min     = self.config["poll_min"]
+        self.poll_backoff = self.config["poll_backoff"]
+
+        # Time of the last click (adaptive polling restarts fast after an action)
+        self._last_action = 0.0
 
         # Stats
         self.stats = {
@@ -254,8 +463,14 @@ class DBFarmer:
             "action":      "Starting",
         }
 
-        # Flag to pause anti-stuck during combat and results screen
-        self.in_combat = False
+        # Learned combat durations (adaptive end-of-combat monitoring)
+        self.combat_durations = CombatDurations(self.config["combat_min_samples"])
+        self.motion = MotionMonitor(self.config["stall_motion"], self.config["stall_regions"])
+        self._stage = None           # fingerprint of the stage being fought
+        self._fresh_combat = False   # combat started by us (duration can be learned)
+        self._combat_start = None    # when we started the current combat
+        self._level = None           # (kind, detected at) of the level being played
+        self._last_completed = None  # when the previous level was completed
 
         # Flag set by anti-stuck to request a recovery
         # Main loop detects it and handles recovery properly
@@ -263,43 +478,129 @@ class DBFarmer:
 
         os.makedirs(self.image_folder, exist_ok=True)
 
-        # Load images
-        self.images = {}
-        self._load_images()
-
-        # Find BlueStacks window
-        self.window = self._find_window()
+        # Load images (+ preprocessed templates used by the detector)
+        self.images    = {}
+        self.templates = {}
+        t = time.perf_counter()
+        if templates is not None:
+            self.images, self.templates = templates
+        else:
+            self._load_images()
+        t = phase("images", t)
+        # Hot-path timings (see metrics.py)
+        self.metrics  = Metrics() if self.config["metrics"] else None
+        self.exporter = None
+        if self.metrics and (self.config["metrics_file"] or self.config["metrics_port"]):
+            self.exporter = MetricsExporter(self.metrics, self.config["metrics_file"],
+                                            self.config["metrics_port"], self.config["metrics_interval"])
+
+        # Structured event stream (see events.py / report.py)
+        self.events = None
+        if self.config["events"]:
+            session = session or os.path.splitext(os.path.basename(log_file))[0]
+            suffix  = "" if name == "main" else f"_{name}"
+            self.events = EventLog(os.path.join(LOG_DIR, f"{session}{suffix}.events.jsonl"), session, name)
+
+        self.regions = None
+        if self.config["region_index"]:
+            regions_path = REGIONS_PATH
+            if name != "main":
+                regions_path = os.path.join(os.path.dirname(REGIONS_PATH), f"regions_{name}.json")
+            self.regions = RegionIndex(regions_path, self.config["region_padding"])
+        self.detector = Detector(
+            self.templates, self.confidence, self.regions,
+            engine=self.config["match_engine"],
+            pyramid_scale=self.config["pyramid_scale"],
+            pyramid_candidates=self.config["pyramid_candidates"],
+            color=self.config["match_color"],
+            cache=DetectionCache(
+                self.config["detection_cache_size"],
+                self.config["detection_cache_tolerance"],
+                self.config["detection_cache_max_age"],
+            ) if self.config["detection_cache"] else None,
+            metrics=self.metrics,
+            calibrator=ScaleCalibrator(
+                self.config["calibration_anchors"], self.confidence,
+                self.config["calibration_interval"],
+            ) if self.config["scale_calibration"] else None,
+        )
+        # Which screen is displayed, from one detection pass
+        # (RematchButton and ReadyButton are stricter: they look a lot like other buttons)
+        self.screens = ScreenRecognizer(
+            self.detector, {"RematchButton": min(0.90, self.confidence + 0.15),
+                            "ReadyButton":   min(0.90, self.confidence + 0.10)}
+        )
+
+        t = phase("setup", t)
+
+        # Find BlueStacks window (a replay or an injected source has no live window)
+        self.replay = frames is not None or self.config["capture_backend"] == "replay"
+        if not self.replay and pyautogui is None:
+            sys.exit("[ERROR] pyautogui unavailable (no display?) → only capture_backend 'replay' can run")
+        self.window = None if self.replay else self._find_window()
+        t = phase("window", t)
+        self.window_tracker = WindowTracker(
+            self.config["window_name"], find_windows, self.window,
+            refresh_interval=self.config["window_refresh_interval"],
+        )
+        self.frames = frames or make_frame_source(self.config, self._get_window_region)
+        self.input  = inputs or make_input_backend(self.config)
+        self.input_queue = None
+        if self.config["input_queue"]:
+            self.input_queue = InputQueue(self.input, self.input_lock, self._input_sent,
+                                          thread_name=f"{name}-input")
+        self.capture = None
+        if self.config["capture_service"]:
+            self.capture = CaptureService(self.frames, self.config["capture_fps"],
+                                          self.config["capture_buffer"],
+                                          thread_name=f"{name}-capture")
+        t = phase("capture", t)
+
+        # Farming flow (transition table, see FARMING_FLOW)
+        self.flow = FlowEngine(
+            FARMING_FLOW,
+            {edge.action: getattr(self, f"_act_{edge.action}") for edge in FARMING_FLOW},
+            recognize=self._screen,
+            wait=self._wait_screen,
+            requested=self._recovery_request,
+            metrics=self.metrics,
+            events=self.events,
+            settle=self._wait_settled,
+        )
+        self._event("session_start", config=self.config)
 
         # Start anti-stuck thread
-        self._stuck_thread = threading.Thread(target=self._anti_stuck_loop, daemon=True)
+        self._stuck_thread = threading.Thread(target=self._anti_stuck_loop, daemon=True,
+                                              name=f"{name}-antistuck")
         self._stuck_thread.start()
 
         # Overlay
         if self.config["overlay_enabled"]:
             overlay_thread = threading.Thread(
-                target=lambda: Overlay(lambda: self.stats).run(),
+                target=lambda: Overlay(self._overlay_data).run(),
                 daemon=True
             )
             overlay_thread.start()
+        phase("setup", t)
 
+        total = time.perf_counter() - started + IMPORT_SECONDS
+        logger.info(f"Startup {total:.2f}s: " + " | ".join(f"{k} {v:.2f}s" for k, v in self.startup.items()))
+        if self.metrics:
+            for key, seconds in self.startup.items():
+                self.metrics.observe("startup", seconds, phase=key)
         logger.info("DBFarmer initialized successfully")
 
     # ── Image loading ───────────────────────────────────────────
 
     def _load_images(self):
-        missing = []
-        for key, filename in IMAGE_FILES.items():
-            path = os.path.join(self.image_folder, filename)
-            if os.path.exists(path):
-                img = cv2.imread(path)
-                if img is not None:
-                    self.images[key] = img
-                    logger.debug(f"Image loaded: {key} ({filename})")
-                else:
-                    logger.warning(f"Could not read image: {filename}")
-                    missing.append(key)
-            else:
-                missing.append(key)
+        """
+        Reads every reference image and preprocesses it ONCE
+        (BGR + grayscale, full + pyramid scale) into self.templates.
+        """
+        images, templates, missing = load_templates(self.image_folder, (self.config["pyramid_scale"],),
+                                                    bundle=self.config["template_bundle"])
+        self.images.update(images)
+        self.templates.update(templates)
 
         if missing:
             logger.warning(f"Missing images ({len(missing)}): {missing}")
@@ -314,7 +615,7 @@ class DBFarmer:
         name = self.config["window_name"]
         logger.info(f"Looking for window: '{name}'")
         for _ in range(30):
-            wins = pyautogui.getWindowsWithTitle(name)
+            wins = find_windows(name)
             if wins:
                 win = wins[0]
                 logger.info(f"Window found: {win.title} | Pos: ({win.left},{win.top}) Size: {win.width}x{win.height}")
@@ -331,122 +632,75 @@ class DBFarmer:
         sys.exit(1)
 
     def _get_window_region(self):
-        """Returns (left, top, width, height) of the BlueStacks window."""
-        try:
-            wins = pyautogui.getWindowsWithTitle(self.config["window_name"])
-            if wins:
-                w = wins[0]
-                return (w.left, w.top, w.width, w.height)
-        except:
-            pass
-        return None
+        """
+        Returns (left, top, width, height) of the BlueStacks window.
+        Cached by the WindowTracker (no window enumeration on every capture).
+        """
+        if self.replay:
+            return self.frames.region
+        return self.window_tracker.region()
 
     # ── Screenshot ─────────────────────────────────────────────
 
-    def _screenshot(self):
-        """Captures only the BlueStacks window."""
-        region = self._get_window_region()
-        if region is None:
-            return None
+    def _screenshot(self) -> Frame | None:
+        """
+        Captures only the BlueStacks window, ONCE, as a BGR Frame
+        (from the configured capture backend, see frame_sources.py).
+        Pass it to _detect() to check any number of images on it.
+        With the capture service, the frame is shared with the other threads
+        and always captured after the last click.
+        Queued clicks are sent first and their click_delay waited: never a
+        capture of the screen before the game reacted to them.
+        """
+        after = self._last_action
+        if self.input_queue is not None:
+            settled = self.input_queue.wait_settled(timeout=5.0)
+            if settled is None:
+                logger.warning("Input queue still busy after 5s")
+            else:
+                after = max(after, settled)
         try:
-            l, t, w, h = region
-            img = ImageGrab.grab(bbox=(l, t, l+w, t+h))
-            return np.array(img)
+            with self._timed("screenshot"):
+                if self.capture:
+                    frame = self.capture.grab(after=after)
+                else:
+                    frame = self.frames.grab()
         except Exception as e:
             logger.error(f"Screenshot error: {e}")
-            return None
+            frame = None
+
+        if self.replay:
+            return frame
+        # Geometry looks stale (window closed, moved, resized) → re-read it next time
+        if frame is None or frame.size != tuple(frame.region[2:4]):
+            self.window_tracker.invalidate()
+        return frame
 
     # ── Image detection ────────────────────────────────────────
 
-    def _find(self, key: str) -> tuple | None:
+    def _detect(self, keys, frame: Frame = None, confidence: float = None,
+                use_cache: bool = True) -> dict:
         """
-        Searches for an image in the BlueStacks window.
-        Returns ABSOLUTE (x, y) on screen, or None if not found.
+        Matches several images against ONE capture (grabbed if not given).
+        Returns {key: (score, coords)} — coords are ABSOLUTE, None if below threshold.
+        use_cache=False → no result reused from the detection cache.
         """
-        if key not in self.images:
-            return None
+        if frame is None:
+            frame = self._screenshot()
+            if frame is None:
+                return {key: (0.0, None) for key in keys}
+        return self.detector.detect(frame, keys, confidence, use_cache)
 
-        screenshot = self._screenshot()
-        if screenshot is None:
-            return None
-
-        template = self.images[key]
-        screen_bgr = cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR)
-
-        sh, sw = screen_bgr.shape[:2]
-        th, tw = template.shape[:2]
-        if th > sh or tw > sw:
-            logger.warning(f"Template {key} larger than screen, resizing...")
-            template = cv2.resize(template, (min(tw, sw-1), min(th, sh-1)))
-
-        result = cv2.matchTemplate(screen_bgr, template, cv2.TM_CCOEFF_NORMED)
-        _, max_val, _, max_loc = cv2.minMaxLoc(result)
-
-        if max_val >= self.confidence:
-            rel_x = max_loc[0] + tw // 2
-            rel_y = max_loc[1] + th // 2
-            region = self._get_window_region()
-            if region:
-                abs_x = region[0] + rel_x
-                abs_y = region[1] + rel_y
-                logger.debug(f"Found [{key}] confidence={max_val:.2f} pos=({abs_x},{abs_y})")
-                return (abs_x, abs_y)
-
-        return None
-
-    def _find_with_confidence(self, key: str, confidence: float) -> tuple | None:
-        """Same as _find but with a custom confidence threshold."""
-        if key not in self.images:
-            return None
-        screenshot = self._screenshot()
-        if screenshot is None:
-            return None
-        template = self.images[key]
-        screen_bgr = cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR)
-        sh, sw = screen_bgr.shape[:2]
-        th, tw = template.shape[:2]
-        if th > sh or tw > sw:
-            template = cv2.resize(template, (min(tw, sw-1), min(th, sh-1)))
-        result = cv2.matchTemplate(screen_bgr, template, cv2.TM_CCOEFF_NORMED)
-        _, max_val, _, max_loc = cv2.minMaxLoc(result)
-        if max_val >= confidence:
-            rel_x = max_loc[0] + tw // 2
-            rel_y = max_loc[1] + th // 2
-            region = self._get_window_region()
-            if region:
-                abs_x = region[0] + rel_x
-                abs_y = region[1] + rel_y
-                logger.debug(f"Found [{key}] confidence={max_val:.2f} (threshold={confidence}) pos=({abs_x},{abs_y})")
-                return (abs_x, abs_y)
-        return None
-
-    def _find_with_score(self, key: str, screenshot_bgr) -> tuple[float, tuple | None]:
+    def _find(self, key: str, frame: Frame = None) -> tuple | None:
         """
-        Searches for an image in an already captured screenshot.
-        Returns (score, coords) — coords can be None if below threshold.
-        Used to compare multiple images on the same screenshot.
+        Searches for an image in the BlueStacks window.
+        Returns ABSOLUTE (x, y) on screen, or None if not found.
         """
-        if key not in self.images:
-            return 0.0, None
+        return self._detect([key], frame)[key][1]
 
-        template = self.images[key]
-        sh, sw = screenshot_bgr.shape[:2]
-        th, tw = template.shape[:2]
-        if th > sh or tw > sw:
-            template = cv2.resize(template, (min(tw, sw-1), min(th, sh-1)))
-            th, tw = template.shape[:2]
-
-        result = cv2.matchTemplate(screenshot_bgr, template, cv2.TM_CCOEFF_NORMED)
-        _, max_val, _, max_loc = cv2.minMaxLoc(result)
-
-        if max_val >= self.confidence:
-            region = self._get_window_region()
-            if region:
-                abs_x = region[0] + max_loc[0] + tw // 2
-                abs_y = region[1] + max_loc[1] + th // 2
-                return max_val, (abs_x, abs_y)
-
-        return max_val, None
+    def _find_with_confidence(self, key: str, confidence: float, frame: Frame = None) -> tuple | None:
+        """Same as _find but with a custom confidence threshold."""
+        return self._detect([key], frame, confidence)[key][1]
 
     def _find_best(self, *keys: str) -> tuple[str | None, tuple | None]:
         """
@@ -454,19 +708,21 @@ class DBFarmer:
         the one with the highest score.
         Avoids false positives between similar images (e.g. demo vs demo_checked).
         Returns (winning_key, coords) or (None, None) if none found.
+        Never from the detection cache: the images compared differ by a few
+        pixels, too little for the cache to see the screen change.
         """
-        screenshot = self._screenshot()
-        if screenshot is None:
+        frame = self._screenshot()
+        if frame is None:
             return None, None
 
-        screen_bgr = cv2.cvtColor(screenshot, cv2.COLOR_RGB2BGR)
+        hits = self._detect(keys, frame, use_cache=False)
 
         best_key    = None
         best_score  = -1.0
         best_coords = None
 
         for key in keys:
-            score, coords = self._find_with_score(key, screen_bgr)
+            score, coords = hits[key]
             logger.debug(f"  _find_best [{key}] score={score:.3f}")
             if score > best_score:
                 best_score  = score
@@ -479,12 +735,50 @@ class DBFarmer:
 
         return None, None
 
+    def _screen(self, frame: Frame = None, screens=None, extra=()) -> ScreenState:
+        """
+        Recognizes the displayed screen on ONE capture (grabbed if not given).
+        See screens.py for the markers of each screen and their precedence.
+        """
+        if frame is None:
+            frame = self._screenshot()
+        return self.screens.recognize(frame, screens, extra)
+
     # ── Click ──────────────────────────────────────────────────
 
+    def _timed(self, name: str, **labels):
+        """Metrics timer for a block (no-op when metrics are off)."""
+        return self.metrics.timer(name, **labels) if self.metrics else contextlib.nullcontext()
+
+    def _event(self, type: str, duration: float = None, **fields):
+        """Adds an event to the event stream (no-op when events are off)."""
+        if self.events is not None:
+            self.events.emit(type, duration, **fields)
+
+    def _send(self, kind: str, *args, delay: float = 0.0):
+        """
+        Sends one input action (see input_backends.py), then `delay` sec
+        before the next one. Queued: returns at once, the delay is held by the
+        input thread. Direct: sent under the input lock, then sleeps.
+        """
+        if self.input_queue is not None:
+            self.input_queue.submit(kind, *args, delay=delay)
+            return
+        with self._timed(kind), self.input_lock:
+            getattr(self.input, kind)(*args)
+        self._last_action = time.monotonic()
+        time.sleep(delay)
+
+    def _input_sent(self, kind: str, sent_at: float, seconds: float):
+        """Input thread callback: an action reached the game."""
+        self._last_action = sent_at
+        if self.metrics:
+            self.metrics.observe(kind, seconds)
+
     def _click(self, x: int, y: int):
         """Clicks at an absolute position on screen."""
-        pyautogui.click(x, y)
-        time.sleep(self.click_delay)
+        self._send("click", x, y, delay=self.click_delay)
+        self._event("click", x=x, y=y)
         logger.debug(f"Click at ({x}, {y})")
 
     def _click_skip(self) -> bool:
@@ -516,10 +810,82 @@ class DBFarmer:
             y = int(t + h * pos.get("y_pct", 0.06))
 
         logger.info(f"Skip click at ({x}, {y}) [mode={mode}]")
-        pyautogui.click(x, y)
-        time.sleep(self.click_delay)
+        self._send("click", x, y, delay=self.click_delay)
+        self._event("click", x=x, y=y, key="skip")
         return True
 
+    # ── Wait engine ────────────────────────────────────────────
+
+    def _wait_for(self, *conditions, timeout: float = 30, max_interval: float = None,
+                  confidence: float = None, abort_on_recovery: bool = False) -> tuple:
+        """
+        Waits until one of the conditions is met. Single primitive behind every wait.
+
+        conditions: image keys and/or callables frame -> value.
+                    All of them are checked on the SAME capture, in the given
+                    order: the first one found / truthy wins.
+        Polling is adaptive: poll_min right after an action, then x poll_backoff
+        per check up to max_interval (default loop_delay).
+        abort_on_recovery: stop early if anti-stuck requested a recovery.
+
+        Returns (condition, value, elapsed):
+          condition → the key / callable that fired, None on timeout or abort
+          value     → its coords (keys) or return value (callables)
+          elapsed   → seconds waited
+        """
+        max_interval = max_interval or self.loop_delay
+        keys  = [c for c in conditions if isinstance(c, str)]
+        start = time.monotonic()
+        polls = 0
+        since = start
+
+        while True:
+            frame = self._screenshot()
+            if frame is not None:
+                hits = self._detect(keys, frame, confidence) if keys else {}
+                for cond in conditions:
+                    value = hits[cond][1] if isinstance(cond, str) else cond(frame)
+                    if value:
+                        return cond, value, time.monotonic() - start
+
+            now = time.monotonic()
+            elapsed = now - start
+            if abort_on_recovery and self.recovery_requested:
+                return None, None, elapsed
+            if elapsed >= timeout:
+                return None, None, elapsed
+
+            # An action happened meanwhile (e.g. anti-stuck click) → fast again
+            if self._last_action > since:
+                since = self._last_action
+                polls = 0
+            interval = min(max_interval, self.poll_min * self.poll_backoff ** polls)
+            polls = min(polls + 1, 50)   # interval capped anyway: no float overflow on long waits
+            time.sleep(max(0.0, min(interval, timeout - elapsed)))
+
+    def _wait_settled(self, timeout: float) -> float:
+        """
+        Waits until the screen stops animating: no motion (MotionMonitor,
+        settle_motion, stall_regions weights) for settle_time sec.
+        Replaces fixed post-transition sleeps: `timeout` is the old sleep, the
+        upper bound when the screen keeps moving. Returns the seconds waited.
+        Stillness only counts once the transition started (motion seen) or
+        click_delay after the last click: a screen still from before the
+        game reacted is not a settled one.
+        """
+        monitor = MotionMonitor(self.config["settle_motion"], self.config["stall_regions"])
+        still = self.config["settle_time"]
+
+        def settled(frame):
+            static = monitor.update(frame)
+            started = monitor.moved or time.monotonic() >= self._last_action + self.click_delay
+            return started and static >= still
+
+        with self._timed("settle"):
+            _, _, elapsed = self._wait_for(settled, timeout=timeout, max_interval=0.1)
+        logger.debug(f"Screen settled after {elapsed:.2f}s (max {timeout}s)")
+        return elapsed
+
     # ── Wait and click ─────────────────────────────────────────
 
     def _wait_and_click(self, key: str, timeout: float = 30, delay: float = None) -> bool:
@@ -528,54 +894,108 @@ class DBFarmer:
         If timeout exceeded → recovery_requested = True (anti-stuck takes over).
         Returns True if clicked, False if timeout.
         """
-        delay = delay or self.loop_delay
         self._set_action(f"Waiting: {key}")
-        start = time.time()
-        while True:
-            coords = self._find(key)
-            if coords:
-                self._set_action(f"Click: {key}")
-                self._click(*coords)
-                return True
-            if time.time() - start > timeout:
-                logger.warning(f"Timeout ({timeout}s) waiting for [{key}] → recovery requested")
-                self.recovery_requested = True
-                return False
-            time.sleep(delay)
+        _, coords, _ = self._wait_for(key, timeout=timeout, max_interval=delay)
+        if coords:
+            self._set_action(f"Click: {key}")
+            self._click(*coords)
+            return True
+        logger.warning(f"Timeout ({timeout}s) waiting for [{key}] → recovery requested")
+        self.recovery_requested = True
+        return False
+
+    # ── Team selection ─────────────────────────────────────────
+
+    SLOT_CHANGE  = 8.0    # mean gray level change of a slot area that shows a click was taken
+    SLOT_STILL   = 2.0    # below it the slot area did not change at all (click surely missed)
+    READY_ACTIVE = 0.6    # ReadyButton saturation vs its image below which it is greyed out
+
+    def _slot_box(self, frame: Frame, slot: dict) -> tuple | None:
+        """(x0, y0, x1, y1) in the frame around a team slot (absolute coords in config.json)."""
+        r = self.config["team_slot_radius"]
+        l, t = frame.region[:2]
+        w, h = frame.size
+        x, y = slot["x"] - l, slot["y"] - t
+        box = (max(0, x - r), max(0, y - r), min(w, x + r), min(h, y + r))
+        return box if box[2] > box[0] and box[3] > box[1] else None
 
-    def _try_click(self, key: str, tries: int = None, delay: float = None) -> bool:
+    def _slot_selected(self, frame: Frame, slot: dict, before: Frame = None) -> bool:
         """
-        Tries to click an element with a limited number of attempts.
-        Returns True if clicked, False if failed after all attempts.
+        Whether a slot is selected, from one capture:
+          - SlotSelected image captured → that mark is found in the slot area
+          - otherwise → the slot area changed since `before` (the capture
+            taken before the clicks; False when there is none)
         """
-        tries = tries or self.max_tries
-        delay = delay or self.loop_delay
-        for i in range(tries):
-            coords = self._find(key)
-            if coords:
-                self._click(*coords)
-                return True
-            time.sleep(delay)
-        logger.warning(f"[{key}] not found after {tries} attempts")
-        return False
+        box = self._slot_box(frame, slot)
+        if box is None:
+            return False
+        x0, y0, x1, y1 = box
+        mark = self.detector.template("SlotSelected", frame)   # at the calibrated scale
+        if mark is not None:
+            area = frame.view(self.detector.color)[y0:y1, x0:x1]
+            tpl  = mark.view(self.detector.color)
+            if tpl.shape[0] > area.shape[0] or tpl.shape[1] > area.shape[1]:
+                return False
+            _, score, _, _ = cv2.minMaxLoc(cv2.matchTemplate(area, tpl, cv2.TM_CCOEFF_NORMED))
+            return score >= self.confidence
+        change = self._slot_change(frame, box, before)
+        return change is not None and change >= self.SLOT_CHANGE
+
+    def _slot_change(self, frame: Frame, box: tuple, before: Frame = None) -> float | None:
+        """Mean gray level change of a slot area since `before` (None without it)."""
+        if before is None or before.size != frame.size:
+            return None
+        x0, y0, x1, y1 = box
+        diff = cv2.absdiff(before.gray[y0:y1, x0:x1], frame.gray[y0:y1, x0:x1])
+        return float(diff.mean())
 
-    # ── Team selection ─────────────────────────────────────────
+    def _slot_missed(self, frame: Frame, slot: dict, before: Frame) -> bool:
+        """
+        Whether a slot click surely was not taken, so that clicking it again
+        cannot deselect it:
+          - SlotSelected image captured → its mark is not in the slot area
+          - otherwise → Ready is still greyed out AND the slot area did not
+            change at all (a change below SLOT_CHANGE may still be a selection)
+        """
+        if "SlotSelected" in self.templates:
+            return not self._slot_selected(frame, slot)
+        box = self._slot_box(frame, slot)
+        change = self._slot_change(frame, box, before) if box else None
+        return change is not None and change < self.SLOT_STILL and not self._ready_active(frame)
 
-    def _select_team(self):
+    def _ready_active(self, frame: Frame) -> tuple | None:
+        """
+        ReadyButton coords if it is on screen AND active (as colorful as its
+        image: the game greys it out while the team is incomplete).
+        """
+        # Never cached: greyed out → active is a color change, too small for the cache
+        coords = self._detect(["ReadyButton"], frame, use_cache=False)["ReadyButton"][1]
+        template = self.detector.template("ReadyButton", frame)   # at the calibrated scale
+        if coords is None or template is None:
+            return coords
+        reference = cv2.cvtColor(template.bgr, cv2.COLOR_BGR2HSV)[..., 1].mean()
+        if reference < 20:
+            return coords   # grey image: nothing to compare
+        tw, th = template.size
+        x, y = coords[0] - frame.region[0], coords[1] - frame.region[1]
+        patch = frame.bgr[max(0, y - th // 4):y + th // 4 + 1, max(0, x - tw // 4):x + tw // 4 + 1]
+        if patch.size == 0:
+            return coords
+        saturation = cv2.cvtColor(patch, cv2.COLOR_BGR2HSV)[..., 1].mean()
+        return coords if saturation >= self.READY_ACTIVE * reference else None
+
+    def _select_team(self) -> bool:
         """
         Waits for LegendsPointer to confirm team selection screen is ready,
-        then clicks all 6 slots using absolute coordinates from config.json.
+        then clicks the slots of config.json that are not selected yet and
+        checks on one capture that every click was taken (clicks again the
+        ones surely missed, up to 3 rounds).
         Edit 'team_slots' in config.json to calibrate positions for your screen.
         """
         self._set_action("Waiting for team selection screen...")
-        start = time.time()
-        while True:
-            if self._find("LegendsPointer"):
-                break
-            if time.time() - start > 30:
-                logger.warning("LegendsPointer not found after 30s → skipping wait")
-                break
-            time.sleep(0.5)
+        found, _, _ = self._wait_for("LegendsPointer", timeout=30, max_interval=0.5)
+        if not found:
+            logger.warning("LegendsPointer not found after 30s → skipping wait")
 
         self._set_action("Team selection")
         slots = self.config.get("team_slots", [])
@@ -583,15 +1003,38 @@ class DBFarmer:
             logger.warning("No team_slots in config.json — skipping team selection")
             return True
 
-        time.sleep(0.3)
-        for i, slot in enumerate(slots):
-            self._click(slot["x"], slot["y"])
-            logger.info(f"Char {i+1} clicked: ({slot['x']}, {slot['y']})")
-            if i == 2:
-                time.sleep(0.5)
+        before = self._screenshot()
+        if before is None:
+            return False
+        if self._ready_active(before):
+            logger.info("✓ Team already complete")
+            return True
+        todo = [i for i, slot in enumerate(slots) if not self._slot_selected(before, slot)]
+
+        for attempt in range(3):
+            for i in todo:
+                slot = slots[i]
+                self._click(slot["x"], slot["y"])
+                logger.info(f"Char {i+1} clicked: ({slot['x']}, {slot['y']})")
+
+            def missed(frame):
+                return [i for i in todo if not self._slot_selected(frame, slots[i], before)]
 
-        # Wait for UI to settle before ReadyButton
-        time.sleep(1.0)
+            # Done as soon as one capture shows every clicked slot selected (or Ready active)
+            cond, _, _ = self._wait_for(self._ready_active, lambda f: not missed(f),
+                                        timeout=2.0, max_interval=0.3)
+            if cond is not None:
+                return True
+            frame = self._screenshot()
+            if frame is None:
+                return False
+            if self._ready_active(frame):
+                return True
+            todo = [i for i in todo if self._slot_missed(frame, slots[i], before)]
+            if not todo:
+                break
+            logger.warning(f"Slot(s) {[i + 1 for i in todo]} not selected → clicking again")
+        logger.warning("Team selection not confirmed → trying Ready anyway")
         return True
 
     # ── Stats / status ─────────────────────────────────────────
@@ -603,118 +1046,218 @@ class DBFarmer:
     def _set_status(self, status: str):
         self.stats["status"] = status
 
-    # ── INITIAL SETUP ──────────────────────────────────────────
+    def _level_detected(self, kind: str):
+        """A combat / cinematic level is being played (one event per level)."""
+        if self._level is None or self._level[0] != kind:
+            self._level = (kind, time.monotonic())
+            self._event("level_detected", kind=kind)
+
+    def _level_completed(self, kind: str):
+        """Cycle time = since the previous completed level (or since this one was detected)."""
+        now = time.monotonic()
+        since = self._last_completed or (self._level[1] if self._level else None)
+        self._event("level_completed", now - since if since else None, kind=kind)
+        self._level, self._last_completed = None, now
+
+    def _combat_started(self, rematch: bool = False):
+        self._fresh_combat = True
+        self._combat_start = time.monotonic()
+        self._event("combat_started", rematch=rematch)
+
+    # ── FLOW ACTIONS (see FARMING_FLOW) ────────────────────────
+    # One method per action of the transition table. Each one acts on the
+    # recognized screen and returns True when done; the flow engine then
+    # waits for the next screen and times the whole transition.
+
+    def _act_open_story(self, state: ScreenState) -> bool:
+        """Home → Story."""
+        self._set_status("Setup")
+        self._set_action("Story")
+        self._click(*state.seen("StoryButton"))
+        logger.info("✓ Story selected")
+        return True
 
-    def setup(self):
+    def _act_continue_story(self, state: ScreenState) -> bool:
+        """Story menu → Continue (a Yes confirmation may follow)."""
+        self._set_action("Continue")
+        self._click(*state.seen("ContinueButton"))
+        logger.info("✓ Continue clicked")
+        return True
+
+    def _act_dismiss(self, state: ScreenState) -> bool:
         """
-        Startup sequence: Story → Continue
-        Each step checks recovery_requested — if blocked, anti-stuck handles it.
+        Popup over any screen: flush TAPs, else click Yes.
+        Right after a back/escape, QuitBattle then No are preferred over Yes
+        (quit the battle, refuse "leave the game?").
         """
-        logger.info("="*55)
-        logger.info("  INITIAL SETUP")
-        logger.info("="*55)
-        self._set_status("Setup")
+        if state.seen("TapArrow") or state.seen("TapArrow2"):
+            self._flush_taps()
+            return True
+        keys = ("YesButton", "QuitBattleButton", "NoButton")
+        if self.flow.previous in ("back", "go_home"):
+            keys = ("QuitBattleButton", "NoButton", "YesButton")
+        for key in keys:
+            coords = state.seen(key)
+            if coords:
+                self._set_action(f"Popup: {key}")
+                self._click(*coords)
+                return True
+        return False
 
-        print("\n[DBFarmer] Waiting for Story button...")
+    def _act_start_battle(self, state: ScreenState) -> bool:
+        """Combat level: verify Play Demo unchecked → Start Battle."""
+        logger.info("─── Handling COMBAT level ───")
+        self._set_status("Preparing combat")
+        self._level_detected("combat")
 
-        # 1. Story button — timeout 60s then recovery
-        self._set_action("Waiting: StoryButton")
-        start = time.time()
-        while not self._find("StoryButton"):
-            if self.recovery_requested:
-                logger.warning("Setup stuck on StoryButton → recovery")
-                return
-            if time.time() - start > 60:
-                logger.warning("Timeout StoryButton (60s) → recovery requested")
-                self.recovery_requested = True
-                return
-            time.sleep(0.5)
-        self._click(*self._find("StoryButton"))
-        logger.info("✓ Story selected")
+        self._set_action("Demo checkmark")
+        if not self._ensure_demo_unchecked(timeout=20):
+            return False
+        logger.info("✓ Demo unchecked, launching combat")
 
-        # 2. Continue button — timeout 60s then recovery
-        self._set_action("Waiting: ContinueButton")
-        start = time.time()
-        while not self._find("ContinueButton"):
-            if self.recovery_requested:
-                logger.warning("Setup stuck on ContinueButton → recovery")
-                return
-            if time.time() - start > 60:
-                logger.warning("Timeout ContinueButton (60s) → recovery requested")
-                self.recovery_requested = True
-                return
-            time.sleep(0.5)
-        self._click(*self._find("ContinueButton"))
-        logger.info("✓ Continue clicked")
+        # Remember which stage this is (learned combat duration per stage)
+        frame = self._screenshot()
+        self._stage = CombatDurations.fingerprint(frame) if frame is not None else None
 
-        # 3. Check if recovery was requested after ContinueButton
-        if self.recovery_requested:
-            logger.warning("Setup stuck after ContinueButton → recovery")
-            return
-
-        # 4. Yes confirmation (if needed)
-        time.sleep(0.5)
-        self._try_click("YesButton", tries=5, delay=0.4)
-        if self.recovery_requested:
-            logger.warning("Setup stuck on YesButton → recovery")
-            return
+        self._set_action("Waiting for StartBattle...")
+        if not self._wait_and_click("StartBattleButton", timeout=30):
+            return False
+        logger.info("✓ Start Battle clicked")
+        return True
 
-        logger.info("✓ Setup done - main loop taking over")
+    def _act_select_team(self, state: ScreenState) -> bool:
+        """Team selection (6 slots) → Ready."""
+        if not self._select_team() or self.recovery_requested:
+            return False
+        self._set_action("Waiting: ReadyButton")
+        _, coords, _ = self._wait_for(self._ready_active, timeout=30)
+        if not coords:
+            logger.warning("Timeout (30s) waiting for an active [ReadyButton] → recovery requested")
+            self.recovery_requested = True
+            return False
+        self._click(*coords)
+        logger.info("✓ Ready")
+        self._combat_started()
+        return True
 
-    # ── LEVEL TYPE DETECTION ───────────────────────────────────
+    def _act_rematch(self, state: ScreenState) -> bool:
+        logger.info("✗ DEFEAT detected (RematchButton visible) → Rematch")
+        self._event("defeat")
+        self._click(*state.seen("RematchButton"))
+        self._event("rematch")
+        self._combat_started(rematch=True)
+        return True
 
-    def _detect_level_type(self, timeout: float = 45.0) -> str:
+    def _act_fight(self, state: ScreenState) -> bool:
         """
-        Detects the level type by searching in parallel:
-          - StartBattleButton → COMBAT
-          - StorySlide        → CINEMATIC
-          - SkipButton        → CINEMATIC (always present on slides)
-
-        First signal found wins immediately.
+        Auto combat: waits for FinishedPointer and clicks it.
+        Durations are learned only for combats we started (not joined midway).
         """
-        self._set_action("Detecting level type...")
-        logger.info("Detecting level type...")
+        learn, self._fresh_combat = self._fresh_combat, False
+        self._set_status("Combat in progress")
+        self._set_action("Waiting for end of combat...")
+        logger.info("Waiting for FinishedPointer...")
 
-        start = time.time()
-        while time.time() - start < timeout:
-            if self._find("StartBattleButton"):
-                logger.info("→ COMBAT (StartBattleButton found)")
-                return "combat"
-            if self._find("StorySlide"):
-                logger.info("→ CINEMATIC (StorySlide found)")
-                return "story"
-            if self._find("SkipButton"):
-                logger.info("→ CINEMATIC (SkipButton found)")
-                return "story"
-            time.sleep(0.3)
-
-        logger.warning(f"Level type not detected after {timeout}s → recovery requested")
-        self.recovery_requested = True
-        return "unknown"
+        coords = self._wait_combat_end(learn)
+        if not coords:
+            logger.warning(f"FinishedPointer not found after {self.config['combat_timeout']}s")
+            return False
+        self._event("combat_finished",
+                    time.monotonic() - self._combat_start if learn else None, learned=learn)
+        self._click(*coords)
+        logger.info("✓ Combat finished")
 
-    # ── CINEMATIC LEVEL HANDLING ───────────────────────────────
+        # Wait for post-combat animations and TAPs to load
+        self._wait_settled(2.0)
+        return True
 
-    def _handle_story_level(self):
+    def _act_results(self, state: ScreenState) -> bool:
         """
-        Cinematic level: Skip → Yes (confirm skip).
+        Results screen (victory): (TAPs) → OK → (TAPs) → OK → Yes (replay).
+        Same sequence whether we got here by the normal flow or a recovery.
         """
+        self._set_status("Results")
+        self._set_action("Results screen")
+        for step in range(2):
+            self._flush_taps()
+            if not self._wait_and_click("OkBattleButton", timeout=20):
+                return False
+            logger.info(f"✓ OkBattle step {step+1}")
+
+        self._set_action("Replay confirmation")
+        self._wait_settled(0.8)
+        if not self._wait_and_click("YesButton", timeout=30):
+            return False
+        logger.info("✓ Replay confirmed")
+
+        self.stats["loops"]     += 1
+        self.stats["completed"] += 1
+        self._level_completed("combat")
+        logger.info(f"✓✓ Combat done | Combats: {self.stats['loops']} | Total: {self.stats['completed']}")
+        self._set_status("Farming")
+        return True
+
+    def _act_skip(self, state: ScreenState) -> bool:
+        """Cinematic level: Skip → Yes (confirm skip)."""
         logger.info("─── Handling CINEMATIC level ───")
         self._set_status("Cinematic")
+        self._level_detected("cinematic")
 
-        # Step 1: Skip the cinematic
         self._set_action("Skip cinematic")
         self._click_skip()
-        logger.info("✓ Skip clicked (fixed coordinates)")
-
-        # Step 2: One Yes to confirm skip
-        time.sleep(0.5)
+        self._wait_settled(0.5)
         if not self._wait_and_click("YesButton", timeout=15):
             return False
         logger.info("✓ Skip confirmed")
 
         self.stats["story_levels"] = self.stats.get("story_levels", 0) + 1
+        self.stats["completed"] += 1
+        self._level_completed("cinematic")
+        logger.info(f"✓✓ Cinematic done | Total: {self.stats['completed']}")
+        self._set_status("Farming")
+        return True
+
+    def _act_back(self, state: ScreenState) -> bool:
+        """One screen back: in-game BackButton, else Escape."""
+        self._set_status("Recovering...")
+        back = self._find_with_confidence("BackButton", max(0.50, self.confidence - 0.25))
+        if back:
+            logger.info(f"Back via BackButton at {back}")
+            self._click(*back)
+        else:
+            logger.info("Back via Escape (no button found)")
+            self._send("press", "escape", self.window)
+        self._wait_settled(1.2)
         return True
 
+    def _act_go_home(self, state: ScreenState) -> bool:
+        """HomeButton if visible (one click to home), else one screen back."""
+        home = self._find("HomeButton")
+        if not home:
+            return self._act_back(state)
+        self._set_status("Recovering...")
+        logger.info(f"HomeButton visible → click at {home}")
+        self._click(*home)
+        self._wait_settled(1.5)
+        return True
+
+    # ── FLOW ENGINE HOOKS ──────────────────────────────────────
+
+    def _wait_screen(self, screens, timeout: float) -> ScreenState | None:
+        """Waits until one of `screens` is recognized (None on timeout / recovery request)."""
+        def arrived(frame):
+            state = self._screen(frame, screens)
+            return state if state.screen is not Screen.UNKNOWN else None
+
+        _, state, _ = self._wait_for(arrived, timeout=timeout, max_interval=0.5,
+                                     abort_on_recovery=True)
+        return state
+
+    def _recovery_request(self) -> bool:
+        """True once per anti-stuck recovery request (the flag is consumed)."""
+        requested, self.recovery_requested = self.recovery_requested, False
+        return requested
+
     # ── PLAY DEMO CHECKBOX VERIFICATION ───────────────────────
 
     def _ensure_demo_unchecked(self, timeout: float = 20.0) -> bool:
@@ -735,7 +1278,7 @@ class DBFarmer:
             elif winner == "DemoChecked":
                 logger.info(f"Play Demo checked — clicking to uncheck at {coords}")
                 self._click(*coords)
-                time.sleep(0.8)
+                self._wait_settled(0.8)
                 # Re-verify with _find_best
                 winner2, _ = self._find_best("DemoCheckmark", "DemoChecked")
                 if winner2 == "DemoCheckmark":
@@ -751,6 +1294,55 @@ class DBFarmer:
         self.recovery_requested = True
         return False
 
+    # ── END OF COMBAT MONITORING ───────────────────────────────
+
+    def _wait_combat_end(self, learn: bool = True) -> tuple | None:
+        """
+        Waits for FinishedPointer (max combat_timeout) and returns its coords, or None.
+
+        With learned durations (combat_adaptive), the wait is split in phases:
+          1. until earliest expected end - combat_lead: only the AUTO ON indicator
+             is checked (its learned region, every combat_slow_interval sec);
+             FinishedPointer is searched only when AUTO ON is gone
+          2. until the late expected end: FinishedPointer every combat_fast_interval
+          3. long tail: FinishedPointer every loop_delay (reference behaviour)
+        Times count from the Ready / Rematch click (_combat_start), the same
+        start as the combat_finished event.
+        learn=False for combats joined midway (smart recovery): nothing is
+        recorded and the start time is unknown, so phase 3 is used directly.
+        """
+        combat_max = self.config["combat_timeout"]
+        start = self._combat_start if learn else time.monotonic()
+        expected = self.combat_durations.expected(self._stage) if learn else None
+
+        phases = []
+        if self.config["combat_adaptive"] and expected:
+            earliest, typical, late = expected
+            logger.info(f"Expected combat end: ~{typical:.0f}s (earliest {earliest:.0f}s, late {late:.0f}s)")
+
+            def finished_early(frame):
+                if self._find("InCombatIndicator", frame):
+                    return None
+                return self._find("FinishedPointer", frame)
+
+            phases.append((earliest - self.config["combat_lead"], finished_early,
+                           self.config["combat_slow_interval"]))
+            phases.append((late * 1.2, "FinishedPointer", self.config["combat_fast_interval"]))
+        phases.append((combat_max, "FinishedPointer", self.loop_delay))
+
+        for until, condition, interval in phases:
+            remaining = min(until, combat_max) - (time.monotonic() - start)
+            if remaining <= 0:
+                continue
+            found, coords, _ = self._wait_for(condition, timeout=remaining, max_interval=interval)
+            if found:
+                duration = time.monotonic() - start
+                if learn:
+                    self.combat_durations.record(duration, self._stage)
+                    logger.info(f"Combat lasted {duration:.1f}s")
+                return coords
+        return None
+
     # ── FLUSH PENDING TAPS ─────────────────────────────────────
 
     def _flush_taps(self, max_taps: int = 10):
@@ -760,144 +1352,55 @@ class DBFarmer:
         """
         taps = 0
         while taps < max_taps:
-            time.sleep(0.5)
-            coords = self._find("TapArrow") or self._find("TapArrow2")
-            if coords:
-                self._click(*coords)
-                taps += 1
-                logger.info(f"✓ TAP #{taps} clicked at {coords}")
-            else:
-                # Wait a bit and re-check in case a new TAP appears
-                time.sleep(1.5)
-                coords = self._find("TapArrow") or self._find("TapArrow2")
-                if coords:
-                    self._click(*coords)
-                    taps += 1
-                    logger.info(f"✓ Late TAP #{taps} clicked at {coords}")
-                else:
-                    break  # Truly no more TAPs
+            # Late TAPs can take up to ~2s to show up, at the end of an animation:
+            # none once the screen has been still for 2 x settle_time
+            monitor = MotionMonitor(self.config["settle_motion"], self.config["stall_regions"])
+            still = 2 * self.config["settle_time"]
+            cond, coords, elapsed = self._wait_for("TapArrow", "TapArrow2",
+                                                   lambda frame: monitor.update(frame) >= still,
+                                                   timeout=2.0, max_interval=0.2)
+            if cond not in ("TapArrow", "TapArrow2"):
+                break  # Truly no more TAPs
+            self._click(*coords)
+            taps += 1
+            logger.info(f"✓ TAP #{taps} clicked at {coords} (after {elapsed:.1f}s)")
 
         if taps > 0:
             logger.info(f"✓ {taps} TAP(s) cleared")
         else:
             logger.debug("No TAP pending")
 
-    # ── COMBAT LEVEL HANDLING ──────────────────────────────────
-
-    def _handle_combat_level(self):
-        """
-        Combat level sequence:
-          [DemoCheckmark already visible on entry]
-          Demo → Start Battle → Team → Ready
-          → [auto combat] →
-          FinishedPointer → (TapArrow if present) → OkBattle → (TapArrow if present) → OkBattle
-          → Yes (replay) → [back to level detection]
-        """
-        logger.info("─── Handling COMBAT level ───")
-        self._set_status("Preparing combat")
-
-        # ── Demo: verify it's UNCHECKED before launching ───────
-        self._set_action("Demo checkmark")
-        if not self._ensure_demo_unchecked(timeout=20):
-            return False  # recovery_requested already set by _ensure_demo_unchecked
-        logger.info("✓ Demo unchecked, launching combat")
-
-        # ── Wait for StartBattleButton to be loaded ────────────
-        self._set_action("Waiting for StartBattle...")
-        if not self._wait_and_click("StartBattleButton", timeout=30):
-            return False  # recovery_requested already set by _wait_and_click
-        logger.info("✓ Start Battle clicked")
-
-        # ── Team selection + Ready ─────────────────────────────
-        self._select_team()
-        if self.recovery_requested:
-            return False
-
-        if not self._wait_and_click("ReadyButton", timeout=30):
-            return False
-        logger.info("✓ Ready")
-
-        # ── Wait for end of combat ─────────────────────────────
-        self.in_combat = True
-        self._set_status("Combat in progress")
-        self._set_action("Waiting for end of combat...")
-        logger.info("Waiting for FinishedPointer...")
-
-        combat_start = time.time()
-        combat_max   = self.config["combat_timeout"]  # 600s = 10 min
-
-        found = False
-        while time.time() - combat_start < combat_max:
-            if self._find("FinishedPointer"):
-                self._click(*self._find("FinishedPointer"))
-                found = True
-                break
-            time.sleep(self.loop_delay)
-
-        self.in_combat = False
-
-        if not found:
-            logger.warning(f"FinishedPointer not found after {combat_max}s → anti-stuck reactivated, recovery")
-            return False
-        logger.info("✓ Combat finished")
-
-        # Wait for post-combat animations and TAPs to load
-        time.sleep(2.0)
-
-        # ── Check victory or defeat ────────────────────────────
-        if self._find_with_confidence("RematchButton", min(0.90, self.confidence + 0.15)):
-            logger.info("✗ DEFEAT detected (RematchButton visible) → Rematch")
-            rematch = self._find_with_confidence("RematchButton", min(0.90, self.confidence + 0.15))
-            self._click(*rematch)
-            self.in_combat = True
-            self._set_status("Combat in progress (rematch)")
-            self._set_action("Waiting for end of combat (rematch)...")
-            logger.info("Waiting for FinishedPointer (rematch)...")
-
-            combat_start = time.time()
-            found = False
-            while time.time() - combat_start < combat_max:
-                if self._find("FinishedPointer"):
-                    self._click(*self._find("FinishedPointer"))
-                    found = True
-                    break
-                time.sleep(self.loop_delay)
-
-            self.in_combat = False
-            if not found:
-                logger.warning("FinishedPointer not found after rematch → recovery")
-                return False
-            logger.info("✓ Rematch combat finished")
-            time.sleep(2.0)
-
-        # ── Results screen (victory confirmed) ─────────────────
-        self.in_combat = True
-        self._set_action("Results screen")
-        for step in range(2):
-            self._flush_taps()
-            if not self._wait_and_click("OkBattleButton", timeout=20):
-                self.in_combat = False
-                return False
-            logger.info(f"✓ OkBattle step {step+1}")
-
-        # ── Replay confirmation ────────────────────────────────
-        self._set_action("Replay confirmation")
-        time.sleep(0.8)
-        if not self._wait_and_click("YesButton", timeout=30):
-            self.in_combat = False
-            return False
-        logger.info("✓ Replay confirmed")
+    # ── MAIN LOOP ──────────────────────────────────────────────
 
-        # ── Done: anti-stuck reactivated ───────────────────────
-        self.in_combat = False
-        logger.info("✓ Combat handled, back to level detection")
-        return True
+    def snapshot(self) -> dict:
+        """Copy of the stats (+ name, recoveries) for the orchestrator view."""
+        return {**self.stats, "name": self.name, "recoveries": self.flow.recoveries}
 
-    # ── MAIN LOOP ──────────────────────────────────────────────
+    def stop(self):
+        """Saves the learned regions and releases the capture and input."""
+        if self.input_queue is not None:
+            self.input_queue.close()
+        else:
+            self.input.close()
+        if self.regions:
+            self.regions.save(force=True)
+        (self.capture or self.frames).close()
+        if self.exporter:
+            self.exporter.close()
+        if self.events:
+            self._event("session_end", stats={k: v for k, v in self.stats.items()
+                                              if k not in ("status", "action")})
+            self.events.close()
+
+    def _overlay_data(self) -> dict:
+        if self.metrics is None:
+            return self.stats
+        return {**self.stats, "perf": self.metrics.summary()}
 
     def loop(self):
         """
-        Infinite loop: detect level type → handle → repeat.
+        Runs the farming flow (FARMING_FLOW) until CTRL+C.
+        From wherever the game is: home → story → levels, combat or cinematic.
         """
         logger.info("="*55)
         logger.info("  FARMING LOOP STARTED")
@@ -906,382 +1409,107 @@ class DBFarmer:
 
         while True:
             try:
-                # ── Check if anti-stuck requested a recovery ───
-                if self.recovery_requested:
-                    logger.warning("Recovery requested by anti-stuck → handling")
-                    self.recovery_requested = False
-                    self.in_combat = False  # Safety
-                    self._smart_recover()
-                    continue
-
-                level_type = self._detect_level_type(timeout=45)
-
-                if level_type == "story":
-                    logger.info("★ CINEMATIC level")
-                    success = self._handle_story_level()
-                    if success:
-                        self.stats["completed"] += 1
-                        logger.info(f"✓✓ Cinematic done | Total: {self.stats['completed']}")
-                    else:
-                        logger.warning("Cinematic failed → smart recovery")
-                        self._smart_recover()
-
-                elif level_type == "combat":
-                    logger.info("★ COMBAT level")
-                    success = self._handle_combat_level()
-                    if success:
-                        self.stats["loops"]     += 1
-                        self.stats["completed"] += 1
-                        logger.info(f"✓✓ Combat done | Combats: {self.stats['loops']} | Total: {self.stats['completed']}")
-                    else:
-                        logger.warning("Combat failed → smart recovery")
-                        self._smart_recover()
-
-                elif level_type == "unknown":
-                    logger.warning("Unknown level type after timeout → smart recovery")
-                    self._smart_recover()
-
-                time.sleep(0.5)
+                self.flow.run()
 
             except KeyboardInterrupt:
                 logger.info("Stop requested (CTRL+C)")
+                self.stop()
                 print("\n[DBFarmer] Stopped. Final stats:")
                 print(f"  Total completed  : {self.stats['completed']}")
                 print(f"    Combats        : {self.stats['loops']}")
                 print(f"    Cinematics     : {self.stats.get('story_levels', 0)}")
                 print(f"  Anti-stuck fixes : {self.stats['stuck_fixed']}")
-                print(f"  Recoveries       : {self.stats.get('recoveries', 0)}")
+                print(f"  Recoveries       : {self.flow.recoveries}")
+                if self.metrics:
+                    print(f"  Hot path         : {self.metrics.summary()}")
+                if self.detector.cache:
+                    c = self.detector.cache.stats()
+                    print(f"  Detection cache  : {c['hits']} hits / {c['misses']} misses "
+                          f"({c['hit_rate']:.0%}), {c['scenes']} scenes, {c['evictions']} evicted")
+                report = self.flow.timing_report()
+                if report:
+                    print("  Transition times :")
+                    for line in report:
+                        print(f"    {line}")
                 sys.exit(0)
 
             except Exception as e:
                 logger.error(f"Error in main loop: {e}", exc_info=True)
                 time.sleep(3)
 
-    # ── COMBAT DETECTION ───────────────────────────────────────
-
-    def _is_in_combat(self) -> bool:
-        """
-        Detects if we are currently in an active combat
-        by looking for the AUTO ON button (only visible during combat).
-        """
-        return self._find("InCombatIndicator") is not None
-
-    # ── SMART RECOVERY ─────────────────────────────────────────
-
-    def _smart_recover(self):
-        """
-        Detects the current screen and resumes from the right point
-        instead of always going back to the menu.
-
-        Priority order:
-          1. In combat (AUTO ON visible)  → quit combat then recover
-          2. OkBattleButton               → resume from results screen
-          3. ReadyButton                  → resume from Ready
-          4. StartBattleButton            → resume full combat sequence
-          5. SkipButton / StorySlide      → resume cinematic
-          6. TapArrow                     → flush taps and continue
-          7. YesButton                    → click and continue
-          8. StoryButton                  → setup()
-          9. Nothing recognized           → _recover_to_menu()
-        """
-        logger.warning("═══ SMART RECOVERY ═══")
-        self._set_status("Smart recovery...")
-        self.stats["recoveries"] = self.stats.get("recoveries", 0) + 1
-        self.in_combat = False
-        time.sleep(1.0)
-
-        # ── 1. In combat (AUTO ON visible) → wait for FinishedPointer ──
-        if self._is_in_combat():
-            logger.info("Smart recovery: AUTO ON detected → still in combat, waiting for FinishedPointer")
-            self.in_combat = True
-            self._set_action("Waiting for end of combat (smart recovery)...")
-            combat_start = time.time()
-            combat_max   = self.config["combat_timeout"]
-            found = False
-            while time.time() - combat_start < combat_max:
-                if self._find("FinishedPointer"):
-                    self._click(*self._find("FinishedPointer"))
-                    found = True
-                    break
-                time.sleep(self.loop_delay)
-            self.in_combat = False
-            if not found:
-                logger.warning("FinishedPointer not found after combat timeout → full recovery")
-                self._recover_to_menu()
-                return
-            time.sleep(2.0)
-            # Results screen
-            self.in_combat = True
-            for step in range(2):
-                self._flush_taps()
-                if not self._wait_and_click("OkBattleButton", timeout=20):
-                    self.in_combat = False
-                    self._recover_to_menu()
-                    return
-                logger.info(f"✓ OkBattle step {step+1}")
-            time.sleep(0.8)
-            self._wait_and_click("YesButton", timeout=30)
-            self.in_combat = False
-            logger.info("✓ Smart recovery: combat finished normally")
-            return
-
-        # ── 2. Results screen ──────────────────────────────────
-        if self._find("OkBattleButton"):
-            logger.info("Smart recovery: results screen → resuming from OkBattle")
-            self.in_combat = True
-            for step in range(2):
-                self._flush_taps()
-                if not self._wait_and_click("OkBattleButton", timeout=20):
-                    self.in_combat = False
-                    self._recover_to_menu()
-                    return
-                logger.info(f"✓ OkBattle step {step+1}")
-            time.sleep(0.8)
-            if not self._wait_and_click("YesButton", timeout=30):
-                self.in_combat = False
-                self._recover_to_menu()
-                return
-            self.in_combat = False
-            logger.info("✓ Smart recovery: results handled")
-            return
-
-        # ── 3. Ready screen → go back and restart from StartBattle ──
-        if self._find("ReadyButton"):
-            logger.info("Smart recovery: ReadyButton visible → going back to re-select team")
-            back = self._find_with_confidence("BackButton", max(0.50, self.confidence - 0.25))
-            if back:
-                self._click(*back)
-                time.sleep(1.2)
-                self._flush_taps()
-            else:
-                pyautogui.press("escape")
-                time.sleep(1.2)
-            # Now should be on StartBattle screen → full combat sequence
-            if self._find("StartBattleButton"):
-                logger.info("Smart recovery: StartBattle found after back → resuming full combat")
-                success = self._handle_combat_level()
-                if success:
-                    self.stats["loops"]     += 1
-                    self.stats["completed"] += 1
-                else:
-                    self._recover_to_menu()
-            else:
-                self._recover_to_menu()
-            return
-
-        # ── 4. Start Battle screen ─────────────────────────────
-        if self._find("StartBattleButton"):
-            logger.info("Smart recovery: StartBattle screen → resuming full combat")
-            success = self._handle_combat_level()
-            if success:
-                self.stats["loops"]     += 1
-                self.stats["completed"] += 1
-            else:
-                self._recover_to_menu()
-            return
-
-        # ── 5. Cinematic ───────────────────────────────────────
-        if self._find("SkipButton") or self._find("StorySlide"):
-            logger.info("Smart recovery: cinematic screen → resuming")
-            success = self._handle_story_level()
-            if success:
-                self.stats["completed"] += 1
-            else:
-                self._recover_to_menu()
-            return
-
-        # ── 6. TAP pending ─────────────────────────────────────
-        if self._find("TapArrow") or self._find("TapArrow2"):
-            logger.info("Smart recovery: TAP detected → flushing")
-            self._flush_taps()
-            return
-
-        # ── 7. Yes button ──────────────────────────────────────
-        if self._find("YesButton"):
-            logger.info("Smart recovery: YesButton detected → clicking")
-            self._click(*self._find("YesButton"))
-            return
-
-        # ── 8. Already on home screen ──────────────────────────
-        if self._find("StoryButton"):
-            logger.info("Smart recovery: already on home screen → setup")
-            self.recovery_requested = False
-            self.setup()
-            return
-
-        # ── 9. Nothing recognized → full recovery ──────────────
-        logger.warning("Smart recovery: screen not recognized → full recovery to menu")
-        self._recover_to_menu()
-
-    # ── RECOVERY TO MENU ───────────────────────────────────────
-
-    def _recover_to_menu(self, max_backs: int = 15) -> bool:
-        """
-        Tries to return to the main menu using:
-          1. BackButton  → in-game back button (highest priority)
-          2. HomeButton  → visible = click = goes directly to home
-          3. Escape      → if no in-game button found
-
-        Stops as soon as StoryButton is visible.
-        Once on home screen, relaunches setup().
-        """
-        logger.warning("═══ RECOVERY TO MENU ═══")
-        self._set_status("Recovering...")
-        self.stats["recoveries"] = self.stats.get("recoveries", 0) + 1
-
-        for attempt in range(max_backs):
-
-            # ── Already on home screen → relaunch setup ────────
-            if self._find("StoryButton"):
-                logger.info("✓ StoryButton visible → home screen reached")
-                time.sleep(1.0)
-                self.recovery_requested = False
-                self.setup()
-                if self.recovery_requested:
-                    logger.warning("Setup interrupted → new recovery attempt")
-                    continue
-                return True
-
-            # ── HomeButton visible → one click goes to home ────
-            home = self._find("HomeButton")
-            if home:
-                logger.info(f"✓ HomeButton visible → click at {home}")
-                self._click(*home)
-                time.sleep(1.5)
-                logger.info("✓ Home reached via HomeButton → relaunching setup")
-                self.recovery_requested = False
-                self.setup()
-                if self.recovery_requested:
-                    logger.warning("Setup interrupted → new recovery attempt")
-                    continue
-                return True
-
-            # ── BackButton visible → go back one screen ────────
-            back = self._find_with_confidence("BackButton", max(0.50, self.confidence - 0.25))
-            if back:
-                logger.info(f"Back #{attempt+1} via BackButton at {back}")
-                self._click(*back)
-                time.sleep(1.2)
-
-                # QuitBattle may appear after pressing back during combat
-                quit_btn = self._find("QuitBattleButton")
-                if quit_btn:
-                    logger.info("QuitBattle button found → clicking")
-                    self._click(*quit_btn)
-                    time.sleep(1.2)
-
-                # Flush all pending TAPs after back
-                self._flush_taps()
-
-                # Refuse possible confirmation
-                no = self._find("NoButton")
-                if no:
-                    self._click(*no)
-                    time.sleep(0.8)
-
-                continue
-
-            # ── No in-game button found → Escape ───────────────
-            logger.info(f"Back #{attempt+1} via Escape (no button found)")
-
-            # Flush TAPs before Escape
-            self._flush_taps()
-
-            pyautogui.press("escape")
-            time.sleep(1.2)
-
-        logger.error("Could not return to menu after multiple attempts")
-        return False
-
     # ── ANTI-STUCK (background thread) ────────────────────────
 
     def _anti_stuck_loop(self):
         """
-        Every X seconds, compares 2 screenshots.
-        If identical → game is stuck → smart click on highest priority button.
-        Also detects unrecognized screens (shop, popups) and requests recovery.
-        TAP buttons are clicked immediately without waiting for diff check.
+        Watches the screen in the background:
+          - every stall_check_interval → one motion sample (MotionMonitor);
+            screen static for stall_seconds → game is stuck → recovery
+            requested (the flow engine does the clicking)
+          - every anti_stuck_delay → TAP clicked immediately, unrecognized
+            screen (shop, popups) → recovery requested
+        Paused while an exclusive transition runs (combat, results screen).
         """
         time.sleep(5)  # Wait for game to launch
         logger.info("Anti-stuck started (background thread)")
 
+        last_check = time.monotonic()
         while True:
             try:
-                old_ss = self._screenshot()
-                time.sleep(self.config["anti_stuck_delay"])
-                new_ss = self._screenshot()
+                time.sleep(self.config["stall_check_interval"])
 
-                if old_ss is None or new_ss is None:
+                # Do not interfere during combat or results screen
+                if self.flow.exclusive:
+                    self.motion.reset()
                     continue
 
-                # Do not interfere during combat or results screen
-                if self.in_combat:
-                    logger.debug("Anti-stuck paused (combat in progress)")
+                frame = self._screenshot()
+                if frame is None:
                     continue
+                static  = self.motion.update(frame)
+                stalled = static >= self.config["stall_seconds"]
+                if not stalled and time.monotonic() - last_check < self.config["anti_stuck_delay"]:
+                    continue
+                # Every check below reads the same detection pass on this frame
+                state = self._screen(frame)
+                hits  = state.hits
 
-                # Compare the two screenshots
-                diff = cv2.absdiff(
-                    cv2.cvtColor(old_ss, cv2.COLOR_RGB2GRAY),
-                    cv2.cvtColor(new_ss, cv2.COLOR_RGB2GRAY)
-                )
-                diff_score = np.sum(diff)
+                # The flow clicked since this capture: its screen may be gone (a
+                # TAP clicked on it would hit the next screen) → check again
+                if self._last_action > frame.timestamp:
+                    continue
+                last_check = time.monotonic()
 
                 # ── Check for unrecognized screen ──────────────
-                on_known_screen = any([
-                    self._find("StartBattleButton"),
-                    self._find("StoryButton"),
-                    self._find("StorySlide"),
-                    self._find("SkipButton"),
-                    self._find("FinishedPointer"),
-                    self._find("OkBattleButton"),
-                    self._find("YesButton"),
-                    self._find("ReadyButton"),
-                    self._find("ContinueButton"),
-                    self._find("TapArrow"),
-                    self._find("TapArrow2"),
-                ])
-
-                # ── TAP detected → click immediately without waiting for diff ──
-                tap = self._find("TapArrow") or self._find("TapArrow2")
+                on_known_screen = state.screen is not Screen.UNKNOWN
+
+                # ── TAP detected → click immediately without waiting for a stall ──
+                tap = hits["TapArrow"][1] or hits["TapArrow2"][1]
                 if tap:
                     logger.info("Anti-stuck: TAP detected → immediate click")
                     self._click(*tap)
+                    self.motion.reset()
                     self.stats["stuck_fixed"] += 1
+                    self._event("anti_stuck_fix", fix="tap")
                     continue
 
                 if not on_known_screen:
                     logger.warning("Anti-stuck: unrecognized screen → recovery requested")
                     self.recovery_requested = True
+                    self.motion.reset()
                     self.stats["stuck_fixed"] += 1
+                    self._event("anti_stuck_fix", fix="recovery_request", reason="unknown_screen")
                     continue
 
-                if diff_score < 50000:
-                    logger.warning(f"Stuck detected! diff={diff_score}")
-                    self._set_status("Anti-stuck active")
-
-                    best_key    = None
-                    best_prio   = -1
-                    best_coords = None
-                    for key, prio in sorted(PRIORITY_LIST.items(), key=lambda x: -x[1]):
-                        coords = self._find(key)
-                        if coords:
-                            if prio > best_prio:
-                                best_prio   = prio
-                                best_key    = key
-                                best_coords = coords
-
-                    if best_key:
-                        logger.info(f"Anti-stuck: clicking [{best_key}] prio={best_prio}")
-                        self._click(*best_coords)
-                        self.stats["stuck_fixed"] += 1
-                    else:
-                        logger.warning("Anti-stuck: no button found → recovery requested")
-                        self.recovery_requested = True
-                        self.stats["stuck_fixed"] += 1
-
-                    self._set_status("Farming")
+                if stalled:
+                    # No click here: the flow may still be inside one of its own
+                    # waits; the recovery clicks from the recognized screen
+                    logger.warning(f"Stuck detected! Screen static for {static:.0f}s → recovery requested")
+                    self.recovery_requested = True
+                    self.motion.reset()
+                    self.stats["stuck_fixed"] += 1
+                    self._event("anti_stuck_fix", static, fix="recovery_request", reason="stall")
                 else:
-                    logger.debug(f"Anti-stuck OK, diff={diff_score}")
+                    logger.debug(f"Anti-stuck OK, screen static for {static:.0f}s")
 
             except Exception as e:
                 logger.error(f"Anti-stuck error: {e}")
@@ -1299,6 +1527,7 @@ class DBFarmer:
         print(f"  Images       : {self.image_folder}/")
         print(f"  Log          : {log_file}")
         print(f"  Window       : {self.config['window_name']}")
+        print(f"  Capture      : {self.frames.name}")
         print(f"  Confidence   : {self.confidence}")
         print()
         print("  Launch the game, go to the main menu")
@@ -1309,13 +1538,14 @@ class DBFarmer:
         print()
 
         # Activate BlueStacks window
-        try:
-            self.window.activate()
-            self.window.maximize()
-        except:
-            logger.warning("Could not activate/maximize window")
+        if self.window is not None:
+            try:
+                self.window.activate()
+                self.window.maximize()
+            except:
+                logger.warning("Could not activate/maximize window")
+            self.window_tracker.invalidate()
 
-        self.setup()
         self.loop()
 
 # ─────────────────────────────────────────────────────────────
@@ -1323,9 +1553,5 @@ class DBFarmer:
 # ─────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
-    pyautogui.FAILSAFE = True   # Mouse to top-left corner = emergency stop
-    pyautogui.PAUSE    = 0.05
-    pyautogui.useImageNotFoundException(False)
-
     farmer = DBFarmer()
     farmer.run()
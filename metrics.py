@@ -0,0 +1,211 @@
+"""
+DBFarmer v2 - Hot-path metrics
+Low-overhead timing histograms (screenshot, template match per image,
+click, flow transitions) exported in the Prometheus text format, to a file
+and / or a local HTTP endpoint, plus a one-line summary for the overlay.
+
+    metrics = Metrics()
+    with metrics.timer("screenshot"):
+        ...
+    metrics.observe("match", 0.012, key="SkipButton")
+    print(metrics.render())
+"""
+
+import os
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("DBFarmer")
+
+PREFIX = "dbfarmer_"
+
+# Bucket upper bounds (sec): 0.5 ms → 10 min, ~2.5x apart
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 150.0, 300.0, 600.0)
+
+# ─────────────────────────────────────────────────────────────
+#  HISTOGRAM
+# ─────────────────────────────────────────────────────────────
+
+class Histogram:
+    """Fixed buckets + count + sum: O(log buckets) per observation, no samples kept."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last = above the highest bound (+Inf)
+        self.count  = 0
+        self.sum    = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum   += seconds
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+# ─────────────────────────────────────────────────────────────
+#  REGISTRY
+# ─────────────────────────────────────────────────────────────
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name    = name
+        self.labels  = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Metrics:
+    """
+    Histograms by (name, labels). Thread-safe: one lock around each update.
+    Every name is exported as <PREFIX><name>_seconds.
+    """
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._hists = {}   # (name, ((label, value), ...)) -> Histogram
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._hists.get(key)
+            if hist is None:
+                hist = self._hists[key] = Histogram()
+            hist.observe(seconds)
+
+    def timer(self, name: str, **labels) -> _Timer:
+        """Context manager timing its block into `name`."""
+        return _Timer(self, name, labels)
+
+    def histograms(self) -> dict:
+        """Snapshot {(name, labels): Histogram copy} taken under the lock."""
+        with self._lock:
+            snap = {}
+            for key, hist in self._hists.items():
+                copy = Histogram(hist.bounds)
+                copy.counts, copy.count, copy.sum = list(hist.counts), hist.count, hist.sum
+                snap[key] = copy
+            return snap
+
+    def render(self) -> str:
+        """All histograms in the Prometheus text exposition format."""
+        lines, typed = [], set()
+        for (name, labels), hist in sorted(self.histograms().items()):
+            metric = f"{PREFIX}{name}_seconds"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            base = ",".join(f'{k}="{v}"' for k, v in labels)
+            cumulative = 0
+            for bound, n in zip(hist.bounds + (float("inf"),), hist.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'{metric}_bucket{{{base + "," if base else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{metric}_sum{suffix} {hist.sum:.6f}")
+            lines.append(f"{metric}_count{suffix} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top: int = 3) -> str:
+        """
+        One line for the overlay: screenshot / click means, then the images
+        that cost the most matching time (total), e.g.
+        "shot 38ms | click 61ms | match SkipButton 41ms, TapArrow 35ms"
+        """
+        per_name, matches = {}, []
+        for (name, labels), hist in self.histograms().items():
+            if name == "match":
+                matches.append((hist.sum, dict(labels).get("key", "?"), hist.mean))
+            elif not labels:
+                per_name[name] = hist.mean
+        parts = [f"{label} {per_name[name] * 1000:.0f}ms"
+                 for name, label in (("screenshot", "shot"), ("click", "click")) if name in per_name]
+        if matches:
+            worst = sorted(matches, reverse=True)[:top]
+            parts.append("match " + ", ".join(f"{key} {mean * 1000:.0f}ms" for _, key, mean in worst))
+        return " | ".join(parts)
+
+# ─────────────────────────────────────────────────────────────
+#  EXPORT
+# ─────────────────────────────────────────────────────────────
+
+class MetricsExporter:
+    """
+    Publishes a Metrics registry:
+      path → text file rewritten every `interval` seconds (node_exporter
+             textfile collector, or just `cat`)
+      port → http://127.0.0.1:<port>/metrics (local only)
+    """
+
+    def __init__(self, metrics: Metrics, path: str = "", port: int = 0, interval: float = 15.0):
+        self.metrics  = metrics
+        self.path     = path
+        self.interval = interval
+        self.server   = None
+        self._stop    = threading.Event()
+        if path:
+            threading.Thread(target=self._write_loop, name="metrics-file", daemon=True).start()
+            logger.info(f"Metrics written to {path} every {interval:g}s")
+        if port:
+            try:
+                self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+            except OSError as e:   # port taken (another instance?): the bot runs without it
+                logger.error(f"Metrics port {port} unavailable: {e}")
+                return
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info(f"Metrics served on http://127.0.0.1:{port}/metrics")
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass   # no access log in the bot log
+
+        return Handler
+
+    def write(self):
+        """Writes the text file now (atomically)."""
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.metrics.render())
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Metrics write error: {e}")
+
+    def _write_loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self._stop.set()
+        if self.path:
+            self.write()
+        if self.server:
+            self.server.shutdown()
@@ -0,0 +1,392 @@
+"""
+DBFarmer v2 - Multi-instance orchestrator
+Farms several BlueStacks instances from one controller: one worker per
+instance, reference images loaded once, one mouse click at a time and an
+aggregated view of every worker.
+
+instances.json:
+    {
+        "mode": "thread",
+        "status_interval": 30,
+        "instances": [
+            {"name": "bs1", "window_name": "BlueStacks App Player"},
+            {"name": "bs2", "window_name": "BlueStacks App Player 1",
+             "config": {"skip_position": {"mode": "relative", "x_pct": 0.82, "y_pct": 0.05}}},
+            {"name": "bs3", "window_name": "BlueStacks App Player 2", "cores": [4, 5]}
+        ]
+    }
+
+  mode     → "thread": every worker in this process (templates shared, least memory)
+             "process": one process per worker, pinned to its "cores" (pip install psutil)
+  config   → overrides of config.json for this instance only
+  cores    → CPU cores of the worker process ("process" mode only)
+
+Usage:
+    python orchestrator.py                      → instances.json
+    python orchestrator.py my_instances.json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import queue
+import signal
+import threading
+import multiprocessing
+
+import cv2
+
+from main import DBFarmer, Overlay, load_config, log_file
+from detection import load_templates
+
+logger = logging.getLogger("DBFarmer")
+
+INSTANCES_PATH = "instances.json"
+MODES          = ("thread", "process")
+LOG_FORMAT     = "%(asctime)s [%(levelname)s] [%(threadName)s] %(message)s"
+
+# ─────────────────────────────────────────────────────────────
+#  INSTANCES
+# ─────────────────────────────────────────────────────────────
+
+def load_instances(path: str) -> tuple[dict, list]:
+    """
+    Reads instances.json → (settings, instances).
+    Exits with a message if names or windows are not unique.
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    settings = {
+        "mode": data.get("mode", "thread"),
+        "status_interval": data.get("status_interval", 30),
+    }
+    if settings["mode"] not in MODES:
+        sys.exit(f"[ERROR] Unknown mode '{settings['mode']}' (expected {' / '.join(MODES)})")
+
+    instances = data.get("instances", [])
+    if not instances:
+        sys.exit(f"[ERROR] No instance in {path}")
+    names, windows = set(), set()
+    for i, spec in enumerate(instances):
+        spec.setdefault("name", f"bs{i+1}")
+        if spec["name"] in names:
+            sys.exit(f"[ERROR] Instance name '{spec['name']}' used twice")
+        names.add(spec["name"])
+        live = spec.get("config", {}).get("capture_backend") != "replay"
+        if live and spec.get("window_name"):
+            if spec["window_name"] in windows:
+                sys.exit(f"[ERROR] Window '{spec['window_name']}' used by two instances")
+            windows.add(spec["window_name"])
+    return settings, instances
+
+
+def instance_config(base: dict, spec: dict, index: int = 0) -> dict:
+    """
+    config.json + the instance overrides. Per-instance overlays are off (aggregated one instead).
+    Metrics exports inherited from config.json get one file / port per instance:
+    metrics.prom → metrics_<name>.prom, port → port + index (instance position).
+    """
+    config = json.loads(json.dumps(base))   # deep copy
+    own = spec.get("config", {})
+    config.update(own)
+    if spec.get("window_name"):
+        config["window_name"] = spec["window_name"]
+    config["overlay_enabled"] = False
+    if config.get("metrics_file") and "metrics_file" not in own:
+        root, ext = os.path.splitext(config["metrics_file"])
+        config["metrics_file"] = f"{root}_{spec.get('name', index)}{ext}"
+    if config.get("metrics_port") and "metrics_port" not in own:
+        config["metrics_port"] += index
+    return config
+
+
+def check_exports(configs: dict):
+    """Exits with a message if two instances export their metrics to the same port or file."""
+    for key in ("metrics_port", "metrics_file"):
+        used = {}
+        for name, config in configs.items():
+            value = config.get(key)
+            if value and value in used:
+                sys.exit(f"[ERROR] {key} {value} used by '{used[value]}' and '{name}'")
+            used[value] = name
+
+# ─────────────────────────────────────────────────────────────
+#  LOGGING
+# ─────────────────────────────────────────────────────────────
+
+class _WorkerFilter(logging.Filter):
+    """Keeps the records of one worker: its thread and the threads it started (name-*)."""
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.worker = name
+
+    def filter(self, record) -> bool:
+        return record.threadName == self.worker or record.threadName.startswith(self.worker + "-")
+
+
+def add_worker_log(name: str, session_log: str = None) -> str:
+    """Adds logs/<session>_<name>.log with the records of that worker only."""
+    path = os.path.splitext(session_log or log_file)[0] + f"_{name}.log"
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(_WorkerFilter(name))
+    logging.getLogger().addHandler(handler)
+    return path
+
+
+def pin_cores(cores: list):
+    """Pins the current process to `cores` and sizes OpenCV's thread pool to match."""
+    try:
+        import psutil
+        psutil.Process().cpu_affinity(list(cores))
+    except ImportError:
+        if not hasattr(os, "sched_setaffinity"):
+            logger.warning("psutil not installed (pip install psutil) → 'cores' ignored")
+            return
+        os.sched_setaffinity(0, cores)
+    cv2.setNumThreads(len(cores))
+    logger.info(f"Pinned to cores {list(cores)}")
+
+# ─────────────────────────────────────────────────────────────
+#  WORKERS
+# ─────────────────────────────────────────────────────────────
+
+class ThreadWorker:
+    """One farmer in a thread of this process (shared templates and input lock)."""
+
+    def __init__(self, name: str, config: dict, templates: tuple):
+        self.name      = name
+        self.config    = config
+        self.templates = templates
+        self.farmer    = None
+        self.error     = None
+        self.thread    = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.farmer = DBFarmer(self.config, self.name, self.templates)
+            self.farmer.loop()
+        except BaseException as e:   # sys.exit() when the window is missing
+            self.error = str(e) or type(e).__name__
+            logger.error(f"Worker stopped: {self.error}")
+
+    def snapshot(self) -> dict:
+        if self.farmer is not None:
+            snap = self.farmer.snapshot()
+        else:
+            snap = {"name": self.name, "status": "Starting"}
+        if self.error is not None:
+            snap["status"] = f"Stopped ({self.error})"
+        return snap
+
+    def stop(self):
+        if self.farmer is not None:
+            self.farmer.stop()
+
+
+def _join_session(session_log: str):
+    """
+    Worker process: logs to the orchestrator session log. A spawned process
+    re-imports main, which opened a log file of its own (removed if empty).
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.FileHandler) and \
+                handler.baseFilename != os.path.abspath(session_log):
+            root.removeHandler(handler)
+            handler.close()
+            try:
+                if os.path.getsize(handler.baseFilename) == 0:
+                    os.remove(handler.baseFilename)
+            except OSError:
+                pass
+            root.addHandler(logging.FileHandler(session_log, encoding="utf-8"))
+    for handler in root.handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+
+def _process_main(name: str, config: dict, cores, input_lock, snapshots, session_log: str, stop):
+    """
+    Entry point of a worker process: logs and events of the orchestrator
+    session, pinned cores, stats pushed every 2s. Runs until `stop` is set,
+    then stops the farmer (learned regions, metrics and events saved).
+    """
+    threading.current_thread().name = name
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # CTRL+C is handled by the orchestrator
+    _join_session(session_log)
+    add_worker_log(name, session_log)
+    if cores:
+        pin_cores(cores)
+
+    session = os.path.splitext(os.path.basename(session_log))[0]
+    farmer = DBFarmer(config, name, input_lock=input_lock, session=session)
+
+    def push():
+        while True:
+            snapshots.put(farmer.snapshot())
+            time.sleep(2.0)
+
+    threading.Thread(target=push, name=f"{name}-stats", daemon=True).start()
+    threading.Thread(target=farmer.loop, name=f"{name}-loop", daemon=True).start()
+    stop.wait()
+    logger.info("Stop requested by the orchestrator")
+    farmer.stop()
+    # Everything is saved: skip the interpreter teardown, which can abort
+    # while the daemon threads (loop, anti-stuck, capture) are inside OpenCV
+    logging.shutdown()
+    os._exit(0)
+
+
+class ProcessWorker:
+    """One farmer in its own process; stats come back through a queue."""
+
+    STOP_TIMEOUT = 10.0   # sec given to a worker to save and exit before it is terminated
+
+    def __init__(self, name: str, config: dict, cores, input_lock, snapshots):
+        self.name    = name
+        self.stopped = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_process_main, name=name, daemon=True,
+            args=(name, config, cores, input_lock, snapshots, log_file, self.stopped),
+        )
+        self.last = {"name": name, "status": "Starting"}
+
+    def start(self):
+        self.process.start()
+
+    def snapshot(self) -> dict:
+        if not self.process.is_alive() and self.process.exitcode is not None:
+            self.last["status"] = f"Stopped (exit code {self.process.exitcode})"
+        return self.last
+
+    def request_stop(self):
+        self.stopped.set()
+
+    def stop(self):
+        """Asks the worker to stop (saves and flushes), terminates it if it does not exit in time."""
+        self.request_stop()
+        self.process.join(self.STOP_TIMEOUT)
+        if self.process.is_alive():
+            logger.warning(f"[{self.name}] still running after {self.STOP_TIMEOUT:g}s → terminated")
+            self.process.terminate()
+
+# ─────────────────────────────────────────────────────────────
+#  AGGREGATED VIEW
+# ─────────────────────────────────────────────────────────────
+
+def aggregate(snaps: list) -> dict:
+    """One stats dict for the Overlay: totals + one status per instance."""
+    running = sum(1 for s in snaps if not str(s.get("status", "")).startswith("Stopped"))
+    return {
+        "status":      f"{running}/{len(snaps)} instances running",
+        "loops":       sum(s.get("loops", 0) for s in snaps),
+        "completed":   sum(s.get("completed", 0) for s in snaps),
+        "stuck_fixed": sum(s.get("stuck_fixed", 0) for s in snaps),
+        "action":      " | ".join(f"{s['name']}: {s.get('status', '...')}" for s in snaps),
+    }
+
+
+def print_status(snaps: list, start: float):
+    hours = max((time.monotonic() - start) / 3600, 1e-9)
+    print("="*78)
+    print(f"  {'Instance':<12} {'Status':<26} {'Done':>6} {'Combats':>8} {'Stuck':>6} {'Recov':>6} {'/hour':>7}")
+    for s in snaps:
+        done = s.get("completed", 0)
+        print(f"  {s['name']:<12} {str(s.get('status', '...'))[:26]:<26} {done:>6} "
+              f"{s.get('loops', 0):>8} {s.get('stuck_fixed', 0):>6} "
+              f"{s.get('recoveries', 0):>6} {done / hours:>7.1f}")
+    total = aggregate(snaps)
+    print(f"  {'TOTAL':<12} {total['status']:<26} {total['completed']:>6} "
+          f"{total['loops']:>8} {total['stuck_fixed']:>6} "
+          f"{sum(s.get('recoveries', 0) for s in snaps):>6} {total['completed'] / hours:>7.1f}")
+    print("="*78)
+
+# ─────────────────────────────────────────────────────────────
+#  MAIN
+# ─────────────────────────────────────────────────────────────
+
+def main_orchestrator(path: str):
+    settings, instances = load_instances(path)
+    base = load_config()
+    mode = settings["mode"]
+
+    threading.current_thread().name = "orchestrator"
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    logger.info(f"Orchestrator: {len(instances)} instance(s), mode={mode}")
+    configs = {spec["name"]: instance_config(base, spec, i) for i, spec in enumerate(instances)}
+    check_exports(configs)
+    workers = []
+    if mode == "thread":
+        # Reference images loaded once per (folder, pyramid scale) for every worker
+        shared = {}
+        for spec in instances:
+            config = configs[spec["name"]]
+            key = (config["image_folder"], config["pyramid_scale"])
+            if key not in shared:
+                images, templates, missing = load_templates(key[0], (key[1],),
+                                                            bundle=config["template_bundle"])
+                if missing:
+                    logger.warning(f"Missing images ({len(missing)}): {missing}")
+                shared[key] = (images, templates)
+            if spec.get("cores"):
+                logger.warning(f"[{spec['name']}] 'cores' is only applied in process mode")
+            logger.info(f"[{spec['name']}] log → {add_worker_log(spec['name'])}")
+            workers.append(ThreadWorker(spec["name"], config, shared[key]))
+    else:
+        input_lock = multiprocessing.Lock()
+        snapshots  = multiprocessing.Queue()
+        for spec in instances:
+            workers.append(ProcessWorker(spec["name"], configs[spec["name"]],
+                                         spec.get("cores"), input_lock, snapshots))
+
+    for worker in workers:
+        worker.start()
+
+    def snaps() -> list:
+        if mode == "process":
+            by_name = {w.name: w for w in workers}
+            while True:
+                try:
+                    snap = snapshots.get_nowait()
+                except queue.Empty:
+                    break
+                by_name[snap["name"]].last = snap
+        return [w.snapshot() for w in workers]
+
+    if base["overlay_enabled"]:
+        threading.Thread(target=lambda: Overlay(lambda: aggregate(snaps())).run(),
+                         name="overlay", daemon=True).start()
+
+    start = time.monotonic()
+    try:
+        while True:
+            time.sleep(settings["status_interval"])
+            print_status(snaps(), start)
+    except KeyboardInterrupt:
+        logger.info("Stop requested (CTRL+C)")
+        signal.signal(signal.SIGINT, signal.SIG_IGN)   # a second CTRL+C must not cut the saves
+        final = snaps()
+        if mode == "process":
+            for worker in workers:
+                worker.request_stop()   # every process saves at the same time
+        for worker in workers:
+            worker.stop()
+        print("\n[DBFarmer] Orchestrator stopped. Final stats:")
+        print_status(final, start)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    path = sys.argv[1] if len(sys.argv) > 1 else INSTANCES_PATH
+    if not os.path.exists(path):
+        print(f"[ERROR] {path} not found (format in the header of orchestrator.py)")
+        sys.exit(1)
+    main_orchestrator(path)
@@ -0,0 +1,165 @@
+"""
+DBFarmer v2 - Session report
+Turns event streams (logs/*.events.jsonl, see events.py) into throughput
+numbers, one column per session, to compare config changes.
+
+Usage:
+    python report.py logs/2026-10-18_13-21-37.events.jsonl
+    python report.py logs/*.events.jsonl                 → every session + total
+    python report.py logs/*.events.jsonl --json out.json
+"""
+
+import sys
+import glob
+import json
+import argparse
+
+import numpy as np
+
+from events import read_events
+
+# ─────────────────────────────────────────────────────────────
+#  STATS
+# ─────────────────────────────────────────────────────────────
+
+def session_stats(events: list) -> dict:
+    """Throughput of one session (or of several sessions pooled: pass them concatenated)."""
+    by_type = {}
+    for e in events:
+        by_type.setdefault(e["type"], []).append(e)
+
+    def count(type_):
+        return len(by_type.get(type_, []))
+
+    def durations(type_, **match):
+        return [e["duration"] for e in by_type.get(type_, [])
+                if e.get("duration") is not None and all(e.get(k) == v for k, v in match.items())]
+
+    # Farming time: from the first to the last event of each session and instance
+    spans = {}
+    for e in events:
+        key = (e["session"], e.get("instance"))
+        first, last = spans.get(key, (e["t"], e["t"]))
+        spans[key] = (min(first, e["t"]), max(last, e["t"]))
+    seconds = sum(last - first for first, last in spans.values())
+    hours = seconds / 3600
+
+    lost = sum(durations("recovery"))
+    levels = count("level_completed")
+    stats = {
+        "sessions": len(spans),
+        "hours": hours,
+        "levels": levels,
+        "levels_per_hour": levels / hours if hours else 0.0,
+        "combats": count("combat_finished"),
+        "combats_per_hour": count("combat_finished") / hours if hours else 0.0,
+        "defeats": count("defeat"),
+        "recoveries": count("recovery"),
+        "recovery_rate": count("recovery") / levels if levels else None,
+        "recovery_lost_s": lost,
+        "recovery_lost_pct": lost / seconds if seconds else 0.0,
+        "anti_stuck_fixes": count("anti_stuck_fix"),
+        "clicks": count("click"),
+        "cycle": {},
+    }
+    for kind in ("combat", "cinematic"):
+        values = durations("level_completed", kind=kind)
+        if values:
+            p50, p90, p95 = np.percentile(values, (50, 90, 95))
+            stats["cycle"][kind] = {"n": len(values), "p50": float(p50), "p90": float(p90), "p95": float(p95)}
+    combat = durations("combat_finished")
+    stats["combat_mean_s"] = float(np.mean(combat)) if combat else None
+    return stats
+
+
+def config_differences(sessions: dict) -> dict:
+    """{config key: [value per session]} for the keys that differ between sessions."""
+    configs = []
+    for events in sessions.values():
+        start = next((e for e in events if e["type"] == "session_start"), None)
+        configs.append((start or {}).get("config", {}))
+    keys = sorted({k for c in configs for k in c})
+    return {k: [c.get(k) for c in configs] for k in keys
+            if len({json.dumps(c.get(k), sort_keys=True) for c in configs}) > 1}
+
+# ─────────────────────────────────────────────────────────────
+#  OUTPUT
+# ─────────────────────────────────────────────────────────────
+
+def _cell(value, fmt: str = "{:.1f}") -> str:
+    return "-" if value is None else fmt.format(value)
+
+
+def print_report(columns: list[tuple[str, dict]], differences: dict):
+    width = 22
+    print("="*(26 + width * len(columns)))
+    print(f"  {'':<24}" + "".join(f"{name[-width+1:]:>{width}}" for name, _ in columns))
+    print("="*(26 + width * len(columns)))
+    rows = [
+        ("Hours",               lambda s: _cell(s["hours"], "{:.2f}")),
+        ("Levels completed",    lambda s: str(s["levels"])),
+        ("Levels / hour",       lambda s: _cell(s["levels_per_hour"])),
+        ("Combats / hour",      lambda s: _cell(s["combats_per_hour"])),
+        ("Combat mean (s)",     lambda s: _cell(s["combat_mean_s"])),
+        ("Defeats",             lambda s: str(s["defeats"])),
+    ]
+    for kind in ("combat", "cinematic"):
+        for p in ("p50", "p90", "p95"):
+            rows.append((f"Cycle {kind} {p} (s)",
+                         lambda s, k=kind, p=p: _cell(s["cycle"].get(k, {}).get(p))))
+    rows += [
+        ("Recoveries",          lambda s: str(s["recoveries"])),
+        ("Recoveries / level",  lambda s: _cell(s["recovery_rate"], "{:.3f}")),
+        ("Lost to recovery (s)", lambda s: _cell(s["recovery_lost_s"], "{:.0f}")),
+        ("Lost to recovery (%)", lambda s: _cell(s["recovery_lost_pct"] * 100)),
+        ("Anti-stuck fixes",    lambda s: str(s["anti_stuck_fixes"])),
+        ("Clicks",              lambda s: str(s["clicks"])),
+    ]
+    for label, cell in rows:
+        print(f"  {label:<24}" + "".join(f"{cell(s):>{width}}" for _, s in columns))
+
+    if differences:
+        print()
+        print("  Config differences:")
+        for key, values in differences.items():
+            print(f"  {key:<24}" + "".join(f"{json.dumps(v)[:width-2]:>{width}}" for v in values))
+    print()
+
+# ─────────────────────────────────────────────────────────────
+#  MAIN
+# ─────────────────────────────────────────────────────────────
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DBFarmer session report")
+    parser.add_argument("files", nargs="+", help="events.jsonl file(s) (wildcards allowed)")
+    parser.add_argument("--json", help="write the stats to this file")
+    args = parser.parse_args(argv)
+
+    paths = [p for pattern in args.files for p in (sorted(glob.glob(pattern)) or [pattern])]
+    try:
+        sessions = read_events(paths)
+    except OSError as e:
+        print(f"[ERROR] {e}")
+        return 1
+    if not sessions:
+        print("[ERROR] No event found")
+        return 1
+
+    columns = []
+    for (session, instance), events in sorted(sessions.items()):
+        name = session if instance == "main" else f"{session}/{instance}"
+        columns.append((name, session_stats(events)))
+    if len(sessions) > 1:
+        columns.append(("TOTAL", session_stats([e for events in sessions.values() for e in events])))
+
+    print_report(columns, config_differences(sessions) if len(sessions) > 1 else {})
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({name: stats for name, stats in columns}, f, indent=2)
+        print(f"  Report written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+DBFarmer v2 - Screen recognition
+Tells which game screen a frame shows from ONE detection pass, instead of
+probing the screen markers one capture at a time.
+"""
+
+import logging
+from enum import Enum
+
+from detection import Frame, Detector
+
+logger = logging.getLogger("DBFarmer")
+
+# ─────────────────────────────────────────────────────────────
+#  SCREENS
+# ─────────────────────────────────────────────────────────────
+
+class Screen(str, Enum):
+    HOME        = "home"
+    STORY_MENU  = "story_menu"    # story chapter screen (Continue)
+    STAGE       = "stage"         # combat level, before Start Battle
+    TEAM_SELECT = "team_select"
+    COMBAT      = "combat"        # auto combat running (or just finished)
+    RESULTS     = "results"
+    DEFEAT      = "defeat"
+    CINEMATIC   = "cinematic"
+    POPUP       = "popup"         # TAP / Yes / No / Quit battle over any screen
+    UNKNOWN     = "unknown"
+
+
+# Images identifying each screen, in PRECEDENCE order: when several screens
+# match on the same frame (overlays, transitions) the first one wins.
+SCREEN_MARKERS = {
+    Screen.COMBAT:      ("InCombatIndicator", "FinishedPointer"),
+    Screen.DEFEAT:      ("RematchButton",),
+    Screen.RESULTS:     ("OkBattleButton",),
+    Screen.TEAM_SELECT: ("ReadyButton", "LegendsPointer"),
+    Screen.STAGE:       ("StartBattleButton", "DemoCheckmark", "DemoChecked"),
+    Screen.CINEMATIC:   ("SkipButton", "StorySlide"),
+    Screen.POPUP:       ("TapArrow", "TapArrow2", "YesButton", "NoButton", "QuitBattleButton"),
+    Screen.STORY_MENU:  ("ContinueButton",),
+    Screen.HOME:        ("StoryButton",),
+}
+
+# Markers that only decide their screen when no marker of another screen
+# scores higher on the frame: ReadyButton looks like a dialog's Yes / No
+# buttons, and a team screen always shows LegendsPointer as well.
+WEAK_MARKERS = ("ReadyButton",)
+
+# ─────────────────────────────────────────────────────────────
+#  RECOGNIZER
+# ─────────────────────────────────────────────────────────────
+
+class ScreenState:
+    """
+    Result of one recognition:
+      screen     → the recognized Screen (UNKNOWN if no marker passed its threshold)
+      marker     → the image that decided it (None for UNKNOWN)
+      confidence → {Screen: best marker score}; UNKNOWN = 1 - best score overall
+      hits       → {key: (score, coords)} of every image scored on the frame
+    """
+
+    def __init__(self, screen: Screen, marker: str | None, confidence: dict, hits: dict):
+        self.screen     = screen
+        self.marker     = marker
+        self.confidence = confidence
+        self.hits       = hits
+
+    @property
+    def score(self) -> float:
+        return self.confidence.get(self.screen, 0.0)
+
+    def seen(self, key: str) -> tuple | None:
+        """ABSOLUTE coords of an image scored on this frame, None if not found."""
+        return self.hits.get(key, (0.0, None))[1]
+
+    def __repr__(self):
+        return f"<{self.screen.value} {self.score:.2f} via {self.marker}>"
+
+
+class ScreenRecognizer:
+    """
+    Scores every screen marker on the same frame and picks the screen.
+    thresholds = {key: confidence} overrides for images that need a
+    stricter (or looser) threshold than the detector's default.
+    weak = markers that lose to a higher scoring marker of a later screen
+    when they are the only one found for their screen (WEAK_MARKERS).
+    """
+
+    def __init__(self, detector: Detector, thresholds: dict = None, markers: dict = None,
+                 weak=WEAK_MARKERS):
+        self.detector   = detector
+        self.thresholds = thresholds or {}
+        self.markers    = markers or SCREEN_MARKERS
+        self.weak       = set(weak)
+
+    def _threshold(self, key: str) -> float:
+        return self.thresholds.get(key, self.detector.confidence)
+
+    def recognize(self, frame: Frame | None, screens=None, extra=()) -> ScreenState:
+        """
+        screens → only consider these screens (fewer images to score)
+        extra   → other images to score in the same pass (returned in hits)
+        """
+        screens = [s for s in self.markers if screens is None or s in screens]
+        keys = list(dict.fromkeys([k for s in screens for k in self.markers[s]] + list(extra)))
+        if frame is None:
+            hits = {key: (0.0, None) for key in keys}
+        else:
+            floor = min(self._threshold(key) for key in keys)
+            hits  = self.detector.detect(frame, keys, floor)
+            for key, (score, coords) in hits.items():
+                if coords and score < self._threshold(key):
+                    hits[key] = (score, None)
+
+        confidence = {}
+        candidates = []   # (screen, its best marker found, only weak markers found)
+        for screen in screens:
+            best = max(self.markers[screen], key=lambda k: hits[k][0])
+            confidence[screen] = hits[best][0]
+            seen = [k for k in self.markers[screen] if hits[k][1]]
+            if seen:
+                candidates.append((screen, max(seen, key=lambda k: hits[k][0]),
+                                   all(k in self.weak for k in seen)))
+        confidence[Screen.UNKNOWN] = 1.0 - max([0.0, *confidence.values()])
+
+        found, marker = Screen.UNKNOWN, None
+        for screen, key, weak in candidates:
+            if weak and any(hits[k][0] > hits[key][0] for _, k, _ in candidates):
+                continue
+            found, marker = screen, key
+            break
+
+        state = ScreenState(found, marker, confidence, hits)
+        logger.debug(f"Screen: {state}")
+        return state
@@ -0,0 +1,583 @@
+"""
+DBFarmer v2 - Game simulator
+A headless stand-in for DB Legends on BlueStacks, to run the bot end to end
+without an emulator: frames are built from the reference images of images/
+placed on generated backgrounds, following the story loop, and the game
+reacts to the bot's clicks and key presses.
+
+    home → Story → Continue → stage (Play Demo check) → Start Battle → team
+    → Ready → combat → FinishedPointer → TAPs → OK → OK → Yes → next level
+    cinematic level: Skip → Yes          defeat: Rematch → combat
+
+Injected trouble: transition latency, popups (Yes / No) over the menus,
+freezes (input ignored, frame static), defeats.
+Several instances can run in this process (templates shared, like the
+orchestrator thread mode). The run ends with the session report of their
+events (report.py) plus CPU use: levels/hour, recoveries and CPU per
+instance of a config, on this machine.
+
+The sim timings (combat length, latency) are its own: compare configs or
+commits with the same options, not against the real game.
+
+Usage:
+    python simulator.py                                  → 5 min, 1 instance
+    python simulator.py --minutes 30 --instances 3
+    python simulator.py --combat 20 40 --latency 0.8 --popup 0.05 --freeze 0.01 --defeat 0.1
+    python simulator.py --set match_engine=pyramid --set capture_fps=2 --json out.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+
+import cv2
+import numpy as np
+
+from detection import Frame, load_templates
+from frame_sources import FrameSource
+from input_backends import RecordingInput
+from events import read_events
+from report import session_stats, print_report
+from main import DBFarmer, REGIONS_PATH, load_config
+from orchestrator import LOG_FORMAT, instance_config
+
+logger = logging.getLogger("DBFarmer")
+
+SIZE = (1280, 720)   # (width, height) of the simulated window
+
+# Screen -> {image: CENTER (x, y)} of the images it shows.
+# Team slots and the greyed out Ready button are drawn apart (see _render).
+LAYOUT = {
+    "home":         {"StoryButton": (1050, 560)},
+    "story_menu":   {"ContinueButton": (1080, 640), "BackButton": (50, 40)},
+    "stage":        {"StartBattleButton": (1080, 650), "DemoCheckmark": (160, 660), "BackButton": (50, 40)},
+    "team":         {"LegendsPointer": (140, 110), "ReadyButton": (1090, 655), "BackButton": (50, 40)},
+    "combat":       {"InCombatIndicator": (1220, 50)},
+    "finished":     {"FinishedPointer": (640, 620)},
+    "taps":         {"TapArrow": (640, 660)},
+    "results":      {"OkBattleButton": (640, 640)},
+    "results2":     {"OkBattleButton": (900, 640)},   # moved: a double OK click misses
+    "replay":       {"NoButton": (480, 470), "YesButton": (800, 470)},
+    "cinematic":    {"SkipButton": (1050, 36), "StorySlide": (640, 640)},
+    "skip_confirm": {"NoButton": (480, 470), "YesButton": (800, 470)},
+    "defeat":       {"RematchButton": (640, 640)},
+    "popup":        {"NoButton": (480, 470), "YesButton": (800, 470)},
+    "quit":         {"QuitBattleButton": (480, 470), "NoButton": (800, 470)},
+}
+
+# Dialogs: drawn on a dimmed copy of the background, in a panel
+DIALOGS = ("replay", "skip_confirm", "popup", "quit")
+
+# (screen, image clicked) -> next screen. Pseudo screens:
+#   "level"  → next story level (cinematic or combat stage)
+#   "ended"  → combat over: defeat, TAPs or results
+#   "tap"    → one TAP less (results when none is left)
+#   "under"  → the screen under the popup
+CLICKS = {
+    ("home", "StoryButton"):          "story_menu",
+    ("story_menu", "ContinueButton"): "level",
+    ("story_menu", "BackButton"):     "home",
+    ("stage", "StartBattleButton"):   "team",
+    ("stage", "BackButton"):          "story_menu",
+    ("team", "ReadyButton"):          "combat",
+    ("team", "BackButton"):           "stage",
+    ("finished", "FinishedPointer"):  "ended",
+    ("taps", "TapArrow"):             "tap",
+    ("results", "OkBattleButton"):    "results2",
+    ("results2", "OkBattleButton"):   "replay",
+    ("replay", "YesButton"):          "level",
+    ("replay", "NoButton"):           "stage",
+    ("cinematic", "SkipButton"):      "skip_confirm",
+    ("skip_confirm", "YesButton"):    "level",
+    ("skip_confirm", "NoButton"):     "cinematic",
+    ("defeat", "RematchButton"):      "combat",
+    ("popup", "YesButton"):           "under",
+    ("popup", "NoButton"):            "under",
+    ("quit", "QuitBattleButton"):     "stage",
+    ("quit", "NoButton"):             "combat",
+}
+
+# Escape key: screen -> previous screen
+BACK = {
+    "story_menu":   "home",
+    "stage":        "story_menu",
+    "team":         "stage",
+    "combat":       "quit",
+    "popup":        "under",
+    "quit":         "combat",
+    "skip_confirm": "cinematic",
+}
+
+# Menus a popup can show up over
+POPUP_SCREENS = ("home", "story_menu", "stage")
+
+# Team slots: 6 portraits, 3 x 2
+SLOT_SIZE = 100
+SLOTS     = [(500 + 140 * (i % 3), 330 + 140 * (i // 3)) for i in range(6)]
+
+# ─────────────────────────────────────────────────────────────
+#  SIMULATED GAME
+# ─────────────────────────────────────────────────────────────
+
+class SimulatedGame(FrameSource):
+    """
+    The game as a frame source: grab() renders the current screen,
+    on_action(kind, *args) (RecordingInput hook) applies the bot's input.
+
+      latency        → sec a screen change takes (x 0.5-1.5), the current screen stays
+                       shown meanwhile and ignores input
+      combat         → (min, max) combat duration (sec)
+      cinematic      → share of cinematic levels
+      defeat         → share of combats lost
+      taps           → max TAPs after a combat (0 to taps)
+      demo           → chance Play Demo is checked on a stage
+      team_ready     → chance the team is already complete on the team screen
+      popup          → chance a popup covers a menu when it shows up
+      freeze         → chance a click freezes the game for freeze_seconds
+                       (click lost, static frame, input ignored)
+    Thread-safe: the capture and input threads of the farmer both call it.
+    """
+
+    name = "simulator"
+
+    def __init__(self, images: dict, latency: float = 0.3, combat: tuple = (8.0, 15.0),
+                 cinematic: float = 0.3, defeat: float = 0.0, taps: int = 2, demo: float = 0.05,
+                 team_ready: float = 0.5, popup: float = 0.0, freeze: float = 0.0,
+                 freeze_seconds: float = 20.0, seed: int = None):
+        self.images         = images
+        self.latency        = latency
+        self.combat         = combat
+        self.cinematic      = cinematic
+        self.defeat         = defeat
+        self.taps           = taps
+        self.demo           = demo
+        self.team_ready     = team_ready
+        self.popup          = popup
+        self.freeze         = freeze
+        self.freeze_seconds = freeze_seconds
+        self.rng            = random.Random(seed)
+        self._seed          = seed or 0
+        self._lock          = threading.Lock()
+
+        self.screen      = "home"
+        self._under      = None    # screen under the popup
+        self._pending    = None    # (time, screen) of the screen change in progress
+        self._frozen     = 0.0     # frozen until (monotonic)
+        self._combat_end = None
+        self._taps_left  = 0
+        self._demo_on    = False
+        self._selected   = set()   # selected team slots
+        self._last       = None    # last frame (shown while frozen)
+        self._closed     = False
+
+        self._backgrounds = {}
+        self._frames      = {}     # static screens, by state
+        self.render_cpu   = 0.0    # CPU sec spent rendering (not the bot's)
+        self.stats = {"levels": 0, "combats": 0, "cinematics": 0, "defeats": 0, "taps": 0,
+                      "popups": 0, "freezes": 0, "clicks": 0, "missed_clicks": 0, "presses": 0}
+
+        ready = images.get("ReadyButton")
+        self._ready_off = None
+        if ready is not None:
+            grey = cv2.cvtColor(cv2.cvtColor(ready, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+            self._ready_off = (grey * 0.7).astype(np.uint8)
+
+    @property
+    def region(self) -> tuple:
+        return (0, 0, *SIZE)
+
+    def config(self) -> dict:
+        """Config overrides matching this window (team slots, Skip position)."""
+        sx, sy = LAYOUT["cinematic"]["SkipButton"]
+        return {
+            "team_slots":    [{"x": x, "y": y} for x, y in SLOTS],
+            "skip_position": {"mode": "relative", "x_pct": sx / SIZE[0], "y_pct": sy / SIZE[1]},
+        }
+
+    # ── State ──────────────────────────────────────────────────
+
+    def _tick(self, now: float):
+        if self._pending and now >= self._pending[0]:
+            _, screen = self._pending
+            self._pending = None
+            self._enter(screen, now)
+        if self.screen == "combat" and self._combat_end and now >= self._combat_end:
+            self._combat_end = None
+            self.screen = "finished"
+
+    def _enter(self, screen: str, now: float, popup: bool = True):
+        if screen == "level":
+            if self.rng.random() < self.cinematic:
+                screen = "cinematic"
+            else:
+                screen = "stage"
+        if screen == "ended":
+            if self.rng.random() < self.defeat:
+                screen = "defeat"
+                self.stats["defeats"] += 1
+            else:
+                self._taps_left = self.rng.randint(0, self.taps)
+                screen = "taps" if self._taps_left else "results"
+        if screen == "tap":
+            self._taps_left -= 1
+            screen = "taps" if self._taps_left > 0 else "results"
+        if screen == "under":
+            screen, popup = self._under or "home", False
+
+        if screen == "combat" and self._combat_end is None:
+            self._combat_end = now + self.rng.uniform(*self.combat)
+        elif screen == "stage":
+            self._combat_end = None   # quit battle
+            self._demo_on = self.rng.random() < self.demo
+        elif screen == "team":
+            self._selected = set(range(len(SLOTS))) if self.rng.random() < self.team_ready else set()
+
+        if popup and screen in POPUP_SCREENS and self.rng.random() < self.popup:
+            self._under = screen
+            screen = "popup"
+            self.stats["popups"] += 1
+        self.screen = screen
+
+    def _go(self, screen: str, now: float):
+        """Screen change, shown after the latency (the current screen stays until then)."""
+        self._pending = (now + self.latency * self.rng.uniform(0.5, 1.5), screen)
+
+    def _visible(self) -> dict:
+        """{image: center} shown on the current screen."""
+        shown = dict(LAYOUT.get(self.screen, {}))
+        if self.screen == "stage" and self._demo_on:
+            shown["DemoChecked"] = shown.pop("DemoCheckmark")
+        return shown
+
+    def _hit(self, x: int, y: int) -> str | None:
+        """Image (or "slot<i>") under an absolute click."""
+        if self.screen == "team":
+            half = SLOT_SIZE // 2
+            for i, (sx, sy) in enumerate(SLOTS):
+                if abs(x - sx) <= half and abs(y - sy) <= half:
+                    return f"slot{i}"
+        for key, (cx, cy) in self._visible().items():
+            image = self.images.get(key)
+            if image is None:
+                continue
+            h, w = image.shape[:2]
+            if abs(x - cx) <= w // 2 and abs(y - cy) <= h // 2:
+                return key
+        return None
+
+    # ── Input (RecordingInput hook) ────────────────────────────
+
+    def on_action(self, kind: str, *args):
+        with self._lock:
+            now = time.monotonic()
+            self._tick(now)
+            if kind == "press":
+                self.stats["presses"] += 1
+                target = BACK.get(self.screen) if args and args[0] == "escape" else None
+                if target and now >= self._frozen and not self._pending:
+                    self._go(target, now)
+                return
+
+            self.stats["clicks"] += 1
+            if now < self._frozen or self._pending:
+                self.stats["missed_clicks"] += 1   # game busy: input ignored
+                return
+            key = self._hit(*args)
+            target = CLICKS.get((self.screen, key))
+            if key and key.startswith("slot"):
+                self._selected.add(int(key[4:]))
+                return
+            if key == "ReadyButton" and len(self._selected) < len(SLOTS):
+                target = None                       # greyed out
+            if key in ("DemoCheckmark", "DemoChecked"):
+                self._demo_on = not self._demo_on
+                return
+            if target is None:
+                self.stats["missed_clicks"] += 1
+                return
+            if self.rng.random() < self.freeze:
+                self._frozen = now + self.freeze_seconds
+                self.stats["freezes"] += 1
+                logger.debug(f"[sim] Freeze {self.freeze_seconds:g}s on {self.screen}")
+                return
+
+            if (self.screen, key) in (("replay", "YesButton"), ("skip_confirm", "YesButton")):
+                self.stats["levels"] += 1
+                self.stats["combats" if self.screen == "replay" else "cinematics"] += 1
+            if self.screen == "taps":
+                self.stats["taps"] += 1
+            logger.debug(f"[sim] {self.screen}: {key} → {target}")
+            self._go(target, now)
+
+    # ── Rendering ──────────────────────────────────────────────
+
+    def _background(self, name: str) -> np.ndarray:
+        """Smooth random background, one per screen (screens must not look alike)."""
+        bg = self._backgrounds.get(name)
+        if bg is None:
+            rng = np.random.default_rng([self._seed, sum(map(ord, name)) * 7919 + len(name)])
+            noise = rng.integers(0, 255, (SIZE[1] // 8, SIZE[0] // 8, 3), dtype=np.uint8)
+            bg = cv2.resize(cv2.GaussianBlur(noise, (5, 5), 0), SIZE, interpolation=cv2.INTER_CUBIC)
+            self._backgrounds[name] = bg
+        return bg
+
+    def _paste(self, img: np.ndarray, image: np.ndarray, center: tuple):
+        h, w = image.shape[:2]
+        x, y = center[0] - w // 2, center[1] - h // 2
+        img[y:y + h, x:x + w] = image
+
+    def _render(self, now: float) -> np.ndarray:
+        animated = self.screen == "combat"
+        key = (self.screen, self._under, self._demo_on, frozenset(self._selected))
+        if not animated:
+            cached = self._frames.get(self.screen)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+
+        if self.screen in DIALOGS:
+            under = self._under if self.screen == "popup" else self.screen
+            img = (self._background(under or "home") * 0.4).astype(np.uint8)
+            cv2.rectangle(img, (340, 220), (940, 530), (70, 60, 50), -1)
+            cv2.rectangle(img, (340, 220), (940, 530), (200, 200, 200), 3)
+        elif self.screen == "combat":
+            shift = int(now * 200) % SIZE[0]
+            img = np.roll(self._background("combat"), shift, axis=1)
+        else:
+            img = self._background(self.screen).copy()
+
+        for name, center in self._visible().items():
+            image = self.images.get(name)
+            if name == "ReadyButton" and len(self._selected) < len(SLOTS):
+                image = self._ready_off
+            if image is not None:
+                self._paste(img, image, center)
+
+        if self.screen == "team":
+            half = SLOT_SIZE // 2
+            for i, (x, y) in enumerate(SLOTS):
+                x0, y0 = x - half, y - half
+                portrait = self._background("portraits")[y0:y0 + SLOT_SIZE, x0:x0 + SLOT_SIZE]
+                if i in self._selected:
+                    portrait = cv2.add(portrait, (70, 70, 70, 0))
+                    cv2.rectangle(portrait, (0, 0), (SLOT_SIZE - 1, SLOT_SIZE - 1), (0, 220, 255), 6)
+                img[y0:y0 + SLOT_SIZE, x0:x0 + SLOT_SIZE] = portrait
+
+        if not animated:
+            self._frames[self.screen] = (key, img)
+        return img
+
+    def grab(self) -> Frame | None:
+        start = time.thread_time()
+        with self._lock:
+            if self._closed:
+                return None
+            now = time.monotonic()
+            self._tick(now)
+            if now >= self._frozen or self._last is None:
+                self._last = self._render(now)
+            bgr = self._last
+        self.render_cpu += time.thread_time() - start
+        return Frame(bgr, self.region)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+
+# ─────────────────────────────────────────────────────────────
+#  RUN
+# ─────────────────────────────────────────────────────────────
+
+# Config of every simulated instance: no overlay, nothing written where the
+# real setup reads it (the learned regions go to regions_sim<N>.json)
+SIM_CONFIG = {
+    "overlay_enabled": False,
+    "metrics_file":    "",
+    "metrics_port":    0,
+    "events":          True,     # the report is built from them
+}
+
+
+class SimulatedInstance:
+    """One farmer on its own simulated game, in a thread of this process."""
+
+    def __init__(self, name: str, config: dict, templates: tuple, game: SimulatedGame):
+        self.name      = name
+        self.config    = config
+        self.templates = templates
+        self.game      = game
+        self.farmer    = None
+        self.error     = None
+        self.ready     = threading.Event()
+        self.thread    = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.farmer = DBFarmer(self.config, self.name, self.templates,
+                                   frames=self.game, inputs=RecordingInput(self.game.on_action))
+            self.ready.set()
+            self.farmer.loop()
+        except BaseException as e:
+            self.error = str(e) or type(e).__name__
+            logger.error(f"Simulated instance stopped: {self.error}")
+        finally:
+            self.ready.set()
+
+
+def simulate(config: dict, minutes: float, instances: int = 1, seed: int = 0,
+             overrides: dict = None, status_interval: float = 30.0, **game_options) -> dict:
+    """
+    Runs `instances` farmers on simulated games for `minutes`
+    (CTRL+C ends the run early) and returns the results:
+      {"instances": {name: {"report": session_stats, "game": game stats, "bot": farmer stats}},
+       "wall_s", "cpu_s", "render_cpu_s", "bot_cpu_per_instance"}
+    CPU = process time (every thread) minus the time spent rendering frames.
+    """
+    images, templates, missing = load_templates(config["image_folder"], (config["pyramid_scale"],),
+                                                bundle=config["template_bundle"])
+    if missing:
+        logger.warning(f"Missing images ({len(missing)}): {missing} → not shown by the simulator")
+
+    runs = []
+    for i in range(instances):
+        # Every run learns the search regions from scratch (comparable runs)
+        regions = os.path.join(os.path.dirname(REGIONS_PATH), f"regions_sim{i + 1}.json")
+        if os.path.exists(regions):
+            os.remove(regions)
+        game = SimulatedGame(images, seed=seed + i, **game_options)
+        spec = {"name": f"sim{i + 1}", "config": {**SIM_CONFIG, **game.config(), **(overrides or {})}}
+        runs.append(SimulatedInstance(spec["name"], instance_config(config, spec, i),
+                                      (images, templates), game))
+
+    for run in runs:
+        run.start()
+        run.ready.wait(60)
+    cpu, wall = time.process_time(), time.monotonic()
+    logger.info(f"Simulation: {instances} instance(s) for {minutes:g} min")
+
+    try:
+        end = wall + minutes * 60
+        while time.monotonic() < end:
+            time.sleep(max(0.0, min(status_interval, end - time.monotonic())))
+            done = sum(run.game.stats["levels"] for run in runs)
+            print(f"[sim] {(time.monotonic() - wall) / 60:.1f} min | levels {done} | "
+                  + " | ".join(f"{run.name}: {run.game.screen}" for run in runs))
+    except KeyboardInterrupt:
+        print("[sim] Stopped early (CTRL+C)")
+
+    wall_s = time.monotonic() - wall
+    cpu_s  = time.process_time() - cpu
+    for run in runs:
+        if run.farmer is not None:
+            run.farmer.stop()
+    time.sleep(1.0)   # no frame after stop(): let the detection passes in progress end
+    render = sum(run.game.render_cpu for run in runs)
+
+    sessions = read_events([run.farmer.events.path for run in runs if run.farmer and run.farmer.events])
+    results = {
+        "wall_s": wall_s, "cpu_s": cpu_s, "render_cpu_s": render,
+        "bot_cpu_per_instance": (cpu_s - render) / instances / wall_s if wall_s else 0.0,
+        "instances": {},
+    }
+    for run in runs:
+        events = next((e for (_, name), e in sessions.items() if name == run.name), [])
+        results["instances"][run.name] = {
+            "report": session_stats(events) if events else None,
+            "game":   dict(run.game.stats),
+            "bot":    {k: v for k, v in run.farmer.stats.items() if k not in ("status", "action")}
+                      if run.farmer else {},
+            "error":  run.error,
+        }
+    return results
+
+
+def print_results(results: dict):
+    columns = [(name, r["report"]) for name, r in results["instances"].items() if r["report"]]
+    if columns:
+        print_report(columns, {})
+    for name, r in results["instances"].items():
+        g = r["game"]
+        print(f"  {name}: game {g['levels']} levels ({g['combats']} combats, {g['cinematics']} cinematics), "
+              f"{g['defeats']} defeats, {g['popups']} popups, {g['freezes']} freezes, "
+              f"{g['missed_clicks']}/{g['clicks']} clicks missed"
+              + (f" | ERROR: {r['error']}" if r["error"] else ""))
+    print(f"  CPU: {results['cpu_s']:.1f}s over {results['wall_s']:.0f}s "
+          f"(rendering {results['render_cpu_s']:.1f}s) → "
+          f"{results['bot_cpu_per_instance']:.1%} of a core per instance")
+    print()
+
+# ─────────────────────────────────────────────────────────────
+#  MAIN
+# ─────────────────────────────────────────────────────────────
+
+def _value(text: str):
+    """--set value: JSON if it parses (numbers, booleans, lists), else a string."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DBFarmer end-to-end run on a simulated game")
+    parser.add_argument("--minutes", type=float, default=5.0, help="run length (default 5)")
+    parser.add_argument("--instances", type=int, default=1, help="farmers run in this process (default 1)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the games")
+    parser.add_argument("--latency", type=float, default=0.3, help="screen change time (sec)")
+    parser.add_argument("--combat", type=float, nargs=2, default=(8.0, 15.0), metavar=("MIN", "MAX"),
+                        help="combat duration range (sec)")
+    parser.add_argument("--cinematic", type=float, default=0.3, help="share of cinematic levels")
+    parser.add_argument("--defeat", type=float, default=0.0, help="share of combats lost")
+    parser.add_argument("--taps", type=int, default=2, help="max TAPs after a combat")
+    parser.add_argument("--demo", type=float, default=0.05, help="chance Play Demo is checked")
+    parser.add_argument("--team-ready", type=float, default=0.5, help="chance the team is already complete")
+    parser.add_argument("--popup", type=float, default=0.0, help="chance of a popup over a menu")
+    parser.add_argument("--freeze", type=float, default=0.0, help="chance a click freezes the game")
+    parser.add_argument("--freeze-seconds", type=float, default=20.0, help="freeze length (sec)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="config override (repeatable), e.g. --set match_engine=pyramid")
+    parser.add_argument("--status", type=float, default=30.0, help="progress line every N sec")
+    parser.add_argument("--quiet", action="store_true", help="warnings only on the console")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.quiet:
+        for handler in logging.getLogger().handlers:
+            if type(handler) is logging.StreamHandler:
+                handler.setLevel(logging.WARNING)
+    if args.instances > 1:
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    config = load_config()
+    overrides = {}
+    for item in args.set:
+        key, sep, value = item.partition("=")
+        if not sep:
+            parser.error(f"--set {item}: expected KEY=VALUE")
+        overrides[key] = _value(value)
+
+    results = simulate(
+        config, args.minutes, args.instances, args.seed, overrides, args.status,
+        latency=args.latency, combat=tuple(args.combat), cinematic=args.cinematic,
+        defeat=args.defeat, taps=args.taps, demo=args.demo, team_ready=args.team_ready,
+        popup=args.popup, freeze=args.freeze, freeze_seconds=args.freeze_seconds,
+    )
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({**results, "options": vars(args)}, f, indent=2, default=str)
+        print(f"  Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())